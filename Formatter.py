@@ -1,11 +1,17 @@
 import os
 import sys
 import csv
+import glob
 import json
+import time
 import string
+import tracemalloc
 import importlib
+import multiprocessing
+from contextlib import contextmanager
+from itertools import groupby, islice, zip_longest
+from operator import itemgetter, methodcaller
 import xlrd
-from xlrd.sheet import ctype_text
 from openpyxl import Workbook, load_workbook
 from optparse import OptionParser
 
@@ -19,61 +25,363 @@ class SpreadsheetReader():
         self.filename = filename
         self.filename_prefix, self.type = os.path.splitext(filename)
 
-    def get_rows(self):
-        rows = []
+    def get_rows(self, skip_rows=0):
+        return list(self.iter_rows(skip_rows))
 
+
+    def get_columns(self, skip_rows=0):
+        '''
+        Return (columns, number of rows) - the data as a list of columns of cell values
+
+        .xls files are read a column at a time, the other types are read row-wise and transposed.
+        Rows shorter than the widest row are padded with None
+        '''
+        if self.type == '.xls':
+            book = xlrd.open_workbook(self.filename, on_demand=True)
+            try:
+                sheet = book.sheet_by_index(0)
+                columns = [self._xls_column(book, sheet, col, skip_rows) for col in range(sheet.ncols)]
+                num_rows = max(0, sheet.nrows - skip_rows)
+                book.unload_sheet(0)
+            finally:
+                book.release_resources()
+            return columns, num_rows
+
+        rows = self.get_rows(skip_rows)
+        return [list(column) for column in zip_longest(*rows)], len(rows)
+
+
+    def _xls_column(self, book, sheet, col, skip_rows=0):
+        '''
+        Read a column of an .xls sheet, from the row after the skipped ones
+        Dates are converted only if the column holds xldate cells, and once per distinct date
+        '''
+        values = sheet.col_values(col, start_rowx=skip_rows)
+        types = sheet.col_types(col, start_rowx=skip_rows)
+
+        if xlrd.XL_CELL_DATE not in types:
+            return values
+
+        dates = {value: None for value, type in zip(values, types) if type == xlrd.XL_CELL_DATE}
+        for value in dates:
+            dates[value] = xlrd.xldate.xldate_as_datetime(value, book.datemode)
+
+        return [dates[value] if type == xlrd.XL_CELL_DATE else value for value, type in zip(values, types)]
+
+
+    def iter_rows(self, skip_rows=0):
+        '''
+        Yield the rows one at a time without holding the whole sheet in memory
+        The first skip_rows rows are passed over without building their rows
+        '''
         if self.type == '.csv':
             with open(self.filename, newline='') as csvfile:
                 reader = csv.reader(csvfile, delimiter=',', quotechar='|')
-                for row in reader:
-                    rows.append(row)
+                for row in islice(reader, skip_rows, None):
+                    yield row
 
         if self.type == '.xlsx':
-            wb = load_workbook(self.filename)
+            wb = load_workbook(self.filename, read_only=True)
             ws = wb.worksheets[0]
-            for row in ws.iter_rows():
-                rows.append([cell.value for cell in row])
 
-        if self.type == '.xls':
-            book = xlrd.open_workbook(self.filename)
-            sheet = book.sheet_by_index(0)
+            # read-only mode trusts the dimension stored in the sheet, which may
+            # count trailing empty rows. Hold empty rows back until a non-empty one shows up
+            empty_rows = []
+            try:
+                if ws.max_column is None:
+                    # Sheets saved without their dimension(like the write-only output of SpreadsheetWriter) give
+                    # each row up to its last value only, they are padded with None to the widest row
+                    rows = [[cell.value for cell in row] for row in ws.iter_rows()]
+                    width = max((len(row) for row in rows), default=0)
+                    for row in rows:
+                        row.extend([None] * (width - len(row)))
+                    rows = rows[skip_rows:]
+                else:
+                    rows = ([cell.value for cell in row] for row in ws.iter_rows(min_row=skip_rows + 1))
+
+                for values in rows:
+                    if all(value is None for value in values):
+                        empty_rows.append(values)
+                        continue
+                    for empty_row in empty_rows:
+                        yield empty_row
+                    empty_rows = []
+                    yield values
+            finally:
+                wb.close()
 
-            rows = []
+        if self.type == '.xls':
+            book = xlrd.open_workbook(self.filename, on_demand=True)
+            try:
+                sheet = book.sheet_by_index(0)
 
-            for i in range(sheet.nrows):
-                row = []
-                for cell in sheet.row(i):
-                    if ctype_text.get(cell.ctype, 'unknown type') == 'xldate':
-                        value = xlrd.xldate.xldate_as_datetime(cell.value, book.datemode)
-                    else:
-                        value = cell.value
+                # Dates are converted only in the columns that hold xldate cells, and once per distinct date
+                date_cols = [col for col in range(sheet.ncols) if xlrd.XL_CELL_DATE in sheet.col_types(col)]
+                dates = {}
 
-                    row.append(value)
-                rows.append(row)
+                for i in range(skip_rows, sheet.nrows):
+                    row = sheet.row_values(i)
+                    if date_cols:
+                        types = sheet.row_types(i)
+                        for col in date_cols:
+                            if types[col] == xlrd.XL_CELL_DATE:
+                                value = row[col]
+                                if value not in dates:
+                                    dates[value] = xlrd.xldate.xldate_as_datetime(value, book.datemode)
+                                row[col] = dates[value]
+                    yield row
 
-        return rows
+                book.unload_sheet(0)
+            finally:
+                book.release_resources()
 
 
 
 class SpreadsheetWriter():
     '''
-    Create .xlsx files from rows data
+    Create .xlsx/.csv/.tsv files from rows data
     rows data is a 2D array - like the data that SpreadsheetReader.get_rows() returns
+
+    output_format: one of OUTPUT_FORMATS, the extension of the saved file
+    write_only: stream the .xlsx rows to a temporary file instead of keeping every cell in memory.
+    The rows are only ever appended, so it is the default. The .csv/.tsv rows are always written as they come,
+    to <output_path>.part which is renamed to output_path by save_file() - a failed run doesn't leave a
+    truncated output behind, discard() removes the partial file
     '''
 
-    def __init__(self, filename, output_sheet_name="Sheet1"):
+    OUTPUT_FORMATS = ['xlsx', 'csv', 'tsv']
+
+    def __init__(self, filename, output_sheet_name="Sheet1", write_only=True, output_format='xlsx'):
         self.filename_prefix, self.type = os.path.splitext(filename)
-        self.wb = Workbook()
         self.output_sheet_name = output_sheet_name
+        self.output_format = output_format
+
+        if self.output_format not in self.OUTPUT_FORMATS:
+            print('Unknown output format {}, expected one of {}'.format(self.output_format, self.OUTPUT_FORMATS))
+            sys.exit(-1)
+
+        self.output_path = self.filename_prefix + '.' + self.output_format
+
+        if self.output_format in ['csv', 'tsv']:
+            # Delimited text is written straight to the file, the sheet name doesn't apply
+            self.part_path = self.output_path + '.part'
+            self.fp = open(self.part_path, 'w', newline='')
+            self.writer = csv.writer(self.fp, delimiter='\t' if self.output_format == 'tsv' else ',')
+            self._append = self.writer.writerow
+            return
+
+        self.wb = Workbook(write_only=write_only)
+        if write_only:
+            self.ws = self.wb.create_sheet(title=self.output_sheet_name)
+        else:
+            self.ws = self.wb.worksheets[0]
+            self.ws.title = self.output_sheet_name
+        self._append = self.ws.append
 
     def set_rows(self, rows):
-        ws = self.wb.worksheets[0]
-        ws.title = self.output_sheet_name
+        append = self._append
         for row in rows:
-            ws.append(row)
+            append(row)
+
+    def append_row(self, row):
+        self._append(row)
 
     def save_file(self):
-        self.wb.save(filename = self.filename_prefix + '.xlsx')
+        if self.output_format in ['csv', 'tsv']:
+            self.fp.close()
+            os.replace(self.part_path, self.output_path)
+        else:
+            self.wb.save(filename = self.output_path)
+
+    def discard(self):
+        '''
+        Drop what was written so far, when the file can't be completed
+        '''
+        if self.output_format in ['csv', 'tsv']:
+            self.fp.close()
+            if os.path.exists(self.part_path):
+                os.remove(self.part_path)
+
+
+
+class ColumnTable():
+    '''
+    Column-oriented table of the rows data, used in the columnar mode of Formatter
+
+    The columns are lists of cell values, and the operations replace whole columns.
+    A column list is never modified in place, so the same list can be shared by many columns.
+    Rows shorter than the widest row are padded with None.
+    '''
+
+    def __init__(self, columns, num_rows):
+        self.columns = columns
+        self.num_rows = num_rows
+        self._empty_column = None
+        # The dictionary encodings of the columns by column-number, as (column, codes, values)
+        self._encodings = {}
+
+    @classmethod
+    def from_rows(cls, rows):
+        return cls([list(column) for column in zip_longest(*rows)], len(rows))
+
+    def delete_rows(self, row_nums):
+        '''
+        Delete the rows at the given indexes, the ones out of range are ignored
+        '''
+        row_nums = set(row_num for row_num in row_nums if 0 <= row_num < self.num_rows)
+        if not row_nums:
+            return
+
+        if row_nums == set(range(len(row_nums))):
+            # A leading run of rows, like the banner rows or the header
+            self.columns = [column[len(row_nums):] for column in self.columns]
+        else:
+            keep = [row_num for row_num in range(self.num_rows) if row_num not in row_nums]
+            self.columns = [[column[row_num] for row_num in keep] for column in self.columns]
+        self.num_rows -= len(row_nums)
+        self._empty_column = None
+        self._encodings = {}
+
+    def pop_row(self, row_num):
+        if row_num >= self.num_rows:
+            return []
+
+        row = [column[row_num] for column in self.columns]
+        self.delete_rows([row_num])
+        return row
+
+    def iter_rows(self):
+        if not self.columns:
+            return ([] for row_num in range(self.num_rows))
+        return zip(*self.columns)
+
+    def empty_column(self):
+        '''
+        A single column of '' shared by all the cleared columns
+        '''
+        if self._empty_column is None:
+            self._empty_column = [''] * self.num_rows
+        return self._empty_column
+
+    def delete_duplicate_rows(self, unique_key_cols):
+        '''
+        unique_key_cols: a list of keys, each key is a list of column-numbers
+        '''
+        if not unique_key_cols:
+            return
+
+        duplicate = [False] * self.num_rows
+
+        # Only the key columns are read, a key of many columns is a tuple of their values
+        for key_cols in unique_key_cols:
+            if len(key_cols) == 1:
+                keys = self.columns[key_cols[0]]
+            else:
+                keys = zip(*[self.columns[col] for col in key_cols])
+
+            seen = set()
+            for row_num, key in enumerate(keys):
+                if key in seen:
+                    duplicate[row_num] = True
+                else:
+                    seen.add(key)
+
+        keep = [row_num for row_num in range(self.num_rows) if not duplicate[row_num]]
+
+        if len(keep) < self.num_rows:
+            self.columns = [[column[row_num] for row_num in keep] for column in self.columns]
+            self.num_rows = len(keep)
+            self._empty_column = None
+            self._encodings = {}
+
+    def cutpaste(self, col, from_col):
+        self.columns[col] = self.columns[from_col]
+        self.columns[from_col] = self.empty_column()
+
+    def operations(self, operation_cols):
+        '''
+        Run the custom operations, a list of (column-number, function, column label), in their order.
+        A vectorized operation(see vectorized) is called once with its whole column,
+        the consecutive other ones are run over rows built once for all of them
+        '''
+        for column_op, group in groupby(operation_cols, key=lambda col_func: is_vectorized(col_func[1])):
+            if column_op:
+                for col, func, col_name in group:
+                    self.columns[col] = list(func(self.columns[col], col_name, True))
+            else:
+                self.row_operations(list(group))
+
+    def row_operations(self, operation_cols):
+        '''
+        Run the custom operations over rows built once for all of them
+        Only the operation columns are read back from the rows
+        '''
+        rows = [list(row) for row in self.iter_rows()]
+
+        for row_num, row in enumerate(rows):
+            for col, func, col_name in operation_cols:
+                row[col] = func(row[col], row, row_num)
+
+        for col, func, col_name in operation_cols:
+            self.columns[col] = [row[col] for row in rows]
+
+    def is_encoded(self, col):
+        encoding = self._encodings.get(col)
+        return encoding is not None and encoding[0] is self.columns[col]
+
+    def encoded(self, col):
+        '''
+        The (codes, values) dictionary encoding of a column(see encode_column)
+        It is kept until the column is replaced, the column lists are never modified in place
+        '''
+        if not self.is_encoded(col):
+            self._encodings[col] = (self.columns[col],) + encode_column(self.columns[col])
+
+        return self._encodings[col][1:]
+
+    def set_mapped_column(self, col, based_on_col, func):
+        '''
+        Set a column(a new one if col is the number of columns) to func(value) for each value of based_on_col.
+        func is called once per distinct value, and the column is encoded by the codes of based_on_col
+        '''
+        codes, values = self.encoded(based_on_col)
+        mapped = [func(value) for value in values]
+        column = [mapped[code] for code in codes]
+
+        if col == len(self.columns):
+            self.columns.append(column)
+        else:
+            self.columns[col] = column
+        self._encodings[col] = (column, codes, mapped)
+
+    def replace(self, col, table):
+        if self.is_encoded(col):
+            self.set_mapped_column(col, col, table.__getitem__)
+        else:
+            # A lookup per cell costs less than encoding the column first
+            self.columns[col] = [table[value] for value in self.columns[col]]
+
+    def replace_based_on(self, col, based_on_col, table, lookup):
+        self.set_mapped_column(col, based_on_col, lookup_replacement(table, lookup))
+
+    def clear(self, cols):
+        for col in cols:
+            self.columns[col] = self.empty_column()
+
+    def new_replace(self, based_on_col, table, lookup):
+        self.set_mapped_column(len(self.columns), based_on_col, lookup_replacement(table, lookup))
+
+    def concatenate(self, based_on_cols, join_string):
+        values = zip(*[self.columns[col] for col in based_on_cols])
+        self.columns.append([join_string.join([str(value) for value in row_values]) for row_values in values])
+
+    def drop(self, cols):
+        '''
+        cols should be in descending order
+        '''
+        for col in cols:
+            del self.columns[col]
+        self._encodings = {}
 
 
 
@@ -86,16 +394,133 @@ class FormatterOptions:
     format = None
     input_path = None
     output_sheet_name = None
-    def __init__(self, format, input_path, output_sheet_name="Sheet1"):
+    streaming = False
+    columnar = False
+    output_format = 'xlsx'
+    profile = False
+    def __init__(self, format, input_path, output_sheet_name="Sheet1", streaming=False, columnar=False,
+                 output_format='xlsx', profile=False):
         self.format = format
         self.input_path = input_path
         self.output_sheet_name = output_sheet_name
+        self.streaming = streaming
+        self.columnar = columnar
+        self.output_format = output_format
+        self.profile = profile
+
+
+
+class ExecutionPlan:
+    '''
+    A format specification compiled by compile_plan()
+
+    steps: a flat list of row-level functions, step(row, row_num) modifies the row in place
+    column_steps: the same steps as functions of a ColumnTable, step(table) modifies whole columns
+    unique_keys: functions that read the key of a row, for the deletion of duplicate rows
+    unique_key_cols: the column-numbers of each of the unique_keys
+    new_header_titles: the header titles of the new columns
+    drop_cols: the column-numbers to be deleted, in descending order
+    '''
+
+    def __init__(self, steps, column_steps, unique_keys, unique_key_cols, new_header_titles, drop_cols):
+        self.steps = steps
+        self.column_steps = column_steps
+        self.unique_keys = unique_keys
+        self.unique_key_cols = unique_key_cols
+        self.new_header_titles = new_header_titles
+        self.drop_cols = drop_cols
+
+
+
+class StageProfiler():
+    '''
+    Record the wall time, CPU time, rows in/out and peak memory(from tracemalloc) of the stages of a run
+
+    A disabled profiler(the default) runs the stages without measuring anything.
+    tracemalloc slows python down noticeably, so the stage timings of a profiled run
+    are only comparable to other profiled runs
+    '''
+
+    def __init__(self, name='', enabled=False):
+        self.name = name
+        self.enabled = enabled
+        self.stages = []
+        self._started_tracing = False
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        '''
+        Measure the code in the 'with' block as the stage 'name'
+        The block can set the row count after the stage with record['rows_out'] = ...
+        peak_memory_bytes is the peak of the memory traced during the stage, including what was allocated before it
+        '''
+        record = {'stage': name, 'rows_in': rows_in, 'rows_out': None}
+
+        if not self.enabled:
+            yield record
+            return
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        tracemalloc.reset_peak()
+
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+        finally:
+            record['wall_seconds'] = round(time.perf_counter() - wall_start, 6)
+            record['cpu_seconds'] = round(time.process_time() - cpu_start, 6)
+            record['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+            self.stages.append(record)
+
+    def run(self, name, func, count_rows):
+        '''
+        Run func() as the stage 'name', count_rows() gives the number of rows before and after it
+        '''
+        if not self.enabled:
+            func()
+            return
+
+        with self.stage(name, count_rows()) as record:
+            func()
+            record['rows_out'] = count_rows()
+
+    def stop(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def report(self):
+        return {
+            'name': self.name,
+            'wall_seconds': round(sum(record['wall_seconds'] for record in self.stages), 6),
+            'cpu_seconds': round(sum(record['cpu_seconds'] for record in self.stages), 6),
+            'peak_memory_bytes': max([record['peak_memory_bytes'] for record in self.stages] or [0]),
+            'stages': self.stages
+        }
+
+    def save(self, path):
+        with open(path, 'w') as fp:
+            json.dump(self.report(), fp, indent=3)
+
+    def print_table(self, file=sys.stderr):
+        row_format = '{:<28} {:>10} {:>10} {:>10} {:>10} {:>12}'
+        print(row_format.format('stage', 'wall s', 'cpu s', 'rows in', 'rows out', 'peak KB'), file=file)
+        for record in self.stages + [dict(self.report(), stage='total', rows_in=None, rows_out=None)]:
+            print(row_format.format(record['stage'][:28],
+                                    '{:.3f}'.format(record['wall_seconds']),
+                                    '{:.3f}'.format(record['cpu_seconds']),
+                                    '' if record['rows_in'] is None else record['rows_in'],
+                                    '' if record['rows_out'] is None else record['rows_out'],
+                                    '{:.1f}'.format(record['peak_memory_bytes'] / 1024)), file=file)
 
 
 
 class Formatter():
     '''
-    Format .csv/.xls/.xlsx files into desired format and save as .xlsx
+    Format .csv/.xls/.xlsx files into desired format and save as .xlsx(or .csv/.tsv)
 
     options.input_path: the file that has to be formatted
 
@@ -107,9 +532,21 @@ class Formatter():
     <root_dir>/formats/xyz.json
     
     options.output_sheet_name: the name of the sheet in the output file
+
+    options.streaming: read, format and write the rows one at a time
+    instead of loading the whole file in memory
+
+    options.columnar: hold the data as a ColumnTable and format whole columns at a time
+
+    options.output_format: xlsx(default), csv or tsv
+
+    options.profile: record the time, rows and memory of each stage in self.profiler
+
+    c, plan: the loaded format and its ExecutionPlan, to reuse them across files.
+    They are loaded and compiled by run() when not given
     '''
 
-    def __init__(self, options):
+    def __init__(self, options, c=None, plan=None):
         self.options = options
         
         # The input file data        
@@ -122,180 +559,87 @@ class Formatter():
         if not self.options.output_sheet_name:
             self.options.output_sheet_name = "Sheet1"
 
+        if not getattr(self.options, 'output_format', None):
+            self.options.output_format = 'xlsx'
+
         # The output file data
-        self.out_spreadsheet = SpreadsheetWriter(out_filename, output_sheet_name=self.options.output_sheet_name)
+        self.out_spreadsheet = SpreadsheetWriter(out_filename, output_sheet_name=self.options.output_sheet_name,
+                                                 output_format=self.options.output_format)
 
-        # The format configuration
-        self.c = {}
+        # The format configuration and its execution plan
+        self.c = c if c is not None else {}
+        self.plan = plan
 
         # 'header_row' and 'data' together is the whole file data
         self.header_row = []
         self.data = []
 
-        # operations_module is a python file in the <root_dir>/operations directory
-        # which contains the custom operations specific to a format
-        try:
-            self.operations_module = importlib.import_module('operations.' + self.options.format)
-        except Exception as e:
-            try:
-                # Fixme: This inner try-except is there to support testing
-                # Could find a way to avoid this
-                parentPath = os.path.abspath("..")
-                if parentPath not in sys.path:
-                    sys.path.insert(0, parentPath)
-                self.operations_module = importlib.import_module('operations.' + self.options.format.split(os.sep)[-1])
-            except Exception as e:
-                pass    
- 
-
-    def _drop_columns(self):
-        '''
-        Delete columns
-        '''
-        if 'columns' not in self.c:
-            return
+        # Number of rows read from the input file and number of data rows written to the output file
+        self.rows_in = 0
+        self.rows_out = 0
 
-        drop_cols = [col2num(col) for col in self.c['columns'] if self.c['columns'][col]=='drop']
+        self.profiler = StageProfiler(self.options.input_path, enabled=getattr(self.options, 'profile', False))
 
-        #Required because: After deletion of col #n, we have col #n+1 now at #n position
-        drop_cols.sort(reverse=True)
+        # operations_module is a python file in the <root_dir>/operations directory
+        # which contains the custom operations specific to a format
+        if self.plan is None:
+            self.operations_module = import_operations_module(self.options.format)
 
-        for row in self.data:
-            for col in drop_cols:
-                del row[col]
 
-        for col in drop_cols:
-            del self.header_row[col]
+    def _compile_plan(self):
+        self.plan = compile_plan(self.c, self.operations_module)
 
 
-    def _create_new_columns(self):
+    def _is_duplicate_row(self, row, seen_keys):
         '''
-        Add new columns at the end
+        Check the row against the keys found so far
+        seen_keys holds a set per unique key and is updated with the new keys found in the row
         '''
+        duplicate = False
 
-        if 'new_columns' not in self.c:
-            return
-
-        replace_based_on_cols = {}
-        concat_based_on_cols = {}
-        new_header_titles = []
-
-        for new_col_def in self.c['new_columns']:
-            if 'action' in self.c['new_columns'][new_col_def] and self.c['new_columns'][new_col_def]['action'] == "replace":
-                    if 'based_on' in self.c['new_columns'][new_col_def]:
-                        replace_based_on_cols[new_col_def] = self.c['new_columns'][new_col_def]
-                        if 'has_header_row' in self.c and self.c['has_header_row'] and self.header_row:
-                            new_header_titles.append(self.c['new_columns'][new_col_def]['header_title'])
-            if 'action' in self.c['new_columns'][new_col_def] and self.c['new_columns'][new_col_def]['action'] == "concatenate":
-                    if 'based_on' in self.c['new_columns'][new_col_def]:
-                        concat_based_on_cols[new_col_def] = self.c['new_columns'][new_col_def]
-                        if 'has_header_row' in self.c and self.c['has_header_row'] and self.header_row:
-                            new_header_titles.append(self.c['new_columns'][new_col_def]['header_title'])
-
-        for row in self.data:
-            for col in replace_based_on_cols:
-                try:
-                    row.append(replace_based_on_cols[col]['with'][str(row[col2num(replace_based_on_cols[col]['based_on'])])])
-                except Exception as e:
-                    # sometimes while reading from csv integers are read as floats (20 as 20.0), this could cause dict KeyErrors
-                    if isfloat(str(row[col2num(replace_based_on_cols[col]['based_on'])])):
-                        row.append(replace_based_on_cols[col]['with'][str(int(row[col2num(replace_based_on_cols[col]['based_on'])]))])
-                    else:
-                        print(e)
-                        sys.exit(-1)
-            for col in concat_based_on_cols:
-                row.append(concat_based_on_cols[col]['join_string'].join([str(row[col2num(c)]) for c in concat_based_on_cols[col]['based_on']]))
-
-                    
-        for header_title in new_header_titles:
-            self.header_row.append(header_title)
-
-
-    def _process_columns(self):
-        '''
-        Perform operations based on columns
-        '''
-        if 'columns' not in self.c:
-            return
-
-        # Gather column-numbers for the deletion of rows based on column-uniqueness
-        unique_cols = [col2num(col) for col in self.c['columns'] if self.c['columns'][col]=='unique']
+        for get_key, seen in zip(self.plan.unique_keys, seen_keys):
+            key = get_key(row)
+            if key in seen:
+                duplicate = True
+            else:
+                seen.add(key)
 
-        colnum_vals_map = {} #colnum: values found in the column
-        rows_to_be_deleted = []
+        return duplicate
 
-        # Gather row-numbers that have duplicates as per 'unique_cols'
-        for row_num, row in enumerate(self.data):
-            for col in unique_cols:
-                if col in colnum_vals_map:
-                    if row[col] in colnum_vals_map[col]:
-                        rows_to_be_deleted.append(row_num)
-                    else:
-                        colnum_vals_map[col].append(row[col])
-                else:
-                    colnum_vals_map[col] = [row[col]]
 
-        # Required because: After deletion of row #n, we have row #n+1 now at #n position
-        rows_to_be_deleted.sort(reverse=True)
+    def _delete_duplicate_rows(self):
+        '''
+        Delete rows that have duplicates as per 'unique_keys', in a single pass
+        '''
+        if not self.plan.unique_keys:
+            return
 
-        # Delete duplicate rows
-        for row_num in rows_to_be_deleted:
-            del self.data[row_num]
+        seen_keys = [set() for get_key in self.plan.unique_keys]
+        self.data = [row for row in self.data if not self._is_duplicate_row(row, seen_keys)]
 
 
-        # Gather info for custom operations, replacements, cut-pastes and clearing
-        operation_cols = {}
-        name_func_map = {}
-        replace_cols = {}
-        replace_based_on_cols = {}
-        cut_paste_cols = {}
+    def _execute_plan(self):
+        '''
+        Run every row through the steps of the plan
+        '''
+        steps = self.plan.steps
 
-        for col in self.c['columns']:
-            if isinstance(self.c['columns'][col], dict):
-                if self.c['columns'][col]['action'] == 'operation':
-                    operation_cols[col2num(col)] = {'function': self.c['columns'][col]['function']}
-                    try:
-                        name_func_map[self.c['columns'][col]['function']] = getattr(self.operations_module, self.c['columns'][col]['function'])
-                    except Exception as e:
-                        print('Error while reading definition of the custom operation {}'.format(self.c['columns'][col]['function']))
-                        sys.exit(-1)
-                if self.c['columns'][col]['action'] == 'replace':
-                    if 'based_on' in self.c['columns'][col]:
-                        replace_based_on_cols[col2num(col)] = self.c['columns'][col]
-                    else:
-                        replace_cols[col2num(col)] = {'with': self.c['columns'][col]['with']}
-                if self.c['columns'][col]['action'] == 'cutpaste':
-                    cut_paste_cols[col2num(col)] = col2num(self.c['columns'][col]['from'])
-
-        clear_cols = [col2num(col) for col in self.c['columns'] if self.c['columns'][col]=='clear']
-
-
-        #Perform custom operations, replacements, cut-pastes and clearing
         for row_num, row in enumerate(self.data):
+            for step in steps:
+                step(row, row_num)
 
-            for col in cut_paste_cols:
-                row[col] = row[cut_paste_cols[col]]
-                row[cut_paste_cols[col]] = ''
 
-            for col in operation_cols:
-                row[col] = name_func_map[operation_cols[col]['function']](row[col], row, row_num)
-
-            for col in replace_cols:
-                row[col] = replace_cols[col]['with'][row[col]]
+    def _process_header_columns(self):
+        '''
+        Add the titles of the new columns to the header and delete the dropped columns from it
+        '''
+        if not self.header_row:
+            return
 
-            for col in replace_based_on_cols:
-                try:
-                    row[col] = replace_based_on_cols[col]['with'][str(row[col2num(replace_based_on_cols[col]['based_on'])])]
-                except Exception as e:
-                    # sometimes while reading from csv integers are read as floats (20 as 20.0), this could cause dict KeyErrors
-                    if isfloat(str(row[col2num(replace_based_on_cols[col]['based_on'])])):
-                        row[col] = replace_based_on_cols[col]['with'][str(int(row[col2num(replace_based_on_cols[col]['based_on'])]))]
-                    else:
-                        print(e)
-                        sys.exit(-1)
+        self.header_row.extend(self.plan.new_header_titles)
 
-            for col in clear_cols:
-                row[col] = ''
+        for col in self.plan.drop_cols:
+            del self.header_row[col]
 
 
     def _process_header(self):
@@ -327,21 +671,42 @@ class Formatter():
             self.data.insert(0, self.header_row)
 
 
-    def _process_rows(self):
+    def _get_drop_rows(self):
         '''
-        Do operations that are row-wise in nature
-        Example: drop row 1, drop row 3
-        Note: this is doesn't consider if there is a header row or not
+        Row numbers(starting from 1) to be deleted, in descending order
         '''
         if not 'rows' in self.c:
-            return
+            return []
 
         drop_rows = [int(row) for row in self.c['rows'] if self.c['rows'][row]=='drop']
 
         #Required because: After deletion of row #n, we have row #n+1 now at #n position
         drop_rows.sort(reverse=True)
-        
-        for row in drop_rows:
+        return drop_rows
+
+
+    def _split_drop_rows(self):
+        '''
+        Split the rows to be deleted into the leading run of rows 1, 2, .. - skipped while reading the file -
+        and the other row numbers, counted from the first row read, in descending order
+        '''
+        drop_rows = self._get_drop_rows()
+
+        skip_rows = 0
+        while skip_rows + 1 in drop_rows:
+            skip_rows += 1
+
+        return skip_rows, [row - skip_rows for row in drop_rows if row > skip_rows]
+
+
+    def _process_rows(self):
+        '''
+        Do operations that are row-wise in nature
+        Example: drop row 1, drop row 3
+        Note: this is doesn't consider if there is a header row or not
+        The leading dropped rows are not here, they were skipped while reading(see _split_drop_rows)
+        '''
+        for row in self._split_drop_rows()[1]:
             try:
                 del self.data[row - 1]
             except:
@@ -352,36 +717,207 @@ class Formatter():
         '''
         Read format specification into self.c
         '''
-        if os.sep in self.options.format:
-            format_fpath = self.options.format
-        else:
-            format_fpath = os.path.join('formats', self.options.format)
+        self.c = load_format(self.options.format)
 
-        if not format_fpath.endswith('.json'):
-            format_fpath += '.json'
 
-        with open(format_fpath) as fp:
-            self.c = json.load(fp)
+    def _prepare(self):
+        '''
+        Load and compile the format, unless they were passed to the constructor
+        '''
+        if not self.c:
+            self._load_format()
+
+        if self.plan is None:
+            self._compile_plan()
+
+
+    def _read_rows(self):
+        skip_rows = self._split_drop_rows()[0]
+        self.data = self.in_spreadsheet.get_rows(skip_rows)
+        self.rows_in = skip_rows + len(self.data)
+
+
+    def _save_rows(self):
+        self.out_spreadsheet.set_rows(self.data)
+        self.out_spreadsheet.save_file()
+
+
+    def _count_rows(self):
+        return len(self.data)
 
 
     def run(self):
         """
         Execute the Formatter function in steps as broken down into functions
         """
+        try:
+            if self.options.streaming:
+                self.run_streaming()
+            elif self.options.columnar:
+                self.run_columnar()
+            else:
+                self._run_stages()
+        except BaseException:
+            # Formatter also exits(SystemExit) on errors in the data
+            self.out_spreadsheet.discard()
+            raise
+        finally:
+            self.profiler.stop()
+
+
+    def _run_stages(self):
+        for name, stage in [
+                                ('_prepare', self._prepare),
+                                ('get_rows', self._read_rows),
+                                ('_process_rows', self._process_rows),
+                                ('_separate_header_and_body', self._separate_header_and_body),
+                                ('_process_header', self._process_header),
+                                ('_delete_duplicate_rows', self._delete_duplicate_rows),
+                                ('_execute_plan', self._execute_plan),
+                                ('_process_header_columns', self._process_header_columns)
+                            ]:
+            self.profiler.run(name, stage, self._count_rows)
+
+        self.rows_out = len(self.data)
+
+        self.profiler.run('_merge_header_and_body', self._merge_header_and_body, self._count_rows)
+        self.profiler.run('save_file', self._save_rows, self._count_rows)
+
+
+    def run_columnar(self):
+        """
+        Same steps as run(), but the column operations are done on a ColumnTable -
+        drop and cut-paste move column lists, clear shares a single empty column
+        and replace is one mapping pass over the column. The rows are rebuilt while writing
+        """
+        profiler = self.profiler
 
-        self.data = self.in_spreadsheet.get_rows()
+        profiler.run('_prepare', self._prepare, lambda: 0)
 
-        self._load_format()
-        self._process_rows()
-        self._separate_header_and_body()
-        self._process_header()
-        self._process_columns()
-        self._create_new_columns()
-        self._drop_columns()
-        self._merge_header_and_body()
+        skip_rows, drop_rows = self._split_drop_rows()
 
-        self.out_spreadsheet.set_rows(self.data)
-        self.out_spreadsheet.save_file()
+        with profiler.stage('get_columns', 0) as stage:
+            table = ColumnTable(*self.in_spreadsheet.get_columns(skip_rows))
+            stage['rows_out'] = table.num_rows
+            self.rows_in = skip_rows + table.num_rows
+
+        with profiler.stage('_process_rows', table.num_rows) as stage:
+            table.delete_rows([row - 1 for row in drop_rows])
+            if 'has_header_row' in self.c and self.c['has_header_row']:
+                self.header_row = table.pop_row(0)
+            stage['rows_out'] = table.num_rows
+
+        profiler.run('_process_header', self._process_header, lambda: table.num_rows)
+
+        with profiler.stage('_delete_duplicate_rows', table.num_rows) as stage:
+            table.delete_duplicate_rows(self.plan.unique_key_cols)
+            stage['rows_out'] = table.num_rows
+
+        with profiler.stage('column_steps', table.num_rows) as stage:
+            if table.num_rows:
+                for step in self.plan.column_steps:
+                    step(table)
+            stage['rows_out'] = table.num_rows
+
+        profiler.run('_process_header_columns', self._process_header_columns, lambda: table.num_rows)
+        self.rows_out = table.num_rows
+
+        with profiler.stage('save_file', table.num_rows) as stage:
+            if 'has_header_row' in self.c and self.c['has_header_row'] and self.header_row:
+                self.out_spreadsheet.append_row(self.header_row)
+            self.out_spreadsheet.set_rows(table.iter_rows())
+            self.out_spreadsheet.save_file()
+            stage['rows_out'] = table.num_rows
+
+
+    def run_streaming(self):
+        """
+        Same steps as run(), but the rows are read, formatted and written one at a time
+        so that the memory use doesn't grow with the size of the input file
+
+        The reading, formatting and writing of the rows are profiled as the single stage 'stream_rows'
+        """
+        self.profiler.run('_prepare', self._prepare, lambda: 0)
+
+        skip_rows, drop_rows = self._split_drop_rows()
+        drop_rows = set(row + skip_rows for row in drop_rows)
+
+        def read_rows():
+            for row_num, row in enumerate(self.in_spreadsheet.iter_rows(skip_rows), skip_rows + 1):
+                self.rows_in = row_num
+                if row_num not in drop_rows:
+                    yield row
+
+        with self.profiler.stage('stream_rows', 0) as stage:
+            rows = read_rows()
+
+            if 'has_header_row' in self.c and self.c['has_header_row']:
+                self.header_row = next(rows, [])
+
+            self._process_header()
+            self._process_header_columns()
+
+            if self.header_row and 'has_header_row' in self.c and self.c['has_header_row']:
+                self.out_spreadsheet.append_row(self.header_row)
+
+            steps = self.plan.steps
+            seen_keys = [set() for get_key in self.plan.unique_keys]
+            row_num = 0
+
+            for row in rows:
+                if self._is_duplicate_row(row, seen_keys):
+                    continue
+
+                for step in steps:
+                    step(row, row_num)
+
+                self.out_spreadsheet.append_row(row)
+                row_num += 1
+
+            self.rows_out = row_num
+            stage['rows_in'] = self.rows_in
+            stage['rows_out'] = self.rows_out
+
+        with self.profiler.stage('save_file', self.rows_out) as stage:
+            self.out_spreadsheet.save_file()
+            stage['rows_out'] = self.rows_out
+
+
+
+def load_format(format):
+    '''
+    Read the format specification of the given format name or path
+    '''
+    if os.sep in format:
+        format_fpath = format
+    else:
+        format_fpath = os.path.join('formats', format)
+
+    if not format_fpath.endswith('.json'):
+        format_fpath += '.json'
+
+    with open(format_fpath) as fp:
+        return json.load(fp)
+
+
+
+def import_operations_module(format):
+    '''
+    Import the custom operations of the format from the <root_dir>/operations directory
+    Returns None if the format has no custom operations
+    '''
+    try:
+        return importlib.import_module('operations.' + format)
+    except Exception as e:
+        try:
+            # Fixme: This inner try-except is there to support testing
+            # Could find a way to avoid this
+            parentPath = os.path.abspath("..")
+            if parentPath not in sys.path:
+                sys.path.insert(0, parentPath)
+            return importlib.import_module('operations.' + format.split(os.sep)[-1])
+        except Exception as e:
+            return None
 
 
 
@@ -399,6 +935,106 @@ def col2num(col):
 
 
 
+def compile_plan(c, operations_module):
+    '''
+    Compile the format specification into an ExecutionPlan - a flat list of steps
+
+    Each instruction is compiled twice: into a function(row, row_num) that modifies a row in place
+    and into a function(table) that modifies a whole ColumnTable.
+    Column numbers, lookup tables and custom operations are resolved once here
+    instead of for every row. The steps follow the 'Order of operations' in README.md
+    '''
+    columns = c['columns'] if 'columns' in c else {}
+    new_columns = c['new_columns'] if 'new_columns' in c else {}
+    has_header_row = 'has_header_row' in c and c['has_header_row']
+
+    # The keys for the deletion of rows based on uniqueness
+    # A key is read from one or more columns, each 'unique' column is a single-column key
+    # itemgetter returns the cell value for a single column and a tuple for multiple columns
+    unique_key_cols = [[col2num(col)] for col in columns if columns[col]=='unique']
+    if 'unique_keys' in c:
+        unique_key_cols += [[col2num(col) for col in key_cols] for key_cols in c['unique_keys']]
+    unique_keys = [itemgetter(*key_cols) for key_cols in unique_key_cols]
+
+    # Each of these is a list of (row step, column step) pairs
+    cut_paste_steps = []
+    operation_steps = []
+    operation_cols = []
+    replace_steps = []
+    replace_based_on_steps = []
+
+    for col in columns:
+        instruction = columns[col]
+        if not isinstance(instruction, dict):
+            continue
+
+        if instruction['action'] == 'operation':
+            try:
+                func = getattr(operations_module, instruction['function'])
+            except Exception as e:
+                print('Error while reading definition of the custom operation {}'.format(instruction['function']))
+                sys.exit(-1)
+            operation_steps.append(operation_step(col2num(col), func, col))
+            operation_cols.append((col2num(col), func, col))
+        if instruction['action'] == 'replace':
+            if 'based_on' in instruction:
+                lookup = normalised_lookup(instruction['with'])
+                replace_based_on_steps.append((replace_based_on_step(col2num(col), col2num(instruction['based_on']), instruction['with'], lookup),
+                                               methodcaller('replace_based_on', col2num(col), col2num(instruction['based_on']), instruction['with'], lookup)))
+            else:
+                replace_steps.append((replace_step(col2num(col), instruction['with']),
+                                      methodcaller('replace', col2num(col), instruction['with'])))
+        if instruction['action'] == 'cutpaste':
+            cut_paste_steps.append((cutpaste_step(col2num(col), col2num(instruction['from'])),
+                                    methodcaller('cutpaste', col2num(col), col2num(instruction['from']))))
+
+    clear_cols = [col2num(col) for col in columns if columns[col]=='clear']
+    clear_steps = [(clear_step(clear_cols), methodcaller('clear', clear_cols))] if clear_cols else []
+
+    # New columns are appended in this order: all the replacements, then all the concatenations
+    new_replace_steps = []
+    new_concat_steps = []
+    new_replace_titles = []
+    new_concat_titles = []
+
+    for new_col_def in new_columns:
+        definition = new_columns[new_col_def]
+        if 'action' not in definition or 'based_on' not in definition:
+            continue
+
+        if definition['action'] == 'replace':
+            lookup = normalised_lookup(definition['with'])
+            new_replace_steps.append((new_replace_step(col2num(definition['based_on']), definition['with'], lookup),
+                                      methodcaller('new_replace', col2num(definition['based_on']), definition['with'], lookup)))
+            if has_header_row:
+                new_replace_titles.append(definition['header_title'])
+        if definition['action'] == 'concatenate':
+            based_on_cols = [col2num(col) for col in definition['based_on']]
+            new_concat_steps.append((concatenate_step(based_on_cols, definition['join_string']),
+                                     methodcaller('concatenate', based_on_cols, definition['join_string'])))
+            if has_header_row:
+                new_concat_titles.append(definition['header_title'])
+
+    new_header_titles = new_replace_titles + new_concat_titles
+
+    #Required because: After deletion of col #n, we have col #n+1 now at #n position
+    drop_cols = sorted([col2num(col) for col in columns if columns[col]=='drop'], reverse=True)
+    drop_steps = [(drop_step(drop_cols), methodcaller('drop', drop_cols))] if drop_cols else []
+
+    # The custom operations need whole rows, so on a ColumnTable they all run in a single step
+    if operation_cols:
+        operation_steps = [(step, methodcaller('operations', operation_cols)) for step in operation_steps[:1]] + \
+                          [(step, None) for step in operation_steps[1:]]
+
+    steps = (cut_paste_steps + operation_steps + replace_steps + replace_based_on_steps + clear_steps
+             + new_replace_steps + new_concat_steps + drop_steps)
+
+    return ExecutionPlan([row_step for row_step, column_step in steps],
+                         [column_step for row_step, column_step in steps if column_step],
+                         unique_keys, unique_key_cols, new_header_titles, drop_cols)
+
+
+
 def isfloat(value):
     try:
         float(value)
@@ -408,17 +1044,327 @@ def isfloat(value):
 
 
 
+###############################################################################
+#                   Row-level steps of a Formatter execution plan             #
+###############################################################################
+
+def cutpaste_step(col, from_col):
+    def step(row, row_num):
+        row[col] = row[from_col]
+        row[from_col] = ''
+    return step
+
+
+def vectorized(func, per_value=None):
+    '''
+    Declare a custom operation as vectorized(it sets func.vectorized = True, as transtab's columns.vectorized does):
+    it is called with a whole column, as func(values, col_name, quit_on_error), and returns the new values
+    of the column. It must not modify values in place. col_name is the column label(like 'M') and quit_on_error
+    is True, the custom operations of Formatter stop on errors.
+    per_value(value) is the same operation on a single value(func.per_value), called when the rows
+    are formatted one at a time. The other custom operations are called once per row, as function(value, row, row_num)
+    '''
+    func.vectorized = True
+    if per_value is not None:
+        func.per_value = per_value
+    return func
+
+
+def is_vectorized(func):
+    return getattr(func, 'vectorized', False)
+
+
+def operation_step(col, func, col_name):
+    if is_vectorized(func):
+        per_value = getattr(func, 'per_value', None)
+        if per_value is not None:
+            def step(row, row_num):
+                row[col] = per_value(row[col])
+            return step
+
+        # The rows are formatted one at a time, so an operation without per_value gets a column of one value
+        def step(row, row_num):
+            row[col] = func([row[col]], col_name, True)[0]
+        return step
+
+    def step(row, row_num):
+        row[col] = func(row[col], row, row_num)
+    return step
+
+
+def replace_step(col, table):
+    def step(row, row_num):
+        row[col] = table[row[col]]
+    return step
+
+
+def replace_based_on_step(col, based_on_col, table, lookup):
+    def step(row, row_num):
+        key = str(row[based_on_col])
+        row[col] = lookup[key] if key in lookup else lookup_fallback(table, row[based_on_col])
+    return step
+
+
+def new_replace_step(based_on_col, table, lookup):
+    def step(row, row_num):
+        key = str(row[based_on_col])
+        row.append(lookup[key] if key in lookup else lookup_fallback(table, row[based_on_col]))
+    return step
+
+
+def concatenate_step(based_on_cols, join_string):
+    def step(row, row_num):
+        row.append(join_string.join([str(row[c]) for c in based_on_cols]))
+    return step
+
+
+def clear_step(cols):
+    def step(row, row_num):
+        for col in cols:
+            row[col] = ''
+    return step
+
+
+def drop_step(cols):
+    '''
+    cols should be in descending order
+    '''
+    def step(row, row_num):
+        for col in cols:
+            del row[col]
+    return step
+
+
+# Cell types that are equal across types(1 == 1.0 == True), a column mixing them is encoded by (type, value)
+NUMBER_TYPES = frozenset([int, float, bool])
+
+
+def encode_column(column):
+    '''
+    Dictionary-encode a column: return (codes, values) - values are the distinct cells in the order first seen,
+    codes the index in values of each cell. Columns like a status or a pay frequency have a few distinct values
+    in many rows, so a replacement map is looked up once per value instead of once per cell.
+    The cells of a column that mixes number types are told apart by their type too, 1 and 1.0 get their own codes
+    '''
+    index = {}
+    codes = [index.setdefault(value, len(index)) for value in column]
+
+    # Only numbers are equal across types, so only a column with numbers needs all its cell types checked
+    if not NUMBER_TYPES.isdisjoint(map(type, index)) and len(NUMBER_TYPES.intersection(map(type, column))) > 1:
+        index = {}
+        codes = [index.setdefault((type(value), value), len(index)) for value in column]
+        return codes, [value for value_type, value in index]
+
+    return codes, list(index)
+
+
+def normalised_lookup(table):
+    '''
+    Return a copy of the replacement map in which integer keys like "20" can also be found as "20.0"
+    Because sometimes while reading from csv/xls integers are read as floats (20 as 20.0)
+    '''
+    lookup = dict(table)
+
+    for key in table:
+        try:
+            # Only the keys written as plain integers, "020" or "+20" are not "20" to the fallback either
+            if str(int(key)) == key:
+                lookup.setdefault(str(float(int(key))), table[key])
+        except ValueError:
+            pass
+
+    return lookup
+
+
+def lookup_replacement(table, lookup):
+    '''
+    The replacement of a value by the normalised lookup map, or by lookup_fallback() if it's not in it
+    '''
+    def replacement(value):
+        key = str(value)
+        return lookup[key] if key in lookup else lookup_fallback(table, value)
+    return replacement
+
+
+def lookup_fallback(table, value):
+    '''
+    Used when the value is not found in the normalised lookup map
+    A float like 20.5 is looked up as "20", anything else is an error
+    '''
+    if isfloat(str(value)):
+        return table[str(int(value))]
+
+    print(repr(str(value)))
+    sys.exit(-1)
+
+
+
+###############################################################################
+#              Batch mode - format many files in a pool of processes          #
+###############################################################################
+
+# Set in every worker process of the pool by _init_batch_worker()
+_batch_options = None
+_batch_c = None
+_batch_plan = None
+_batch_error = None
+
+
+def _init_batch_worker(options, c, plan=None):
+    '''
+    Import the custom operations and compile the format once per worker process(the plan can't be pickled).
+    An initializer that exits would make the pool start workers again and again,
+    so a format that fails to compile here fails the files of the worker instead
+    '''
+    global _batch_options, _batch_c, _batch_plan, _batch_error
+
+    _batch_options = options
+    _batch_c = c
+    _batch_plan = plan
+    _batch_error = None
+
+    if _batch_plan is None:
+        try:
+            _batch_plan = compile_plan(c, import_operations_module(options.format))
+        except (Exception, SystemExit) as e:
+            _batch_error = 'the format could not be compiled - {}: {}'.format(type(e).__name__, e)
+
+
+
+def _format_batch_file(input_path):
+    '''
+    Format a single file of the batch and return its summary
+    '''
+    result = {'input_path': input_path, 'output_path': None, 'rows_in': 0, 'rows_out': 0, 'seconds': 0, 'error': None}
+    if _batch_error:
+        result['error'] = _batch_error
+        return result
+
+    start = time.time()
+
+    try:
+        options = FormatterOptions(_batch_options.format, input_path,
+                                   output_sheet_name=_batch_options.output_sheet_name,
+                                   streaming=_batch_options.streaming,
+                                   columnar=_batch_options.columnar,
+                                   output_format=_batch_options.output_format)
+        formatter = Formatter(options, c=_batch_c, plan=_batch_plan)
+        formatter.run()
+
+        result['output_path'] = formatter.out_spreadsheet.output_path
+        result['rows_in'] = formatter.rows_in
+        result['rows_out'] = formatter.rows_out
+    except (Exception, SystemExit) as e:
+        # Formatter exits on errors in the data, that should fail only this file
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+
+    result['seconds'] = round(time.time() - start, 3)
+    return result
+
+
+
+def find_batch_inputs(path):
+    '''
+    Return the .csv/.xls/.xlsx files in a directory or matching a glob pattern
+    The outputs of previous runs(*_formatted.xlsx/.csv/.tsv) are left out
+    '''
+    if os.path.isdir(path):
+        paths = [os.path.join(path, fname) for fname in os.listdir(path)]
+    else:
+        paths = glob.glob(path)
+
+    input_paths = []
+    for path in paths:
+        filename_prefix, type = os.path.splitext(path)
+        if os.path.isfile(path) and type in ['.csv', '.xls', '.xlsx'] and not filename_prefix.endswith('_formatted'):
+            input_paths.append(path)
+
+    return sorted(input_paths)
+
+
+
+def run_batch(format, path, workers=None, summary_path='batch_summary.json', output_sheet_name="Sheet1", streaming=False,
+              columnar=False, output_format='xlsx'):
+    '''
+    Format every input file found by find_batch_inputs(path) in a pool of 'workers' processes
+    The format is loaded once and compiled once per process. It is compiled first in this process,
+    so a format that can't be compiled(like one naming an undefined custom operation) exits before the pool starts.
+
+    A summary with the row counts, duration and error of every file is saved as JSON to summary_path
+    '''
+    input_paths = find_batch_inputs(path)
+    c = load_format(format)
+    batch_options = FormatterOptions(format, None, output_sheet_name=output_sheet_name, streaming=streaming,
+                                     columnar=columnar, output_format=output_format)
+    plan = compile_plan(c, import_operations_module(format))
+    workers = workers or multiprocessing.cpu_count()
+
+    start = time.time()
+
+    if workers == 1:
+        _init_batch_worker(batch_options, c, plan)
+        results = [_format_batch_file(input_path) for input_path in input_paths]
+    else:
+        with multiprocessing.Pool(workers, initializer=_init_batch_worker, initargs=(batch_options, c)) as pool:
+            results = pool.map(_format_batch_file, input_paths, chunksize=1)
+
+    summary = {
+        'format': format,
+        'workers': workers,
+        'files': len(results),
+        'failures': len([result for result in results if result['error']]),
+        'seconds': round(time.time() - start, 3),
+        'results': results
+    }
+
+    with open(summary_path, 'w') as fp:
+        json.dump(summary, fp, indent=3)
+
+    for result in results:
+        if result['error']:
+            print('{}: FAILED - {}'.format(result['input_path'], result['error']))
+        else:
+            print('{}: {} rows in, {} rows out, {}s'.format(result['input_path'], result['rows_in'],
+                                                             result['rows_out'], result['seconds']))
+
+    print('{} files, {} failures, {}s. Summary saved to {}'.format(summary['files'], summary['failures'],
+                                                                    summary['seconds'], summary_path))
+    return summary
+
+
+
 def process_options():
     parser = OptionParser()
     parser.add_option("-f", "--format", dest="format",help="enter format", metavar="FORMAT")
     parser.add_option("-i", "--input", dest="input_path", help="input file path", metavar="PATH")
     parser.add_option("-s", "--sheet", dest="output_sheet_name", help="sheet name", metavar="SHEET_NAME")
+    parser.add_option("--stream", dest="streaming", action="store_true", default=False,
+                      help="format the rows one at a time without loading the whole file in memory")
+    parser.add_option("--columnar", dest="columnar", action="store_true", default=False,
+                      help="hold the data column-wise and format whole columns at a time")
+    parser.add_option("-o", "--output-format", dest="output_format", type="choice", choices=SpreadsheetWriter.OUTPUT_FORMATS,
+                      default="xlsx", help="format of the output file: xlsx(default), csv or tsv", metavar="FORMAT")
+    parser.add_option("--profile", dest="profile", action="store_true", default=False,
+                      help="record the time, CPU time, rows and peak memory of each stage, printed as a table on stderr")
+    parser.add_option("--profile-report", dest="profile_path", default="profile.json", help="where to save the profile report as JSON",
+                      metavar="PATH")
+    parser.add_option("-b", "--batch", dest="batch", help="format all the .csv/.xls/.xlsx files in a directory or matching a glob pattern",
+                      metavar="DIR_OR_GLOB")
+    parser.add_option("-w", "--workers", dest="workers", type="int", help="number of processes in batch mode, defaults to the number of CPUs",
+                      metavar="N")
+    parser.add_option("--summary", dest="summary_path", default="batch_summary.json", help="where to save the summary of a batch run",
+                      metavar="PATH")
 
     (options, args) = parser.parse_args()
 
     if not options.format:
         parser.error('format not provided (-f option)')
 
+    if options.batch:
+        if options.profile:
+            parser.error('--profile works on a single input file (-i option), not in batch mode')
+        return options
+
     if not options.input_path:
             parser.error('input path not provided (-i option)')
 
@@ -430,7 +1376,20 @@ def process_options():
 
 def main():
     options = process_options()
-    Formatter(options).run()
+
+    if options.batch:
+        summary = run_batch(options.format, options.batch, workers=options.workers, summary_path=options.summary_path,
+                            output_sheet_name=options.output_sheet_name, streaming=options.streaming,
+                            columnar=options.columnar, output_format=options.output_format)
+        if summary['failures']:
+            sys.exit(-1)
+    else:
+        formatter = Formatter(options)
+        formatter.run()
+
+        if options.profile:
+            formatter.profiler.save(options.profile_path)
+            formatter.profiler.print_table()
 
 
 
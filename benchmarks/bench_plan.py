@@ -0,0 +1,71 @@
+'''
+Time the row processing of Formatter.run() on a riceland-sized input
+
+The rows of test/data/riceland.xlsx are repeated (with a fresh SSN per row, so that
+the 'unique' check keeps them) to build an input of the requested size in memory.
+Reading and writing the spreadsheets is left out, only the formatting steps are timed.
+
+$ python benchmarks/bench_plan.py -n 200000
+$ python benchmarks/bench_plan.py -n 200000 --columnar
+'''
+import os
+import sys
+import copy
+import time
+from optparse import OptionParser
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from Formatter import Formatter, FormatterOptions, SpreadsheetReader
+
+
+def riceland_rows(n):
+    rows = SpreadsheetReader(os.path.join(ROOT_DIR, 'test', 'data', 'riceland.xlsx')).get_rows()
+    banner_and_header, body = rows[:3], rows[3:]
+
+    data = []
+    for i in range(n):
+        row = list(body[i % len(body)])
+        row[0] = '{:03d}-{:02d}-{:04d}'.format(i // 1000000, (i // 10000) % 100, i % 10000)
+        data.append(row)
+
+    return banner_and_header + data
+
+
+def time_run(rows, repeat, columnar=False):
+    best = None
+
+    for _ in range(repeat):
+        options = FormatterOptions(os.path.join(ROOT_DIR, 'formats', 'riceland'), os.path.join(ROOT_DIR, 'riceland.xlsx'),
+                                   columnar=columnar)
+        formatter = Formatter(options)
+        data = copy.deepcopy(rows)
+        formatter.in_spreadsheet.get_rows = lambda skip_rows=0: data[skip_rows:]
+        formatter.out_spreadsheet.set_rows = lambda rows: list(rows)
+        formatter.out_spreadsheet.append_row = lambda row: None
+        formatter.out_spreadsheet.save_file = lambda: None
+
+        start = time.perf_counter()
+        formatter.run()
+        elapsed = time.perf_counter() - start
+
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-n", "--rows", dest="rows", type="int", default=200000, help="number of data rows")
+    parser.add_option("-r", "--repeat", dest="repeat", type="int", default=3, help="number of runs, the best is reported")
+    parser.add_option("--columnar", dest="columnar", action="store_true", default=False, help="run in the columnar mode")
+    (options, args) = parser.parse_args()
+
+    rows = riceland_rows(options.rows)
+    elapsed = time_run(rows, options.repeat, columnar=options.columnar)
+    print('{} rows: {:.3f}s ({:.0f} rows/s)'.format(options.rows, elapsed, options.rows / elapsed))
+
+
+if __name__ == '__main__':
+    main()
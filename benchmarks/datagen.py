@@ -0,0 +1,183 @@
+'''
+Generate riceland-shaped payroll sheets of any size for the benchmarks
+
+The sheets have the layout of test/data/riceland.xlsx - two banner rows, the header row
+and one row per employee - with values drawn from the same vocabularies, so that
+formats/riceland.json and transtab/sample/riceland.txt run on them unchanged.
+The same seed always gives the same rows.
+
+flavour 'formatter' writes the Payroll Frequency as text(Weekly, Semimonthly, ...) as formats/riceland.json expects,
+flavour 'transtab' writes it as the pay periods per year(52, 24, ...) as transtab/sample/riceland.txt expects
+
+$ python benchmarks/datagen.py -n 100000 -o riceland_100000.xlsx
+'''
+import os
+import csv
+import random
+import datetime
+from optparse import OptionParser
+
+from openpyxl import Workbook
+
+
+# .xls sheets can't hold more than 65536 rows
+XLS_MAX_ROWS = 65536 - 3
+
+HEADER = ['SSN', 'File Number', 'Employee ID', 'First Name', 'Last Name', 'Birth Date', 'Gender',
+          'Mailing Address Line 1', 'Mailing Address Line 2', 'Mailing Address City', 'Mailing Address State',
+          'Mailing Address ZIP/Postal', 'Phone Number', 'Payroll Frequency', 'Annual Rate', 'Location Code (Work)',
+          'Location Name', 'Pay Group', 'Department Code', 'Department Name', 'Hourly Rate', 'Hire Date',
+          'Job Termination Date', 'Job Rehire Date', 'Employee Status', 'Job Information Effective Date', 'Job Title',
+          'Reason Code', 'Action/Reason Description', 'Action/Reasons Effective Date', 'Job Action',
+          'Full-Time/Part-Time']
+
+BANNER = [['Job Information - Effective Date', 'All records independent of date'],
+          ['Job Information - Effective Sequence', 'All records']]
+
+FIRST_NAMES = ['John', 'Mary', 'James', 'Linda', 'Robert', 'Patricia', 'Michael', 'Barbara', 'David', 'Susan']
+LAST_NAMES = ['Doe', 'Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Miller', 'Davis', 'Wilson', 'Moore']
+CITIES = [('Little Rock', 'AR', 72205), ('Stuttgart', 'AR', 72160), ('Jonesboro', 'AR', 72401), ('Memphis', 'TN', 38103)]
+PHONE_FORMATS = ['{}/{}-{}', '({}) {}-{}', '{}-{}-{}', '{}{}{}']
+PAYROLL_FREQUENCIES = [('Weekly', 52, 0.9), ('Semimonthly', 24, 0.05), ('Monthly (4.33 Weeks)', 12, 0.05)]
+LOCATIONS = [('6110', 'Stuttgart Rice Division'), ('6150', 'Jonesboro Rice Division'), ('7415', 'Hydro'),
+             ('6105', 'Headquarters')]
+PAY_GROUPS = ['J67', 'J67', 'J67', 'J69', 'SG6', 'J66', 'J6T', '@HR', 'J68']
+DEPARTMENTS = [('611496', 'Stgt C/Rice Dom Pkg Ship'), ('610656', 'Stgt Rice Packaging'),
+               ('610796', 'Stgt Rice Maintenance General'), ('748656', 'Stgt Oil Packaging Dept')]
+JOB_TITLES = ['Checker III', 'Miscellaneous Labor', 'Plant Electrician', 'Temporary', 'Forklift Operator']
+ACTIONS = [('PAY', 'STP', 'Step Progression'), ('TER', 'F', 'Abandoned Job'), ('HIR', None, None),
+           ('XFR', 'TRA', 'Transfer'), ('PAY', 'O', 'Other')]
+
+
+def random_date(rnd, start_year, end_year):
+    return datetime.datetime(start_year, 1, 1) + datetime.timedelta(days=rnd.randrange((end_year - start_year) * 365))
+
+
+def riceland_rows(n, seed=0, flavour='formatter'):
+    '''
+    Yield the banner rows, the header row and n employee rows
+    '''
+    rnd = random.Random(seed)
+    frequency_weights = [weight for name, periods, weight in PAYROLL_FREQUENCIES]
+
+    for row in BANNER:
+        yield row + [None] * (len(HEADER) - len(row))
+    yield list(HEADER)
+
+    for i in range(n):
+        city, state, zip_code = rnd.choice(CITIES)
+        frequency_name, frequency_periods, weight = rnd.choices(PAYROLL_FREQUENCIES, frequency_weights)[0]
+        location_code, location_name = rnd.choice(LOCATIONS)
+        department_code, department_name = rnd.choice(DEPARTMENTS)
+        job_action, reason_code, reason = rnd.choice(ACTIONS)
+
+        phone = None
+        if rnd.random() < 0.9:
+            phone = rnd.choice(PHONE_FORMATS).format(rnd.choice(['870', '501', '314']), rnd.randrange(200, 1000),
+                                                     '{:04d}'.format(rnd.randrange(10000)))
+
+        hire_date = random_date(rnd, 1985, 2018)
+        termination_date = random_date(rnd, 2018, 2019) if job_action == 'TER' else None
+        rehire_date = random_date(rnd, 2010, 2019) if rnd.random() < 0.25 else None
+
+        yield [
+            '{:03d}-{:02d}-{:04d}'.format(100 + i // 1000000, (i // 10000) % 100, i % 10000),
+            200001 + i,
+            10000 + i,
+            rnd.choice(FIRST_NAMES),
+            rnd.choice(LAST_NAMES),
+            random_date(rnd, 1950, 2000),
+            rnd.choice(['Male', 'Female']),
+            '{} Address RD'.format(rnd.randrange(1, 10000)),
+            None,
+            city,
+            state,
+            zip_code,
+            phone,
+            frequency_name if flavour == 'formatter' else frequency_periods,
+            rnd.randrange(20, 120) * 1000,
+            location_code,
+            location_name,
+            rnd.choice(PAY_GROUPS),
+            department_code,
+            department_name,
+            rnd.randrange(10, 40),
+            hire_date,
+            termination_date,
+            rehire_date,
+            'Terminated' if termination_date else rnd.choice(['Active', 'Active', 'Active', 'Leave of Absence']),
+            termination_date or hire_date,
+            rnd.choice(JOB_TITLES),
+            reason_code,
+            reason,
+            random_date(rnd, 2001, 2018) if reason else None,
+            job_action,
+            rnd.choice(['F', 'F', 'F', 'P'])
+        ]
+
+
+def write_csv(rows, path):
+    with open(path, 'w', newline='') as fp:
+        writer = csv.writer(fp)
+        for row in rows:
+            writer.writerow([val.strftime('%m/%d/%Y') if isinstance(val, datetime.datetime) else val for val in row])
+
+
+def write_xlsx(rows, path):
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title='Sheet1')
+    for row in rows:
+        ws.append(row)
+    wb.save(path)
+
+
+def write_xls(rows, path):
+    import xlwt
+
+    date_style = xlwt.easyxf(num_format_str='MM/DD/YYYY')
+    wb = xlwt.Workbook()
+    ws = wb.add_sheet('Sheet1')
+    for row_num, row in enumerate(rows):
+        for col_num, val in enumerate(row):
+            if isinstance(val, datetime.datetime):
+                ws.write(row_num, col_num, val, date_style)
+            elif val is not None:
+                ws.write(row_num, col_num, val)
+    wb.save(path)
+
+
+WRITERS = {'csv': write_csv, 'xls': write_xls, 'xlsx': write_xlsx}
+
+
+def generate(n, path, seed=0, flavour='formatter'):
+    '''
+    Write n riceland rows to path, the type of the file is taken from its extension
+    '''
+    type = os.path.splitext(path)[1].lstrip('.')
+
+    if type not in WRITERS:
+        raise ValueError('Can not generate .{} files, expected one of {}'.format(type, sorted(WRITERS)))
+
+    if type == 'xls' and n > XLS_MAX_ROWS:
+        raise ValueError('.xls files hold at most {} data rows'.format(XLS_MAX_ROWS))
+
+    WRITERS[type](riceland_rows(n, seed=seed, flavour=flavour), path)
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-n", "--rows", dest="rows", type="int", default=10000, help="number of employee rows")
+    parser.add_option("-o", "--output", dest="output", help="output file path, its extension(.csv/.xls/.xlsx) sets the type. "
+                      "Default: riceland_<rows>.csv", metavar="PATH")
+    parser.add_option("--seed", dest="seed", type="int", default=0, help="random seed")
+    parser.add_option("--flavour", dest="flavour", type="choice", choices=['formatter', 'transtab'], default='formatter',
+                      help="formatter(default) or transtab, see the module docstring")
+    (options, args) = parser.parse_args()
+
+    path = options.output or 'riceland_{}.csv'.format(options.rows)
+    generate(options.rows, path, seed=options.seed, flavour=options.flavour)
+    print('{} rows saved to {}'.format(options.rows, path))
+
+
+if __name__ == '__main__':
+    main()
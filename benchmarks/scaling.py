@@ -0,0 +1,136 @@
+'''
+Check that TransTab instructions scale linearly with the number of rows
+
+Each case runs one instruction on generated sheets of growing sizes(the sheet is loaded
+once per size and only the instruction is timed) and compares the time per row of the
+biggest sheet with the smallest one. A time per row that grows by more than --max-ratio
+means the instruction is worse than linear, and the script exits with 1.
+
+$ python benchmarks/scaling.py
+$ python benchmarks/scaling.py --sizes 20000,40000,80000,160000 --cases sum-col-and-delete-duplicate-rows
+'''
+import os
+import sys
+import gc
+import csv
+import time
+import random
+import shutil
+import tempfile
+from optparse import OptionParser
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'transtab'))
+
+from transtab.TransTab import TransTab, compile_format
+
+
+SIZES = [25000, 50000, 100000, 200000]
+
+HEADER = ['Employee ID', 'SSN', 'Department', 'Hours', 'Note']
+
+# The instruction of each case, run on sheets of HEADER rows.
+# The SSNs repeat with 40% unique values, which is the shape that made the per key row lookups quadratic
+CASES = {
+    'sum-col-and-delete-duplicate-rows': "sum-col-and-delete-duplicate-rows sum 'Hours' unique 'SSN'",
+    'delete-duplicate-rows': "delete-duplicate-rows 'SSN'",
+    'delete-rows-by-column-val': "delete-rows-by-column-val col 'Department' val 'Ship'",
+    'group-by': "group-by 'SSN', 'Department' aggregate sum 'Hours', count, min 'Employee ID', "
+                "max 'Employee ID' as 'Last Employee ID', first 'Note'",
+}
+
+
+def write_sheet(path, n, seed=0):
+    rnd = random.Random(seed)
+    unique_ssns = max(1, n * 2 // 5)
+
+    with open(path, 'w', newline='') as fp:
+        writer = csv.writer(fp)
+        writer.writerow(HEADER)
+        for i in range(n):
+            ssn = rnd.randrange(unique_ssns)
+            writer.writerow([10000 + i, '{:03d}-{:02d}-{:04d}'.format(100 + ssn // 1000000, (ssn // 10000) % 100, ssn % 10000),
+                             rnd.choice(['Packaging', 'Maintenance', 'Shipping']), rnd.randrange(1, 60), 'note {}'.format(i)])
+
+
+def time_case(case, sizes, work_dir, repeat=1):
+    '''
+    Return the best time of the case's instruction at each size
+    '''
+    format_path = os.path.join(work_dir, 'scaling.txt')
+    with open(format_path, 'w') as fp:
+        fp.write(CASES[case])
+    instruction = compile_format(CASES[case])[0]
+
+    timings = []
+    for n in sizes:
+        sheet_path = os.path.join(work_dir, 'scaling_{}.csv'.format(n))
+        if not os.path.exists(sheet_path):
+            write_sheet(sheet_path, n)
+
+        best = None
+        for _ in range(repeat):
+            tt = TransTab(sheet_path, format_path, cache_dir='')
+            # csv values are loaded as text, sum-col-and-delete-duplicate-rows sums the cells as they are
+            # (group-by converts the numbers in text cells itself, so it is timed on the text)
+            if case == 'sum-col-and-delete-duplicate-rows':
+                pos = tt.data.headers.index('Hours')
+                for row in tt.data._data:
+                    row[pos] = int(row[pos])
+
+            # As in timeit, the garbage collector is kept from adding pauses that depend on the heap size
+            gc.collect()
+            gc.disable()
+            try:
+                start = time.perf_counter()
+                tt.execute(instruction)
+                seconds = time.perf_counter() - start
+            finally:
+                gc.enable()
+            best = seconds if best is None else min(best, seconds)
+
+        timings.append((n, best))
+
+    return timings
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--sizes", dest="sizes", default=','.join(str(size) for size in SIZES),
+                      help="comma separated numbers of rows, default: %default")
+    parser.add_option("--cases", dest="cases", default=','.join(sorted(CASES)), help="comma separated cases, default: %default")
+    parser.add_option("-r", "--repeat", dest="repeat", type="int", default=3, help="runs per size, the best is kept")
+    parser.add_option("--max-ratio", dest="max_ratio", type="float", default=2.0,
+                      help="largest allowed growth of the time per row from the smallest to the biggest size, default: %default")
+    (options, args) = parser.parse_args()
+
+    sizes = sorted(int(size) for size in options.sizes.split(',') if size)
+    cases = [case for case in options.cases.split(',') if case]
+    unknown = [case for case in cases if case not in CASES]
+    if unknown:
+        parser.error('unknown cases: {}'.format(', '.join(unknown)))
+
+    work_dir = tempfile.mkdtemp(prefix='transtab_scaling_')
+    failed = []
+    try:
+        for case in cases:
+            timings = time_case(case, sizes, work_dir, repeat=options.repeat)
+            for n, seconds in timings:
+                print('{:<36} {:>9} rows {:>9.3f}s {:>9.2f} us/row'.format(case, n, seconds, seconds / n * 1e6))
+
+            ratio = (timings[-1][1] / timings[-1][0]) / (timings[0][1] / timings[0][0])
+            status = 'ok' if ratio <= options.max_ratio else 'NOT LINEAR'
+            print('{:<36} time per row x{:.2f} from {} to {} rows: {}'.format(case, ratio, sizes[0], sizes[-1], status))
+            if ratio > options.max_ratio:
+                failed.append(case)
+    finally:
+        shutil.rmtree(work_dir)
+
+    if failed:
+        print('{} cases are not linear: {}'.format(len(failed), ', '.join(failed)))
+        sys.exit(1)
+    print('All cases scale linearly')
+
+
+if __name__ == '__main__':
+    main()
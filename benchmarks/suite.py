@@ -0,0 +1,247 @@
+'''
+Throughput benchmarks of Formatter and TransTab on generated riceland sheets
+
+'run' formats generated inputs(see datagen.py) of each size and type with formats/riceland.json
+through Formatter.py and with transtab/sample/riceland.txt through the transtab command, each in its
+own process, and saves the best time, rows/s and peak memory of every run as JSON.
+The inputs are generated once per seed and kept in benchmarks/data.
+
+'compare' flags the runs of a result file that are slower than in a baseline result file
+by more than the threshold, or that failed where the baseline didn't.
+
+$ python benchmarks/suite.py run --sizes 10000,100000 --types csv,xlsx -o results.json
+$ python benchmarks/suite.py compare benchmarks/baseline.json results.json --threshold 0.2
+
+Runs over the --timeout are recorded as errors. .xls inputs are limited to 65533 rows,
+bigger .xls runs are recorded as skipped
+'''
+import os
+import sys
+import json
+import time
+import platform
+import datetime
+import tempfile
+import subprocess
+from optparse import OptionParser
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+DATA_DIR = os.path.join(BENCHMARKS_DIR, 'data')
+TRANSTAB_DIR = os.path.join(ROOT_DIR, 'transtab')
+
+sys.path.insert(0, BENCHMARKS_DIR)
+
+import datagen
+
+
+SIZES = [10000, 100000, 1000000]
+TYPES = ['csv', 'xls', 'xlsx']
+TOOLS = ['formatter', 'transtab']
+
+
+def input_path(tool, size, type, seed):
+    '''
+    Path of the generated input of the tool, generated when it doesn't exist yet
+    '''
+    path = os.path.join(DATA_DIR, 'riceland_{}_{}_seed{}.{}'.format(tool, size, seed, type))
+
+    if not os.path.exists(path):
+        if not os.path.isdir(DATA_DIR):
+            os.makedirs(DATA_DIR)
+        print('generating {}'.format(path))
+        datagen.generate(size, path, seed=seed, flavour=tool)
+
+    return path
+
+
+def tool_command(tool, path):
+    '''
+    The command line, working directory and environment to format path with the tool
+    '''
+    env = dict(os.environ)
+
+    if tool == 'formatter':
+        return [sys.executable, 'Formatter.py', '-f', 'riceland', '-i', path], ROOT_DIR, env
+
+    env['PYTHONPATH'] = os.pathsep.join([TRANSTAB_DIR] + [p for p in [env.get('PYTHONPATH')] if p])
+    return ([sys.executable, '-m', 'transtab.transtab_cmd', '-f', 'riceland.txt', '-i', path],
+            os.path.join(TRANSTAB_DIR, 'sample'), env)
+
+
+def run_command(command, cwd, env, timeout):
+    '''
+    Run the command and return its wall time, peak memory(KB) and error
+    The process is waited for with os.wait4 to get the resource usage of this run alone(Unix only)
+    '''
+    with tempfile.TemporaryFile() as stderr:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=stderr)
+
+        while True:
+            pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+            if pid:
+                break
+
+            if time.perf_counter() - start > timeout:
+                process.kill()
+                os.wait4(process.pid, 0)
+                process.returncode = -1
+                return None, None, 'timeout after {}s'.format(timeout)
+
+            time.sleep(0.01)
+
+        seconds = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+        error = None
+        if process.returncode != 0:
+            stderr.seek(0)
+            lines = stderr.read().decode(errors='replace').strip().splitlines()
+            error = lines[-1] if lines else 'exit code {}'.format(process.returncode)
+
+    return seconds, rusage.ru_maxrss, error
+
+
+def run_benchmark(tool, size, type, seed=0, repeat=1, timeout=3600):
+    result = {'name': '{}/{}/{}'.format(tool, type, size), 'tool': tool, 'type': type, 'rows': size,
+              'seconds': None, 'rows_per_second': None, 'max_rss_kb': None, 'error': None, 'skipped': None}
+
+    if type == 'xls' and size > datagen.XLS_MAX_ROWS:
+        result['skipped'] = '.xls files hold at most {} data rows'.format(datagen.XLS_MAX_ROWS)
+        return result
+
+    path = input_path(tool, size, type, seed)
+    command, cwd, env = tool_command(tool, path)
+
+    for _ in range(repeat):
+        seconds, max_rss_kb, error = run_command(command, cwd, env, timeout)
+        if error:
+            result['error'] = error
+            break
+
+        if result['seconds'] is None or seconds < result['seconds']:
+            result['seconds'] = round(seconds, 3)
+            result['rows_per_second'] = round(size / seconds)
+        result['max_rss_kb'] = max(result['max_rss_kb'] or 0, max_rss_kb)
+
+    output_path = os.path.splitext(path)[0] + '_formatted.xlsx'
+    if os.path.exists(output_path):
+        os.remove(output_path)
+
+    return result
+
+
+def run_suite(sizes, types, tools, seed=0, repeat=1, timeout=3600):
+    results = []
+
+    for size in sizes:
+        for type in types:
+            for tool in tools:
+                result = run_benchmark(tool, size, type, seed=seed, repeat=repeat, timeout=timeout)
+                results.append(result)
+                print(format_result(result))
+
+    return {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': seed,
+        'repeat': repeat,
+        'results': results
+    }
+
+
+def format_result(result):
+    if result['skipped']:
+        return '{:<28} skipped: {}'.format(result['name'], result['skipped'])
+    if result['error']:
+        return '{:<28} FAILED: {}'.format(result['name'], result['error'])
+    return '{:<28} {:>9.3f}s {:>9} rows/s {:>9} KB'.format(result['name'], result['seconds'], result['rows_per_second'],
+                                                         result['max_rss_kb'])
+
+
+def compare(baseline, current, threshold):
+    '''
+    Print the change of every run found in both result files and return the regressions -
+    runs slower than (1 + threshold) times the baseline, or failing where the baseline didn't
+    '''
+    baseline_results = {result['name']: result for result in baseline['results']}
+    regressions = []
+
+    for result in current['results']:
+        base = baseline_results.get(result['name'])
+        if base is None or base['skipped'] or result['skipped']:
+            continue
+
+        if base['error']:
+            status = 'baseline failed'
+        elif result['error']:
+            status = 'REGRESSION - failed: {}'.format(result['error'])
+            regressions.append(result['name'])
+        else:
+            change = result['seconds'] / base['seconds'] - 1
+            status = '{:+.1%}'.format(change)
+            if change > threshold:
+                status += ' REGRESSION'
+                regressions.append(result['name'])
+
+        print('{:<28} {:>10} {:>10}  {}'.format(result['name'],
+                                                '' if base['seconds'] is None else '{:.3f}s'.format(base['seconds']),
+                                                '' if result['seconds'] is None else '{:.3f}s'.format(result['seconds']),
+                                                status))
+
+    return regressions
+
+
+def split_list(value, convert=str):
+    return [convert(item) for item in value.split(',') if item]
+
+
+def main():
+    parser = OptionParser(usage='%prog run [options]\n       %prog compare BASELINE RESULTS [--threshold T]')
+    parser.add_option("--sizes", dest="sizes", default=','.join(str(size) for size in SIZES),
+                      help="comma separated numbers of rows, default: %default")
+    parser.add_option("--types", dest="types", default=','.join(TYPES), help="comma separated input types, default: %default")
+    parser.add_option("--tools", dest="tools", default=','.join(TOOLS), help="comma separated tools, default: %default")
+    parser.add_option("--seed", dest="seed", type="int", default=0, help="seed of the generated inputs")
+    parser.add_option("-r", "--repeat", dest="repeat", type="int", default=1, help="runs per benchmark, the best is kept")
+    parser.add_option("--timeout", dest="timeout", type="int", default=3600, help="seconds before a run is stopped")
+    parser.add_option("-o", "--output", dest="output", default="benchmark_results.json", help="where to save the results",
+                      metavar="PATH")
+    parser.add_option("--threshold", dest="threshold", type="float", default=0.2,
+                      help="slowdown(fraction of the baseline time) reported as a regression, default: %default")
+    (options, args) = parser.parse_args()
+
+    if not args or args[0] not in ['run', 'compare']:
+        parser.error('expected a command: run or compare')
+
+    if args[0] == 'run':
+        unknown = [t for t in split_list(options.types) if t not in TYPES] + [t for t in split_list(options.tools) if t not in TOOLS]
+        if unknown:
+            parser.error('unknown types/tools: {}'.format(', '.join(unknown)))
+
+        summary = run_suite(split_list(options.sizes, int), split_list(options.types), split_list(options.tools),
+                            seed=options.seed, repeat=options.repeat, timeout=options.timeout)
+        with open(options.output, 'w') as fp:
+            json.dump(summary, fp, indent=3)
+        print('Results saved to {}'.format(options.output))
+        return
+
+    if len(args) != 3:
+        parser.error('compare expects the baseline and the results files')
+
+    with open(args[1]) as fp:
+        baseline = json.load(fp)
+    with open(args[2]) as fp:
+        current = json.load(fp)
+
+    regressions = compare(baseline, current, options.threshold)
+    if regressions:
+        print('{} regressions: {}'.format(len(regressions), ', '.join(regressions)))
+        sys.exit(1)
+    print('No regressions')
+
+
+if __name__ == '__main__':
+    main()
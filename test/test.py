@@ -3,13 +3,19 @@ import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
 from Formatter import *
 
+import csv
+import json
+import shutil
+import datetime
+import tempfile
 import unittest
+import tracemalloc
 
 
 
 class TestFormatter(unittest.TestCase):
 
-    def _format_test_helper(self, f):
+    def _format_test_helper(self, f, **options):
         """
         Helper function to test a format
         """
@@ -31,7 +37,7 @@ class TestFormatter(unittest.TestCase):
         actual_path = os.path.join(data_dir, input_fname_prefix + '_formatted.xlsx')
         expected_path = os.path.join(data_dir, input_fname_prefix + '_expected.xlsx')
 
-        Formatter(FormatterOptions(format_path, input_path)).run()
+        Formatter(FormatterOptions(format_path, input_path, **options)).run()
 
         actual_SR = SpreadsheetReader(actual_path)
         expected_SR = SpreadsheetReader(expected_path)
@@ -76,7 +82,7 @@ class TestFormatter(unittest.TestCase):
 
 
 
-    def _rule_test_helper(self, rule):
+    def _rule_test_helper(self, rule, **options):
         """
         Helper function to test a rule
         """
@@ -99,7 +105,7 @@ class TestFormatter(unittest.TestCase):
         actual_path = os.path.join(data_dir, input_fname_prefix + '_formatted.xlsx')
         expected_path = os.path.join(data_dir, input_fname_prefix + '_expected.xlsx')
 
-        Formatter(FormatterOptions(rule_path, input_path)).run()
+        Formatter(FormatterOptions(rule_path, input_path, **options)).run()
 
         actual_SR = SpreadsheetReader(actual_path)
         expected_SR = SpreadsheetReader(expected_path)
@@ -136,6 +142,7 @@ class TestFormatter(unittest.TestCase):
                     'row_drop', 
                     'header_replace', 
                     'col_unique', 
+                    'col_unique_composite',
                     'col_drop', 
                     'col_clear',
                     'col_replace_with_val',
@@ -150,5 +157,335 @@ class TestFormatter(unittest.TestCase):
             self._rule_test_helper(rule)
 
 
+    def test_streaming(self):
+        """
+        Run the formats and rules in streaming mode(--stream)
+
+        The output is expected to be the same as that of the normal mode,
+        so the same <name>_expected.xlsx files are used
+        """
+
+        for f in ['riceland']:
+            print('testing format {} in streaming mode'.format(f))
+            self._format_test_helper(f, streaming=True)
+
+        rules = [
+                    'row_drop',
+                    'header_replace',
+                    'col_unique',
+                    'col_unique_composite',
+                    'col_drop',
+                    'col_clear',
+                    'col_replace_with_val',
+                    'col_replace_based_on_col',
+                    'col_cutpaste',
+                    'col_new_col_replace',
+                    'col_new_concat'
+                ]
+
+        for rule in rules:
+            print('testing rule {} in streaming mode'.format(rule))
+            self._rule_test_helper(rule, streaming=True)
+
+
+    def test_xls_reader(self):
+        """
+        The rows, the streamed rows and the columns of an .xls file should hold the same data
+        with the xldate cells converted to datetimes
+        """
+
+        data_dir = 'data'
+        if os.path.exists("test") and os.path.isdir("test"):
+            data_dir = os.path.join('test', data_dir)
+
+        reader = SpreadsheetReader(os.path.join(data_dir, 'riceland.xls'))
+
+        rows = reader.get_rows()
+        columns, num_rows = reader.get_columns()
+
+        self.assertEqual(num_rows, len(rows))
+        self.assertEqual([list(row) for row in zip(*columns)], rows)
+        self.assertEqual(list(reader.iter_rows()), rows)
+
+        # 'Birth Date' and 'Job Termination Date' of the first data row
+        self.assertEqual(rows[3][5], datetime.datetime(1990, 1, 20))
+        self.assertEqual(rows[3][22], '')
+
+
+    def test_write_only_input(self):
+        """
+        A write-only .xlsx(like Formatter's own output) has no stored dimension and gives each row up to its last value,
+        its rows are padded to the widest row so that the rules can reach the trailing empty cells
+        """
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            input_path = os.path.join(tmp_dir, 'write_only.xlsx')
+            writer = SpreadsheetWriter(input_path)
+            writer.set_rows([['Item', 'Type', 'Note'], ['Orange', 'Fruit', None], ['Pen', None, 'Blue']])
+            writer.save_file()
+
+            self.assertEqual(SpreadsheetReader(input_path).get_rows(),
+                             [['Item', 'Type', 'Note'], ['Orange', 'Fruit', None], ['Pen', None, 'Blue']])
+
+            rule_path = os.path.join(tmp_dir, 'clear_note')
+            with open(rule_path + '.json', 'w') as fp:
+                json.dump({'has_header_row': True, 'columns': {'C': 'clear'}}, fp)
+
+            for options in [{}, {'streaming': True}, {'columnar': True}]:
+                Formatter(FormatterOptions(rule_path, input_path, **options)).run()
+                rows = SpreadsheetReader(os.path.join(tmp_dir, 'write_only_formatted.xlsx')).get_rows()
+                self.assertEqual([row[:2] for row in rows], [['Item', 'Type'], ['Orange', 'Fruit'], ['Pen', None]])
+                self.assertEqual([row[2:] for row in rows[1:]], [[None], [None]])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+    def test_batch(self):
+        """
+        Format a directory of files in a pool of processes(-b option)
+
+        Each file gets its own <file>_formatted.xlsx and a row in the summary,
+        a file that can't be read is reported as a failure without stopping the others
+        """
+
+        rule_dir = 'rules'
+        data_dir = 'data'
+        if os.path.exists("test") and os.path.isdir("test"):
+            rule_dir = os.path.join('test', rule_dir)
+            data_dir = os.path.join('test', data_dir)
+
+        batch_dir = tempfile.mkdtemp()
+        try:
+            for fname in ['a.xlsx', 'b.xlsx']:
+                shutil.copy(os.path.join(data_dir, 'col_drop.xlsx'), os.path.join(batch_dir, fname))
+            with open(os.path.join(batch_dir, 'c.xlsx'), 'w') as fp:
+                fp.write('not a spreadsheet')
+
+            summary_path = os.path.join(batch_dir, 'summary.json')
+            run_batch(os.path.join(rule_dir, 'col_drop'), batch_dir, workers=2, summary_path=summary_path)
+
+            with open(summary_path) as fp:
+                summary = json.load(fp)
+
+            self.assertEqual(summary['files'], 3)
+            self.assertEqual(summary['failures'], 1)
+            self.assertEqual([bool(result['error']) for result in summary['results']], [False, False, True])
+
+            expected_file_data = SpreadsheetReader(os.path.join(data_dir, 'col_drop_expected.xlsx')).get_rows()
+            for result in summary['results'][:2]:
+                self.assertEqual(result['rows_out'], len(expected_file_data) - 1)
+                self.assertEqual(SpreadsheetReader(result['output_path']).get_rows(), expected_file_data)
+
+            # The file that failed leaves no partial .csv behind
+            run_batch(os.path.join(rule_dir, 'col_drop'), batch_dir, workers=2, summary_path=summary_path,
+                      output_format='csv')
+            self.assertEqual(sorted(fname for fname in os.listdir(batch_dir) if fname.endswith(('.csv', '.part'))),
+                             ['a_formatted.csv', 'b_formatted.csv'])
+        finally:
+            shutil.rmtree(batch_dir)
+
+
+    def test_batch_undefined_operation(self):
+        """
+        A format naming an undefined custom operation stops the batch before the pool starts
+        """
+        from Formatter import _init_batch_worker, _format_batch_file
+
+        data_dir = 'data'
+        if os.path.exists("test") and os.path.isdir("test"):
+            data_dir = os.path.join('test', data_dir)
+
+        batch_dir = tempfile.mkdtemp()
+        try:
+            shutil.copy(os.path.join(data_dir, 'col_drop.xlsx'), os.path.join(batch_dir, 'a.xlsx'))
+            format_path = os.path.join(batch_dir, 'undefined_operation')
+            with open(format_path + '.json', 'w') as fp:
+                json.dump({'columns': {'A': {'action': 'operation', 'function': 'nope'}}}, fp)
+
+            summary_path = os.path.join(batch_dir, 'summary.json')
+            with self.assertRaises(SystemExit):
+                run_batch(format_path, batch_dir, workers=2, summary_path=summary_path)
+            self.assertFalse(os.path.exists(summary_path))
+
+            # A worker that can't compile the format fails its files instead of exiting
+            _init_batch_worker(FormatterOptions(format_path, None), load_format(format_path))
+            result = _format_batch_file(os.path.join(batch_dir, 'a.xlsx'))
+            self.assertIn('could not be compiled', result['error'])
+        finally:
+            shutil.rmtree(batch_dir)
+
+
+    def test_output_formats(self):
+        """
+        Save the formatted rows as .csv/.tsv(-o option)
+
+        The text output is expected to hold the same rows as <rule>_expected.xlsx
+        with every value written as text
+        """
+
+        rule_dir = 'rules'
+        data_dir = 'data'
+        if os.path.exists("test") and os.path.isdir("test"):
+            rule_dir = os.path.join('test', rule_dir)
+            data_dir = os.path.join('test', data_dir)
+
+        expected_file_data = SpreadsheetReader(os.path.join(data_dir, 'col_cutpaste_expected.xlsx')).get_rows()
+        expected_file_data = [['' if val is None else str(val) for val in row] for row in expected_file_data]
+
+        for output_format, delimiter in [('csv', ','), ('tsv', '\t')]:
+            print('testing {} output'.format(output_format))
+            formatter = Formatter(FormatterOptions(os.path.join(rule_dir, 'col_cutpaste'),
+                                                   os.path.join(data_dir, 'col_cutpaste.xlsx'),
+                                                   output_format=output_format))
+            formatter.run()
+
+            output_path = formatter.out_spreadsheet.output_path
+            try:
+                self.assertEqual(output_path, os.path.join(data_dir, 'col_cutpaste_formatted.' + output_format))
+                with open(output_path, newline='') as fp:
+                    self.assertEqual(list(csv.reader(fp, delimiter=delimiter)), expected_file_data)
+            finally:
+                os.remove(output_path)
+
+
+    def test_profile(self):
+        """
+        Profile the stages of a run(--profile) in each mode
+
+        Every stage gets its timings, row counts and peak memory,
+        the rows dropped and deduplicated show up in the row counts
+        """
+
+        rule_dir = 'rules'
+        data_dir = 'data'
+        if os.path.exists("test") and os.path.isdir("test"):
+            rule_dir = os.path.join('test', rule_dir)
+            data_dir = os.path.join('test', data_dir)
+
+        expected_file_data = SpreadsheetReader(os.path.join(data_dir, 'col_unique_expected.xlsx')).get_rows()
+
+        for options in [{}, {'streaming': True}, {'columnar': True}]:
+            print('testing profile of {}'.format(options))
+            formatter = Formatter(FormatterOptions(os.path.join(rule_dir, 'col_unique'),
+                                                   os.path.join(data_dir, 'col_unique.xlsx'),
+                                                   profile=True, **options))
+            formatter.run()
+
+            report = formatter.profiler.report()
+            json.dumps(report)
+
+            self.assertFalse(tracemalloc.is_tracing())
+            self.assertEqual(report['stages'][-1]['stage'], 'save_file')
+            self.assertEqual(formatter.rows_out, len(expected_file_data))
+            self.assertEqual(report['wall_seconds'], round(sum(stage['wall_seconds'] for stage in report['stages']), 6))
+            for stage in report['stages']:
+                self.assertGreater(stage['peak_memory_bytes'], 0)
+                self.assertGreaterEqual(stage['cpu_seconds'], 0)
+
+            if not options:
+                stages = {stage['stage']: stage for stage in report['stages']}
+                self.assertEqual(stages['get_rows']['rows_out'], formatter.rows_in)
+                self.assertEqual(stages['_delete_duplicate_rows']['rows_out'], formatter.rows_out)
+
+
+    def test_columnar(self):
+        """
+        Run the formats and rules in columnar mode(--columnar)
+
+        The output is expected to be the same as that of the normal mode,
+        so the same <name>_expected.xlsx files are used
+        """
+
+        for f in ['riceland']:
+            print('testing format {} in columnar mode'.format(f))
+            self._format_test_helper(f, columnar=True)
+
+        rules = [
+                    'row_drop',
+                    'header_replace',
+                    'col_unique',
+                    'col_unique_composite',
+                    'col_drop',
+                    'col_clear',
+                    'col_replace_with_val',
+                    'col_replace_based_on_col',
+                    'col_cutpaste',
+                    'col_new_col_replace',
+                    'col_new_concat'
+                ]
+
+        for rule in rules:
+            print('testing rule {} in columnar mode'.format(rule))
+            self._rule_test_helper(rule, columnar=True)
+
+
+    def test_normalised_lookup(self):
+        """
+        Integers read as floats(20.0) find the same value as lookup_fallback would - the plain "20" key
+        """
+        table = {'020': 'padded', '20': 'plain', '+7': 'signed', 'AP': 'Apple'}
+        lookup = normalised_lookup(table)
+
+        self.assertEqual(lookup[str(20.0)], lookup_fallback(table, 20.0))
+        self.assertEqual(lookup[str(20.0)], 'plain')
+        self.assertNotIn(str(7.0), lookup)
+        self.assertEqual(lookup['AP'], 'Apple')
+
+
+    def test_encode_column(self):
+        """
+        The distinct values in the order first seen, 1 and 1.0 are kept apart only in a column mixing number types
+        """
+        self.assertEqual(encode_column(['A', 'T', 'A', None, 'T']), ([0, 1, 0, 2, 1], ['A', 'T', None]))
+        self.assertEqual(encode_column([1, 1.0, 1, True]), ([0, 1, 0, 2], [1, 1.0, True]))
+
+        # The encoding of a column is kept by its replacements
+        table = ColumnTable([['A', 'T', 'A'], [20.0, 20.0, 7.5]], 3)
+        self.assertEqual(table.encoded(0), ([0, 1, 0], ['A', 'T']))
+        table.replace(0, {'A': 'Active', 'T': 'Terminated'})
+        self.assertEqual(table.columns[0], ['Active', 'Terminated', 'Active'])
+        self.assertEqual(table.encoded(0), ([0, 1, 0], ['Active', 'Terminated']))
+
+        # Looked up once per distinct value, with the fallback of the float 7.5 to "7"
+        table.new_replace(1, {'20': 'twenty', '7': 'seven'}, normalised_lookup({'20': 'twenty', '7': 'seven'}))
+        self.assertEqual(table.columns[2], ['twenty', 'twenty', 'seven'])
+
+
+    def test_vectorized_operation(self):
+        """
+        A vectorized operation gets a whole column in columnar mode and its per_value function is called
+        a value at a time in row mode(or a column of one value without per_value), the row operations after it see its values
+        """
+        calls = []
+
+        def upper(values, col_name, quit_on_error):
+            calls.append(col_name)
+            return [value.upper() for value in values]
+
+        def mark(value, row, row_num):
+            return row[0] + '!'
+
+        rows = [['Orange', 'Fruit'], ['Pen', 'Stationery']]
+        expected = [['ORANGE', 'ORANGE!'], ['PEN', 'PEN!']]
+
+        vectorized(upper)
+        table = ColumnTable.from_rows(rows)
+        table.operations([(0, upper, 'A'), (1, mark, 'B')])
+        self.assertEqual([list(row) for row in table.iter_rows()], expected)
+        self.assertEqual(calls, ['A'])
+
+        for per_value, expected_calls in [(None, ['A', 'A']), (str.upper, [])]:
+            calls = []
+            vectorized(upper, per_value=per_value)
+            row_rows = [list(row) for row in rows]
+            steps = [operation_step(0, upper, 'A'), operation_step(1, mark, 'B')]
+            for row_num, row in enumerate(row_rows):
+                for step in steps:
+                    step(row, row_num)
+            self.assertEqual(row_rows, expected)
+            self.assertEqual(calls, expected_calls)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -17,7 +17,8 @@ setuptools.setup(
 	url='https://github.com/SolveForTech/csvprogram',
     packages=setuptools.find_packages(),
     entry_points = {
-    	'console_scripts': ['transtab=transtab.transtab_cmd:main'],
+    	'console_scripts': ['transtab=transtab.transtab_cmd:main', 'transtab-server=transtab.server:main',
+    	                    'transtab-watch=transtab.watch:main'],
     },
     classifiers=(
         "Programming Language :: Python :: 3",
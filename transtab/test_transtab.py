@@ -3,6 +3,9 @@
 """Tests for Transtab."""
 
 import os
+import json
+import shutil
+import tempfile
 
 import unittest
 import tablib
@@ -96,6 +99,192 @@ class TablibTestCase(unittest.TestCase):
         self.perform_common_steps(test_command, in_data, exp_data)
 
 
+    def test_delete_rows_by_column_val_predicates(self):
+        test_command = ("delete-rows-by-column-val col 'item' regex '^C.*r$'\n"
+                        "delete-rows-by-column-val col 'type' equals 'Fruit'\n"
+                        "delete-rows-by-column-val col 'price' in '50', '12'\n"
+                        "delete-rows-by-column-val col 'item' in file 'excluded_items.txt'")
+
+        headers = ('item', 'type', 'price')
+        orange = ('Orange', 'Fruit', '90')
+        cucumber = ('Cucumber', 'Vegetable', '67')
+        carrot = ('Carrot', 'Vegetable', '35')
+        grapefruit = ('Grapefruit', 'Citrus Fruit', '40')
+        pen = ('Pen', 'Stationery', '50')
+        pencil = ('Pencil', 'Stationery', '12')
+        eraser = ('Eraser', 'Stationery', '5')
+        ruler = ('Ruler', 'Stationery', '8')
+
+        in_data = tablib.Dataset(headers=headers)
+        for row in [orange, cucumber, carrot, grapefruit, pen, pencil, eraser, ruler]:
+            in_data.append(row)
+
+        exp_data = tablib.Dataset(headers=headers)
+        exp_data.append(carrot)
+        exp_data.append(grapefruit)
+        exp_data.append(ruler)
+
+        with open('excluded_items.txt', 'w') as f:
+            f.write('Eraser\n\nSharpener\n')
+
+        try:
+            self.perform_common_steps(test_command, in_data, exp_data)
+        finally:
+            os.remove('excluded_items.txt')
+
+
+    def test_skip_rows(self):
+        headers = ('Payroll report', '', '')
+        banner = ('All records', '', '')
+        header = ('item', 'type', 'price')
+        orange = ('Orange', 'Fruit', '90')
+        cucumber = ('Cucumber', 'Vegetable', '67')
+
+        in_data = tablib.Dataset(headers=headers)
+        in_data.append(banner)
+        in_data.append(header)
+        in_data.append(orange)
+        in_data.append(cucumber)
+
+        exp_data = tablib.Dataset(headers=('item', 'type', 'cost'))
+        exp_data.append(orange)
+        exp_data.append(cucumber)
+
+        self.perform_common_steps("skip 2 rows\nrename 'price' as 'cost'", in_data, exp_data)
+        self.perform_common_steps("header at row 3\nrename 'price' as 'cost'", in_data, exp_data)
+
+        # The same rows as 'delete row 1' twice, done row by row on the loaded data
+        self.perform_common_steps("delete row 1\ndelete row 1\nrename 'price' as 'cost'", in_data, exp_data)
+
+        with open('in_skip.csv', 'w') as f:
+            f.write('Payroll report,,\nAll records,,\nitem,type,price\nOrange,Fruit,90\nCucumber,Vegetable,67\n')
+        self.create_format_file("skip 2 rows", 'skip.txt')
+
+        try:
+            tt = TransTab(in_fname='in_skip.csv', format_fname='skip.txt', cache_dir='')
+            self.assertEqual(tt.data.headers, list(header))
+            self.assertEqual(tt.data[:], [orange, cucumber])
+        finally:
+            os.remove('in_skip.csv')
+            os.remove('skip.txt')
+
+
+    def test_dates(self):
+        import datetime
+        from transtab.dates import convert_dates, infer_pattern
+
+        values = ['03/15/2019', '12/01/2018', '03/15/2019', '', '2019-04-01', None, '7/4/2017']
+        rows = [['Orange', value] for value in values]
+
+        self.assertEqual(infer_pattern(values), '%m/%d/%Y')
+
+        convert_dates(rows, 1, 'csv')
+        self.assertEqual([row[1] for row in rows],
+                         [datetime.datetime(2019, 3, 15), datetime.datetime(2018, 12, 1), datetime.datetime(2019, 3, 15), '',
+                          datetime.datetime(2019, 4, 1), None, datetime.datetime(2017, 7, 4)])
+
+        # xls/xlsx cells are xldate numbers, or datetimes already
+        rows = [[43539], [datetime.datetime(2019, 3, 16)], ['03/17/2019']]
+        convert_dates(rows, 0, 'xlsx')
+        self.assertEqual([row[0] for row in rows],
+                         [datetime.datetime(2019, 3, 15), datetime.datetime(2019, 3, 16), datetime.datetime(2019, 3, 17)])
+
+
+    def test_write_only_xlsx(self):
+        import datetime
+        import openpyxl
+
+        headers = ('item', 'type', 'price', 'sold')
+
+        in_data = tablib.Dataset(headers=headers)
+        in_data.append(('Orange', 'Fruit\nCitrus', 90, datetime.datetime(2019, 3, 15)))
+        in_data.append(('Cucumber', None, 67.5, ''))
+
+        self.create_data_file(in_data, 'in_write.xlsx')
+        self.create_format_file("rename 'sold' as 'sold on'", 'write.txt')
+
+        sheets = []
+        try:
+            for write_only in [True, False]:
+                TransTab(in_fname='in_write.xlsx', format_fname='write.txt', out_fname='act_write.xlsx', cache_dir='',
+                         write_only=write_only).transform()
+                ws = openpyxl.load_workbook('act_write.xlsx').active
+                sheets.append((ws.title, ws.freeze_panes, [[(cell.value, cell.font.b) for cell in row] for row in ws.rows]))
+                if write_only:
+                    wrapped = [cell.value for row in ws.rows for cell in row if cell.alignment.wrap_text]
+        finally:
+            for fname in ['in_write.xlsx', 'write.txt', 'act_write.xlsx']:
+                if os.path.exists(fname):
+                    os.remove(fname)
+
+        self.assertEqual(sheets[0], sheets[1])
+        self.assertEqual(sheets[0][0], 'Sheet1')
+        self.assertEqual(sheets[0][2][0], [('item', True), ('type', True), ('price', True), ('sold on', True)])
+        self.assertEqual(wrapped, ['Fruit\nCitrus'])
+
+
+    def test_load_dataset(self):
+        import openpyxl
+        from transtab.loaders import load_dataset
+
+        headers = ('item', 'type', 'price')
+
+        # Write-only workbooks leave out the sheet dimensions and the trailing empty cells
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet(title='Sheet1')
+        for row in [headers, ('Orange', 'Fruit', 90.0), ('Cucumber', 67.5, None)]:
+            ws.append(row)
+        wb.save('in_load.xlsx')
+        with open('in_load.csv', 'w') as f:
+            f.write('item,type,price\nOrange,Fruit,90\nCucumber,,67.5\n')
+
+        try:
+            xlsx_data = load_dataset('in_load.xlsx', 'xlsx')
+            csv_data = load_dataset('in_load.csv', 'csv')
+        finally:
+            os.remove('in_load.xlsx')
+            os.remove('in_load.csv')
+
+        self.assertEqual(xlsx_data.title, 'Sheet1')
+        self.assertEqual(xlsx_data.headers, list(headers))
+        self.assertEqual([list(row) for row in xlsx_data], [['Orange', 'Fruit', 90], ['Cucumber', 67.5, None]])
+        self.assertEqual(type(xlsx_data[0][2]), int)
+
+        self.assertEqual(csv_data.headers, list(headers))
+        self.assertEqual(csv_data[:], [('Orange', 'Fruit', '90'), ('Cucumber', '', '67.5')])
+
+
+    def test_delimited_output(self):
+        import csv
+        import gzip
+
+        headers = ('item', 'type', 'price')
+
+        in_data = tablib.Dataset(headers=headers)
+        in_data.append(('Orange', 'Fruit, Citrus', 90))
+        in_data.append(('Cucumber', '', 67.5))
+
+        self.create_data_file(in_data, 'in_delimited.xlsx')
+        self.create_format_file("rename 'price' as 'cost'", 'delimited.txt')
+
+        exp_rows = [['item', 'type', 'cost'], ['Orange', 'Fruit, Citrus', '90'], ['Cucumber', '', '67.5']]
+
+        outputs = {}
+        try:
+            for out_fname in ['act_delimited.csv', 'act_delimited.tsv.gz']:
+                TransTab(in_fname='in_delimited.xlsx', format_fname='delimited.txt', out_fname=out_fname, cache_dir='').transform()
+                with (gzip.open if out_fname.endswith('.gz') else open)(out_fname, 'rt', newline='') as f:
+                    outputs[out_fname] = list(csv.reader(f, delimiter='\t' if '.tsv' in out_fname else ','))
+                self.assertFalse(os.path.exists(out_fname + '.part'))
+        finally:
+            for fname in ['in_delimited.xlsx', 'delimited.txt', 'act_delimited.csv', 'act_delimited.tsv.gz']:
+                if os.path.exists(fname):
+                    os.remove(fname)
+
+        self.assertEqual(outputs['act_delimited.csv'], exp_rows)
+        self.assertEqual(outputs['act_delimited.tsv.gz'], exp_rows)
+
+
     def test_new_col(self):
         test_command = "new col 'quantity'"
 
@@ -292,6 +481,316 @@ class TablibTestCase(unittest.TestCase):
         self.perform_common_steps(test_command, in_data, exp_data)
 
 
+    def test_columns(self):
+        from transtab.columns import encode_column, filter_rows, map_column
+
+        self.assertEqual(encode_column(['A', 'T', 'A', None]), ([0, 1, 0, 2], ['A', 'T', None]))
+        self.assertEqual(encode_column([1, 1.0, True, 1]), ([0, 1, 2, 0], [1, 1.0, True]))
+
+        calls = []
+        rows = [['Orange', 'active'], ['Cucumber', 'Leave'], ['Pen', 'ACTIVE'], ['Pencil', 'active']]
+        map_column(rows, 1, lambda cell: calls.append(cell) or cell.lower())
+        self.assertEqual([row[1] for row in rows], ['active', 'leave', 'active', 'active'])
+        self.assertEqual(calls, ['active', 'Leave', 'ACTIVE'])
+
+        rows = [['Orange', 1], ['Cucumber', 1.0], ['Pen', 2]]
+        self.assertEqual(filter_rows(rows, 1, lambda cell: str(cell) != '1.0'), [['Orange', 1], ['Pen', 2]])
+
+
+    def test_vectorized_operations(self):
+        import sys
+
+        with open('vectorized_ops.py', 'w') as f:
+            f.write("from transtab.columns import vectorized\n\n"
+                    "@vectorized\n"
+                    "def upper(values, col_name, quit_on_error):\n"
+                    "    return [val.upper() for val in values]\n\n"
+                    "def mark(row, row_num, quit_on_error):\n"
+                    "    row['type'] = row['item'] + '!'\n"
+                    "    return row\n")
+        self.create_format_file("do mark\ndo upper on 'item'\ndo validate_phone_number on 'phone'\n"
+                                "do validate_ssn on 'ssn'", 'vectorized_ops.txt')
+
+        in_data = tablib.Dataset(headers=('item', 'type', 'phone', 'ssn'))
+        in_data.append(('Orange', 'Fruit', '(555) 123-4567', '123 45 6789'))
+        in_data.append(('Pen', 'Stationery', '555-1234', 123456789.0))
+        self.create_data_file(in_data, 'in_vectorized.xlsx')
+
+        try:
+            tt = TransTab(in_fname='in_vectorized.xlsx', format_fname='vectorized_ops.txt', cache_dir='')
+            # The four instructions are fused into one group, the row steps and the vectorized ones
+            tt.execute_fused(tt.program)
+        finally:
+            sys.modules.pop('vectorized_ops', None)
+            for fname in ['vectorized_ops.py', 'vectorized_ops.txt', 'in_vectorized.xlsx']:
+                os.remove(fname)
+
+        # mark runs before upper on each row, as the instructions are written
+        self.assertEqual(tt.data[:], [('ORANGE', 'Orange!', '555-123-4567', '123-45-6789'),
+                                      ('PEN', 'Pen!', '', '123-45-6789')])
+
+
+    def test_memoize(self):
+        import sys
+        from transtab.memo import LRUCache
+
+        with open('memo_ops.py', 'w') as f:
+            f.write("calls = []\n\n"
+                    "def status_code(val, row, row_num, col_name, quit_on_error):\n"
+                    "    calls.append(val)\n"
+                    "    return val[0]\n")
+        self.create_format_file("do status_code on 'status' memoize\n"
+                                "do validate_phone_number on 'phone' memoize", 'memo_ops.txt')
+
+        in_data = tablib.Dataset(headers=('name', 'status', 'phone'))
+        for row in [('John', 'Active', '555 123 4567'), ('Jane', 'Leave', '5551234567'),
+                    ('Jim', 'Active', '555 123 4567'), ('Joe', 'Active', '555-1234')]:
+            in_data.append(row)
+        self.create_data_file(in_data, 'in_memo.xlsx')
+
+        try:
+            tt = TransTab(in_fname='in_memo.xlsx', format_fname='memo_ops.txt', out_fname='act_memo.xlsx', cache_dir='',
+                          profile=True)
+            tt.transform()
+            calls = sys.modules['memo_ops'].calls
+        finally:
+            sys.modules.pop('memo_ops', None)
+            for fname in ['memo_ops.py', 'memo_ops.txt', 'in_memo.xlsx', 'act_memo.xlsx']:
+                if os.path.exists(fname):
+                    os.remove(fname)
+
+        self.assertEqual(calls, ['Active', 'Leave'])
+        self.assertEqual(tt.data[:], [('John', 'A', '555-123-4567'), ('Jane', 'L', '555-123-4567'),
+                                      ('Jim', 'A', '555-123-4567'), ('Joe', 'A', '')])
+
+        memo = tt.profiler.report()['stages'][2]['memo']
+        self.assertEqual(memo['status_code'], {'hits': 2, 'misses': 2, 'hit_rate': 0.5})
+        self.assertEqual(memo['validate_phone_number'], {'hits': 1, 'misses': 3, 'hit_rate': 0.25})
+
+        # The least recently used result is evicted first
+        cache = LRUCache(maxsize=2)
+        cache.add('a', 1)
+        cache.add('b', 2)
+        cache.lookup('a')
+        cache.add('c', 3)
+        self.assertEqual(list(cache.results), [(str, 'a'), (str, 'c')])
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+
+
+    def test_workers(self):
+        import sys
+
+        with open('worker_ops.py', 'w') as f:
+            f.write("import os\n"
+                    "import sys\n"
+                    "from transtab.parallel import sequential\n\n"
+                    "seen = []\n\n"
+                    "def tag_row(row, row_num, quit_on_error):\n"
+                    "    row['num'] = row_num\n"
+                    "    row['pid'] = os.getpid()\n"
+                    "    return row\n\n"
+                    "def upper(val, row, row_num, col_name, quit_on_error):\n"
+                    "    return val.upper()\n\n"
+                    "@sequential\n"
+                    "def count_row(val, row, row_num, col_name, quit_on_error):\n"
+                    "    seen.append(row_num)\n"
+                    "    return len(seen)\n\n"
+                    "def fail(val, row, row_num, col_name, quit_on_error):\n"
+                    "    if row_num == 7:\n"
+                    "        sys.exit(-1)\n"
+                    "    return val\n")
+        self.create_format_file("do tag_row\n"
+                                "do upper on 'name'\n"
+                                "do count_row on 'seen'", 'worker_ops.txt')
+        self.create_format_file("do fail on 'name'", 'worker_fail.txt')
+
+        in_data = tablib.Dataset(headers=('name', 'num', 'pid', 'seen'))
+        for i in range(10):
+            in_data.append(('name{}'.format(i), 0, 0, 0))
+        self.create_data_file(in_data, 'in_workers.xlsx')
+
+        try:
+            tt = TransTab(in_fname='in_workers.xlsx', format_fname='worker_ops.txt', out_fname='act_workers.xlsx',
+                          cache_dir='', workers=2)
+            tt.transform()
+            seen = sys.modules['worker_ops'].seen
+
+            # An operation that exits in a worker exits the main process
+            tt_fail = TransTab(in_fname='in_workers.xlsx', format_fname='worker_fail.txt', cache_dir='', workers=2)
+            with self.assertRaises(SystemExit):
+                tt_fail.execute(tt_fail.program[0])
+            self.assertIsNone(tt_fail.pool)
+        finally:
+            sys.modules.pop('worker_ops', None)
+            for fname in ['worker_ops.py', 'worker_ops.txt', 'worker_fail.txt', 'in_workers.xlsx', 'act_workers.xlsx']:
+                if os.path.exists(fname):
+                    os.remove(fname)
+
+        # The chunks come back in order, with the row numbers of the whole dataset
+        self.assertEqual(tt.data['name'], ['NAME{}'.format(i) for i in range(10)])
+        self.assertEqual(tt.data['num'], list(range(10)))
+        self.assertNotIn(os.getpid(), tt.data['pid'])
+        self.assertIsNone(tt.pool)
+
+        # The sequential operation ran in this process, over the rows in order
+        self.assertEqual(seen, list(range(10)))
+        self.assertEqual(tt.data['seen'], list(range(1, 11)))
+
+
+    def test_server(self):
+        import threading
+        import urllib.request
+        from urllib.error import HTTPError
+        from transtab.server import FormatCache, JobHandler, TransformServer, is_loopback
+
+        def request(path, job=None):
+            data = json.dumps(job).encode('utf-8') if job is not None else None
+            try:
+                with urllib.request.urlopen('http://127.0.0.1:{}{}'.format(port, path), data) as response:
+                    return response.status, json.loads(response.read())
+            except HTTPError as e:
+                return e.code, json.loads(e.read())
+
+        with open('server_ops.py', 'w') as f:
+            f.write("def shout(val, row, row_num, col_name, quit_on_error):\n"
+                    "    return val.upper()\n")
+        self.create_format_file("do shout on 'name'", 'server_ops.txt')
+
+        in_data = tablib.Dataset(headers=('name', 'dept'))
+        in_data.append(('John', 'Sales'))
+        in_data.append(('Jane', 'Accounts'))
+        self.create_data_file(in_data, 'in_server.xlsx')
+
+        server = TransformServer(('127.0.0.1', 0), formats_dir=os.getcwd(), jobs=1, queue_size=1,
+                                 format_cache=FormatCache(cache_dir=''))
+        server.RequestHandlerClass = type('QuietHandler', (JobHandler,), {'log_message': lambda *args: None})
+        port = server.server_address[1]
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        job = {'input': 'in_server.xlsx', 'format': 'server_ops', 'output': 'act_server.csv'}
+        try:
+            status, result = request('/jobs', job)
+            with open('act_server.csv', 'r') as f:
+                act_rows = f.read().splitlines()
+
+            # The loaded format is used again until its module is edited
+            self.assertEqual(request('/jobs', job)[0], 200)
+            mtime = os.stat('server_ops.py').st_mtime + 10
+            os.utime('server_ops.py', (mtime, mtime))
+            self.assertEqual(request('/jobs', job)[0], 200)
+
+            fail_status, fail_result = request('/jobs', dict(job, format='no_such_format'))
+            bad_status = request('/jobs', {'input': 'in_server.xlsx'})[0]
+            # The formats outside of the formats directory are never loaded
+            outside_statuses = [request('/jobs', dict(job, format=name))[0] for name in ['../server_ops', '/etc/passwd']]
+            stats = request('/stats')[1]
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+            for fname in ['server_ops.py', 'server_ops.txt', 'in_server.xlsx', 'act_server.csv']:
+                if os.path.exists(fname):
+                    os.remove(fname)
+
+        self.assertEqual(status, 200)
+        self.assertEqual((result['status'], result['rows']), ('done', 2))
+        self.assertEqual(act_rows, ['name,dept', 'JOHN,Sales', 'JANE,Accounts'])
+
+        self.assertEqual((fail_status, fail_result['status']), (500, 'failed'))
+        self.assertEqual(bad_status, 400)
+        self.assertEqual(outside_statuses, [400, 400])
+        self.assertTrue(is_loopback('127.0.0.1') and is_loopback('::1') and is_loopback('localhost'))
+        self.assertFalse(is_loopback('0.0.0.0') or is_loopback('192.168.1.5') or is_loopback('example.com'))
+
+        self.assertEqual((stats['done'], stats['failed'], stats['queue_depth'], stats['running']), (3, 1, 0, 0))
+        self.assertEqual(stats['latency']['count'], 4)
+        self.assertEqual(stats['formats'], {'loaded': 1, 'hits': 1, 'misses': 3})
+
+
+    def test_watch(self):
+        from unittest import mock
+        from transtab import watch as watch_module
+        from transtab.server import FormatCache
+        from transtab.watch import Watcher
+
+        tmp_dir = tempfile.mkdtemp()
+        watch_dir = os.path.join(tmp_dir, 'drop')
+        out_dir = os.path.join(tmp_dir, 'out')
+        os.makedirs(watch_dir)
+        os.makedirs(out_dir)
+
+        formats = {}
+        for name, col_name in [('watch_name', 'name'), ('watch_dept', 'dept')]:
+            with open(os.path.join(tmp_dir, name + '.py'), 'w') as f:
+                f.write("def shout(val, row, row_num, col_name, quit_on_error):\n"
+                        "    return val.upper()\n")
+            formats[name] = os.path.join(tmp_dir, name + '.txt')
+            self.create_format_file("do shout on '{}'".format(col_name), formats[name])
+        routes = [('x_*', formats['watch_dept']), ('*.csv', formats['watch_name']), ('*.tsv', formats['watch_name'])]
+
+        def drop(fname, text):
+            with open(os.path.join(watch_dir, fname), 'a') as f:
+                f.write(text)
+
+        def read_out(fname):
+            with open(os.path.join(out_dir, fname), 'r') as f:
+                return f.read().splitlines()
+
+        def new_watcher():
+            return Watcher(watch_dir, routes, out_dir, 'csv', jobs=1, settle=0, format_cache=FormatCache(cache_dir=''))
+
+        def watch(polls):
+            watcher = new_watcher()
+            for i in range(polls):
+                watcher.poll()
+            watcher.close()
+            return sorted(os.listdir(out_dir))
+
+        state_writes = mock.patch.object(watch_module, 'write_state', side_effect=watch_module.write_state)
+        try:
+            with state_writes as write_state:
+                drop('a.csv', 'name,dept\nJohn,Sales\n')
+                drop('a.tsv', 'name\tdept\nJane\tAccounts\n')
+                drop('notes.txt', 'not routed')
+                # A file is transformed once it is seen unchanged by a second scan
+                self.assertEqual(watch(1), [])
+                # The outputs keep the extension of their file, a.csv and a.tsv don't overwrite each other
+                self.assertEqual(watch(2), ['a.csv_formatted.csv', 'a.tsv_formatted.csv'])
+                # The state is written once per scan at most, the scans that change nothing don't write it -
+                # both files are recorded with a single write when the watcher is closed
+                self.assertEqual(write_state.call_count, 1)
+
+            self.assertEqual(read_out('a.csv_formatted.csv'), ['name,dept', 'JOHN,Sales'])
+            self.assertEqual(read_out('a.tsv_formatted.csv'), ['name,dept', 'JANE,Accounts'])
+
+            # A restarted watcher skips the files transformed and the contents seen before with the same format,
+            # the same content with another format is transformed
+            for fname in os.listdir(out_dir):
+                os.remove(os.path.join(out_dir, fname))
+            drop('b.csv', 'name,dept\nJohn,Sales\n')
+            drop('x_b.csv', 'name,dept\nJohn,Sales\n')
+            self.assertEqual(watch(2), ['x_b.csv_formatted.csv'])
+            self.assertEqual(read_out('x_b.csv_formatted.csv'), ['name,dept', 'John,SALES'])
+            os.remove(os.path.join(out_dir, 'x_b.csv_formatted.csv'))
+
+            # A file that is still being written waits for the next scans
+            drop('c.csv', 'name,dept\n')
+            watcher = new_watcher()
+            watcher.poll()
+            drop('c.csv', 'Jane,Accounts\n')
+            watcher.poll()
+            watcher.collect(wait=True)
+            self.assertEqual(os.listdir(out_dir), [])
+            watcher.poll()
+            watcher.close()
+
+            self.assertEqual(os.listdir(out_dir), ['c.csv_formatted.csv'])
+            self.assertEqual(read_out('c.csv_formatted.csv'), ['name,dept', 'JANE,Accounts'])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
     def test_delete_duplicate_rows(self):
 
         test_command = "delete-duplicate-rows"
@@ -334,6 +833,73 @@ class TablibTestCase(unittest.TestCase):
         self.perform_common_steps(test_command, in_data, exp_data)
 
 
+    def test_sum_col_and_delete_duplicate_rows_interleaved(self):
+
+        test_command = "sum-col-and-delete-duplicate-rows sum 'price' unique 'item'"
+
+        headers = ('item', 'type', 'price')
+
+        in_data = tablib.Dataset(headers=headers)
+        in_data.append(('Orange', 'Fruit', 90))
+        in_data.append(('Cucumber', 'Vegetable', 67))
+        in_data.append(('Orange', 'Citrus', 10))
+        in_data.append(('Apple', 'Fruit', 5))
+        in_data.append(('Cucumber', 'Vegetable', 3))
+
+        exp_data = tablib.Dataset(headers=headers)
+        exp_data.append(('Orange', 'Fruit', 100))
+        exp_data.append(('Cucumber', 'Vegetable', 70))
+        exp_data.append(('Apple', 'Fruit', 5))
+
+        self.perform_common_steps(test_command, in_data, exp_data)
+
+
+    def test_group_by(self):
+
+        test_command = ("group-by 'item', 'type' aggregate sum 'price', count, min 'day', max 'day' as 'last day', "
+                        "first 'shop'")
+
+        headers = ('item', 'type', 'price', 'day', 'shop')
+
+        in_data = tablib.Dataset(headers=headers)
+        in_data.append(('Orange', 'Fruit', 90, 3, 'A'))
+        in_data.append(('Cucumber', 'Vegetable', 67, 2, 'B'))
+        in_data.append(('Orange', 'Fruit', 10, 1, 'C'))
+        in_data.append(('Orange', 'Citrus', 20, 5, 'D'))
+        in_data.append(('Orange', 'Fruit', '', 7, 'E'))
+
+        headers = ('item', 'type', 'price', 'day', 'shop', 'count', 'last day')
+
+        exp_data = tablib.Dataset(headers=headers)
+        exp_data.append(('Orange', 'Fruit', 100, 1, 'A', 3, 7))
+        exp_data.append(('Cucumber', 'Vegetable', 67, 2, 'B', 1, 2))
+        exp_data.append(('Orange', 'Citrus', 20, 5, 'D', 1, 5))
+
+        self.perform_common_steps(test_command, in_data, exp_data)
+
+
+    def test_group_by_csv(self):
+        # The cells of a csv file are text, the numbers among them are aggregated as numbers
+        with open('in_group_by_csv.csv', 'w') as f:
+            f.write('item,price,qty\nOrange,10,3\nOrange,20,1.5\nOrange,9,\nPen,5,2\n')
+        self.create_format_file("group-by 'item' aggregate sum 'price', min 'price' as 'low', max 'qty'", 'group_by_csv.txt')
+        self.create_format_file("group-by 'item' aggregate sum 'item' as 'total'", 'group_by_text.txt')
+
+        try:
+            tt = TransTab(in_fname='in_group_by_csv.csv', format_fname='group_by_csv.txt', cache_dir='')
+            tt.execute(tt.program[0])
+
+            tt_text = TransTab(in_fname='in_group_by_csv.csv', format_fname='group_by_text.txt', cache_dir='')
+            with self.assertRaises(SystemExit):
+                tt_text.execute(tt_text.program[0])
+        finally:
+            for fname in ['in_group_by_csv.csv', 'group_by_csv.txt', 'group_by_text.txt']:
+                os.remove(fname)
+
+        self.assertEqual(tt.data.headers, ['item', 'price', 'qty', 'low'])
+        self.assertEqual(tt.data[:], [('Orange', 39, 3, 9), ('Pen', 5, 2, 5)])
+
+
     def test_validate_phone_number(self):
 
         test_command = "do validate_phone_number on 'Ph num'"
@@ -456,5 +1022,116 @@ class TablibTestCase(unittest.TestCase):
         self.perform_common_steps(test_command, in_data, exp_data)
 
 
+    def test_profile(self):
+        test_command = "drop\nnew col 'quantity'\ndelete-duplicate-rows unique 'type'"
+
+        headers = ('item', 'type', 'price')
+        orange = ('Orange', 'Fruit', '90')
+        apple = ('Apple', 'Fruit', '70')
+        cucumber = ('Cucumber', 'Vegetable', '67')
+
+        in_data = tablib.Dataset(headers=headers)
+        in_data.append(orange)
+        in_data.append(apple)
+        in_data.append(cucumber)
+
+        self.create_data_file(in_data, 'in_profile.xlsx')
+        self.create_format_file(test_command, 'profile.txt')
+
+        try:
+            tt = TransTab(in_fname='in_profile.xlsx', format_fname='profile.txt', out_fname='act_profile.xlsx', profile=True)
+            tt.transform()
+        finally:
+            for fname in ['in_profile.xlsx', 'profile.txt', 'act_profile.xlsx']:
+                if os.path.exists(fname):
+                    os.remove(fname)
+
+        report = tt.profiler.report()
+
+        self.assertEqual([stage['stage'] for stage in report['stages']],
+                         ['load_program', 'load', 'drop', "new 'quantity'", "delete-duplicate-rows 'type'", 'save'])
+        self.assertEqual([(stage['rows_in'], stage['rows_out']) for stage in report['stages']],
+                         [(None, None), (0, 3), (3, 2), (2, 2), (2, 1), (1, 1)])
+        for stage in report['stages']:
+            self.assertGreater(stage['peak_memory_bytes'], 0)
+
+
+    def test_fused_row_steps(self):
+        from transtab.TransTab import compile_format, plan_program
+
+        test_command = ("concatenate 'item', 'type' and store in 'label' using '-'\n"
+                        "concatenate 'label', 'price' and store in 'label' using ' '\n"
+                        "rename 'label' as 'name'")
+
+        self.assertEqual([len(group) for group in plan_program(compile_format(test_command))], [2, 1])
+
+        headers = ('item', 'type', 'price')
+        orange = ('Orange', 'Fruit', '90')
+        cucumber = ('Cucumber', 'Vegetable', '67')
+
+        in_data = tablib.Dataset(headers=headers)
+        in_data.append(orange)
+        in_data.append(cucumber)
+
+        headers = ('item', 'type', 'price', 'name')
+        orange = ('Orange', 'Fruit', '90', 'Orange-Fruit 90')
+        cucumber = ('Cucumber', 'Vegetable', '67', 'Cucumber-Vegetable 67')
+
+        exp_data = tablib.Dataset(headers=headers)
+        exp_data.append(orange)
+        exp_data.append(cucumber)
+
+        self.perform_common_steps(test_command, in_data, exp_data)
+
+
+    def test_program_cache(self):
+        from transtab.TransTab import compile_format, PROGRAM_VERSION
+        from transtab.program_cache import program_path
+
+        test_command = "drop"
+
+        headers = ('item', 'type', 'price')
+        orange = ('Orange', 'Fruit', '90')
+        cucumber = ('Cucumber', 'Vegetable', '67')
+
+        in_data = tablib.Dataset(headers=headers)
+        in_data.append(orange)
+        in_data.append(cucumber)
+
+        self.create_data_file(in_data, 'in_cache.xlsx')
+        self.create_format_file(test_command, 'cache.txt')
+        cache_dir = tempfile.mkdtemp()
+
+        try:
+            TransTab(in_fname='in_cache.xlsx', format_fname='cache.txt', out_fname='act_cache.xlsx', cache_dir=cache_dir).transform()
+
+            path = program_path(cache_dir, test_command, PROGRAM_VERSION)
+            with open(path) as f:
+                self.assertEqual(json.load(f), {'version': PROGRAM_VERSION, 'program': compile_format(test_command)})
+
+            # A cached program is used without parsing the format again
+            with open(path, 'w') as f:
+                json.dump({'version': PROGRAM_VERSION, 'program': [{'op': 'new', 'col_name': 'quantity'}]}, f)
+
+            tt = TransTab(in_fname='in_cache.xlsx', format_fname='cache.txt', out_fname='act_cache.xlsx', cache_dir=cache_dir)
+            tt.transform()
+            self.assertEqual(tt.data.headers, ['item', 'type', 'price', 'quantity'])
+            self.assertEqual(len(tt.data), 2)
+
+            # .. but not one cached by another version
+            with open(path, 'w') as f:
+                json.dump({'version': PROGRAM_VERSION - 1, 'program': [{'op': 'new', 'col_name': 'quantity'}]}, f)
+
+            tt = TransTab(in_fname='in_cache.xlsx', format_fname='cache.txt', out_fname='act_cache.xlsx', cache_dir=cache_dir)
+            tt.transform()
+            self.assertEqual(tt.data.headers, ['item', 'type', 'price'])
+            self.assertEqual(len(tt.data), 1)
+        finally:
+            shutil.rmtree(cache_dir)
+            for fname in ['in_cache.xlsx', 'cache.txt', 'act_cache.xlsx']:
+                if os.path.exists(fname):
+                    os.remove(fname)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,17 +1,26 @@
 import os
+import re
 import sys
-import maya
 import importlib
+import multiprocessing
+from collections import OrderedDict
 from tablib import Dataset, Databook
 from warnings import filterwarnings
 filterwarnings("ignore", category=UserWarning)
 
 from pyparsing import *
 
-from xlrd import xldate
 from xlrd.sheet import ctype_text
 
 from transtab.utils import process_options
+from transtab.profiler import StageProfiler
+from transtab.dates import convert_dates
+from transtab.columns import encode_column, filter_rows, first_rows, is_vectorized, map_column
+from transtab.memo import DEFAULT_MEMO_SIZE, LRUCache
+from transtab.parallel import CHUNKS_PER_WORKER, init_worker, is_sequential, run_chunk
+from transtab.loaders import LOAD_TYPES, load_dataset
+from transtab.writers import DELIMITERS, write_delimited, write_xlsx
+from transtab.program_cache import DEFAULT_CACHE_DIR, program_path, read_program, write_program
 from transtab.global_operations import *
 
 from transtab.tablib_patch import dset_sheet as dset_sheet_patched
@@ -25,6 +34,8 @@ tablib.formats.xlsx.dset_sheet = dset_sheet_patched
 LPARA, RPARA, COLON, COMMA, EQUALS = map(Suppress, "{}:,=")
 
 DATES = CaselessLiteral("dates").setResultsName('decl')
+SKIP = CaselessKeyword("skip").setResultsName('decl')
+HEADER = CaselessKeyword("header").setResultsName('decl')
 
 NEW = CaselessLiteral("new").setResultsName('op')
 CLEAR = CaselessLiteral("clear").setResultsName('op')
@@ -38,6 +49,7 @@ DELETE_DUPLICATE_ROWS = CaselessLiteral("delete-duplicate-rows").setResultsName(
 DELETE_ROWS_BY_COLUMN_VAL = CaselessLiteral("delete-rows-by-column-val").setResultsName('op')
 DROP = CaselessLiteral("drop").setResultsName('op')
 SUM_COL_AND_DELETE_DUPLICATE_ROWS = CaselessLiteral("sum-col-and-delete-duplicate-rows").setResultsName('op')
+GROUP_BY = CaselessLiteral("group-by").setResultsName('op')
 DO = CaselessLiteral("do").setResultsName('op')
 CUSTOM_OP_NAME = Word( alphas+"_", alphanums+"_" ).setResultsName('custom_op_name')
 
@@ -55,10 +67,18 @@ STORE = Suppress(CaselessLiteral("store"))
 DEFAULT = CaselessLiteral("default")
 CASE_INSENSITIVE = CaselessLiteral("case-insensitive")
 QUIT_ON_ERROR = CaselessLiteral("quit-on-error")
+MEMOIZE = CaselessLiteral("memoize").setResultsName('memoize')
 UNIQUE = Suppress(CaselessLiteral("unique"))
 SUM = Suppress(CaselessLiteral("sum"))
 DEL_COL = Suppress(CaselessLiteral("col"))
 DEL_VAL = Suppress(CaselessLiteral("val"))
+AGGREGATE = Suppress(CaselessLiteral("aggregate"))
+AGG_FUNC = (CaselessKeyword("sum") | CaselessKeyword("min") | CaselessKeyword("max") | CaselessKeyword("first")).setResultsName('func')
+COUNT = CaselessKeyword("count").setResultsName('func')
+MATCH_REGEX = CaselessKeyword("regex").setResultsName('match')
+MATCH_EQUALS = CaselessKeyword("equals").setResultsName('match')
+MATCH_IN = CaselessKeyword("in").setResultsName('match')
+IN_FILE = CaselessKeyword("file").setResultsName('in_file')
 
 ROW_NUM = Word(nums).setResultsName('row_num').setParseAction( lambda t: int(t[0]) )
 
@@ -75,6 +95,8 @@ REPLACE_CASE_FLAG = CASE_INSENSITIVE.setResultsName('case_insensitive')
 REPLACE_PARAMS = OneOrMore(REPLACE_DEFAULT_PARAM | REPLACE_CASE_FLAG) 
 
 DATES_DECL = DATES + EQUALS + COL_LIST.setResultsName('cols')
+SKIP_DECL = SKIP + ROW_NUM + Suppress(CaselessKeyword("rows") | CaselessKeyword("row"))
+HEADER_DECL = HEADER + Suppress(CaselessKeyword("at")) + Suppress(CaselessKeyword("row")) + ROW_NUM
 
 NEW_CMD = NEW + Optional(COL) + COL_NAME
 CLEAR_CMD = CLEAR + COL_NAME
@@ -85,12 +107,23 @@ CUTPASTE_CMD = CUTPASTE + COL_NAME.setResultsName('src_col') + Optional(TO) + CO
 CONCATENATE_CMD = CONCATENATE + COL_LIST.setResultsName('src_cols') + Optional(AND) + Optional(STORE) + Optional(IN) + COL_NAME.setResultsName('dest_col') + Optional(USING + QuotedString("'").setResultsName('join_str'))
 REPLACE_COL_CMD = REPLACE + COL_NAME + KV_MAP + Optional(REPLACE_PARAMS)
 DELETE_DUPLICATES_CMD = DELETE_DUPLICATE_ROWS + Optional(UNIQUE + COL_NAME)
-DELETE_ROWS_BY_COLUMN_VAL_CMD = DELETE_ROWS_BY_COLUMN_VAL + DEL_COL + COL_NAME.setResultsName('col') + DEL_VAL + COL_NAME.setResultsName('val')
+PATTERN = (QuotedString("'") | QuotedString('"')).setResultsName('val')
+ROW_PREDICATE = ((DEL_VAL + COL_NAME.setResultsName('val'))
+                 | (MATCH_REGEX + PATTERN)
+                 | (MATCH_EQUALS + COL_NAME.setResultsName('val'))
+                 | (MATCH_IN + IN_FILE + COL_NAME.setResultsName('val'))
+                 | (MATCH_IN + COL_LIST.setResultsName('vals')))
+DELETE_ROWS_BY_COLUMN_VAL_CMD = DELETE_ROWS_BY_COLUMN_VAL + DEL_COL + COL_NAME.setResultsName('col') + ROW_PREDICATE
 DROP_CMD = DROP
 SUM_DELETE_DUPLICATES_CMD = SUM_COL_AND_DELETE_DUPLICATE_ROWS + SUM + COL_NAME.setResultsName('sum_col') + UNIQUE + COL_NAME.setResultsName('unique_col')
-CUSTOM_CMD = DO + CUSTOM_OP_NAME + Optional(ON + COL_NAME) + Optional(QUIT_ON_ERROR)
+AGG_OUT_COL = Optional(AS + QuotedString("'").setResultsName('out_col'))
+AGG = Group((AGG_FUNC + COL_NAME + AGG_OUT_COL) | (COUNT + AGG_OUT_COL))
+GROUP_BY_CMD = GROUP_BY + COL_LIST.setResultsName('key_cols') + AGGREGATE + Group(delimitedList(AGG)).setResultsName('aggregates')
+CUSTOM_CMD = DO + CUSTOM_OP_NAME + Optional(ON + COL_NAME) + ZeroOrMore(MEMOIZE | QUIT_ON_ERROR)
 
 F_CMD = Group( DATES_DECL
+    | SKIP_DECL
+    | HEADER_DECL
     | NEW_CMD 
     | CLEAR_CMD 
     | DELETE_CMD 
@@ -102,76 +135,313 @@ F_CMD = Group( DATES_DECL
     | DELETE_DUPLICATES_CMD 
     | DROP_CMD
     | SUM_DELETE_DUPLICATES_CMD 
+    | GROUP_BY_CMD
     | CUSTOM_CMD 
     | DELETE_ROWS_BY_COLUMN_VAL_CMD)
 
 COMMENT = Suppress(pythonStyleComment)
 
+# Packrat parsing was measured slower on this grammar(it hardly backtracks),
+# the compiled formats are cached on disk instead. See TransTab.load_program()
 GRAMMAR = OneOrMore(F_CMD + Optional(COMMENT) | COMMENT)
 
 
+###############################################################################
+#              Format programs - the parsed formats as plain data             #
+###############################################################################
+
+# Version of the instruction dicts made by compile_format().
+# Bump it whenever they change, so that the programs cached by older versions are not used
+PROGRAM_VERSION = 3
+
+
+def compile_instruction(f_cmd):
+    '''
+    Convert an instruction parsed by GRAMMAR into a plain dict of its op and arguments
+    '''
+    op = f_cmd.decl or f_cmd.op
+
+    if op == 'dates':
+        return {'op': op, 'cols': list(f_cmd.cols)}
+
+    # 'header at row N' is the same as 'skip N-1 rows'
+    if op == 'skip':
+        return {'op': op, 'rows': f_cmd.row_num}
+    if op == 'header':
+        return {'op': 'skip', 'rows': f_cmd.row_num - 1}
+
+    if op in ['new', 'clear']:
+        return {'op': op, 'col_name': f_cmd.col_name}
+
+    if op == 'delete':
+        if f_cmd.row:
+            return {'op': 'delete-row', 'row_num': f_cmd.row_num}
+        return {'op': op, 'col_name': f_cmd.col_name}
+
+    if op == 'drop':
+        return {'op': op}
+
+    if op == 'rename':
+        return {'op': op, 'col_name': f_cmd.col_name, 'new_name': f_cmd.new_name}
+
+    if op in ['copy', 'cutpaste']:
+        return {'op': op, 'src_col': f_cmd.src_col, 'dest_col': f_cmd.dest_col}
+
+    if op == 'concatenate':
+        return {'op': op, 'src_cols': list(f_cmd.src_cols), 'dest_col': f_cmd.dest_col, 'join_str': f_cmd.join_str}
+
+    if op == 'replace':
+        return {'op': op, 'col_name': f_cmd.col_name, 'kv_map': dict(f_cmd.kv_map.items()),
+                'has_default': bool(f_cmd.has_default), 'default_val': f_cmd.default_val,
+                'case_insensitive': bool(f_cmd.case_insensitive)}
+
+    if op == 'delete-duplicate-rows':
+        return {'op': op, 'col_name': f_cmd.col_name}
+
+    if op == 'delete-rows-by-column-val':
+        match = f_cmd.match.lower() if f_cmd.match else 'contains'
+        if match == 'in':
+            if f_cmd.in_file:
+                return {'op': op, 'col': f_cmd.col, 'match': 'in-file', 'val': f_cmd.val}
+            return {'op': op, 'col': f_cmd.col, 'match': match, 'val': list(f_cmd.vals)}
+        return {'op': op, 'col': f_cmd.col, 'match': match, 'val': f_cmd.val}
+
+    if op == 'sum-col-and-delete-duplicate-rows':
+        return {'op': op, 'sum_col': f_cmd.sum_col, 'unique_col': f_cmd.unique_col}
+
+    if op == 'group-by':
+        return {'op': op, 'key_cols': list(f_cmd.key_cols),
+                'aggregates': [{'func': agg.func.lower(), 'col_name': agg.col_name or None,
+                                'out_col': agg.out_col or agg.col_name or 'count'} for agg in f_cmd.aggregates]}
+
+    if op == 'do':
+        return {'op': op, 'custom_op_name': f_cmd.custom_op_name, 'col_name': f_cmd.col_name,
+                'quit_on_error': bool(f_cmd.quit_on_error), 'memoize': bool(f_cmd.memoize)}
+
+    return {'op': op, 'text': str(f_cmd)}
+
+
+# Instructions that change each row on its own, without adding, deleting or moving rows or columns.
+# Consecutive ones are run together in a single pass over the rows, see plan_program()
+ROW_LOCAL_OPS = ['concatenate', 'do']
+
+
+def is_row_local(instruction):
+    return instruction['op'] in ROW_LOCAL_OPS and (instruction['op'] != 'do' or bool(instruction['custom_op_name']))
+
+
+def cell_matcher(match, val):
+    '''
+    The predicate of a delete-rows-by-column-val instruction, called with the text of a cell
+    contains: val is in the cell(or the cell is empty, if val is empty), regex: the cell matches
+    the regular expression(re.search), equals: the cell is val, in: the cell is one of the values in val(a hashed lookup)
+    '''
+    if match == 'contains':
+        if val == '':
+            return lambda text: text == ''
+        return lambda text: val in text
+
+    if match == 'equals':
+        return lambda text: text == val
+
+    if match == 'regex':
+        try:
+            return re.compile(val).search
+        except re.error as e:
+            print('Invalid regular expression {}: {}'.format(val, e))
+            sys.exit(-1)
+
+    return frozenset(val).__contains__
+
+
+def text_to_number(val):
+    '''
+    The number in a text cell(csv/tsv cells are all text) as an int, or a float if it isn't integral.
+    Raises ValueError if the text isn't a number, the other cells(numbers, dates) are returned as they are
+    '''
+    if not isinstance(val, str):
+        return val
+
+    try:
+        return int(val)
+    except ValueError:
+        return float(val)
+
+
+def split_skip_rows(program):
+    '''
+    Return (the program without its skip declaration, the number of leading rows to skip while loading)
+    '''
+    skips = [instruction['rows'] for instruction in program if instruction['op'] == 'skip']
+
+    if len(skips) > 1:
+        print('Only one skip/header declaration is allowed in a format')
+        sys.exit(-1)
+
+    if skips and skips[0] < 0:
+        print('header at row 0: the rows are numbered from 1')
+        sys.exit(-1)
+
+    return [instruction for instruction in program if instruction['op'] != 'skip'], sum(skips)
+
+
+def plan_program(program):
+    '''
+    Group the instructions of the program for execution -
+    a run of consecutive row-local instructions makes one group, every other instruction is a group of its own
+    '''
+    groups = []
+
+    for instruction in program:
+        if groups and is_row_local(instruction) and is_row_local(groups[-1][-1]):
+            groups[-1].append(instruction)
+        else:
+            groups.append([instruction])
+
+    return groups
+
+
+def compile_format(file_format):
+    '''
+    Parse the format and return its program - the list of its instructions as plain dicts
+    '''
+    return [compile_instruction(f_cmd) for f_cmd in GRAMMAR.parseString(file_format)]
+
+
+def load_program(file_format, cache_dir=DEFAULT_CACHE_DIR):
+    '''
+    Compile the format into its program, or read it from the cache if the same format was compiled before.
+    No caching if cache_dir is empty
+    '''
+    if not cache_dir:
+        return compile_format(file_format)
+
+    path = program_path(cache_dir, file_format, PROGRAM_VERSION)
+    program = read_program(path, PROGRAM_VERSION)
+
+    if program is None:
+        program = compile_format(file_format)
+        write_program(path, program, PROGRAM_VERSION)
+
+    return program
+
+
 ###############################################################################
 #                                Main class                                   #
 ###############################################################################
 
 class TransTab(object):
 
-    def __init__(self, in_fname, format_fname, out_sheet='Sheet1', out_fname=''):
+    def __init__(self, in_fname, format_fname, out_sheet='Sheet1', out_fname='', profile=False, cache_dir=DEFAULT_CACHE_DIR,
+                 write_only=True, memo_size=DEFAULT_MEMO_SIZE, workers=1, program=None, format_module=None):
 
         self.in_fname = in_fname
 
+        # Records the time, rows and memory of loading, of each instruction and of saving
+        self.profiler = StageProfiler(in_fname, enabled=profile)
+
         self.in_fname_prefix, self.in_type = os.path.splitext(in_fname)
         self.in_type = self.in_type.lstrip('.')
 
         self.out_fname_prefix, self.out_type = os.path.splitext(out_fname)
         self.out_type = self.out_type.lstrip('.')
 
+        # Compressed outputs like out.csv.gz have the out_type 'csv.gz'
+        if self.out_type == 'gz':
+            self.out_fname_prefix, inner_type = os.path.splitext(self.out_fname_prefix)
+            self.out_type = inner_type.lstrip('.') + '.gz'
+            if inner_type.lstrip('.') not in DELIMITERS:
+                print('Only .csv and .tsv outputs can be compressed, not {}'.format(out_fname))
+                sys.exit(-1)
+
         if not self.out_fname_prefix or not self.out_type:
             self.out_fname_prefix = self.in_fname_prefix + '_formatted'
             self.out_type = 'xlsx'
 
         self.out_sheet = out_sheet
 
-        with open(format_fname, 'r') as f:
-            self.file_format = f.read()
+        # .xlsx outputs are streamed through a write-only workbook(see writers.write_xlsx),
+        # unless write_only is False - then they are exported by tablib, styling every cell
+        self.write_only = write_only
+
+        # The compiled formats are cached in cache_dir, no caching if it is empty
+        self.cache_dir = cache_dir
+
+        # The result caches of the memoized operations by operation name, each keeps up to memo_size results
+        self.memo_size = memo_size
+        self.memos = {}
 
-        sys.path.append(os.path.dirname(os.path.abspath(format_fname)))
+        # With more than one worker the row operations(do <custom_op_name>) are run over chunks of rows
+        # in a pool of worker processes, started by the first of them
+        self.workers = workers
+        self.pool = None
 
+        # The compiled program and the custom operations module of the format may be passed in
+        # by a caller that keeps them loaded(see server.FormatCache), then they aren't read here
+        if program is None:
+            with open(format_fname, 'r') as f:
+                self.file_format = f.read()
+
+        # The custom operations module and the files named in the format are looked up next to the format
+        self.format_dir = os.path.dirname(os.path.abspath(format_fname))
         self.format_name = os.path.splitext(os.path.basename(format_fname))[0]
 
-        try:
-            self.format_module = importlib.import_module(self.format_name)
-        except:
-            self.format_module = ''
+        if format_module is not None:
+            self.format_module = format_module
+        else:
+            sys.path.append(self.format_dir)
+            try:
+                self.format_module = importlib.import_module(self.format_name)
+            except:
+                self.format_module = ''
 
         if self.in_type in ['xls', 'xlsx']:
             self.file_read_mode = 'rb'
         else:
             self.file_read_mode = 'r'
 
-        with open(in_fname, self.file_read_mode) as f:
-            self.data = Dataset().load(f.read())
+        # The format is compiled before loading, as its skip/header declaration is applied while loading
+        with self.profiler.stage('load_program') as stage:
+            self.program, self.skip_rows = split_skip_rows(program if program is not None else self.load_program())
 
-        if self.in_type in ['xls', 'xlsx']:
-            for i, row in enumerate(self.data):
-                self.data[i] = [int(n) if type(n)==float and n == int(n) else n for n in row]
+        if self.skip_rows and self.in_type not in LOAD_TYPES:
+            print('skip/header declarations are supported for {} files only'.format(', '.join(LOAD_TYPES)))
+            sys.exit(-1)
+
+        with self.profiler.stage('load', 0) as stage:
+            if self.in_type in LOAD_TYPES:
+                self.data = load_dataset(in_fname, self.in_type, self.skip_rows)
+            else:
+                with open(in_fname, self.file_read_mode) as f:
+                    self.data = Dataset().load(f.read())
+
+            stage['rows_out'] = len(self.data)
 
 
     def preprocess_dates(self, cols):
-        for i, row in enumerate(self.data.dict):
-            for col in cols:
-                if not row[col]:
-                    continue
+        '''
+        Convert the declared date columns into datetimes, a column at a time, see convert_dates()
+        '''
+        for col in cols:
+            convert_dates(self.data._data, self.data.headers.index(col), self.in_type)
 
-                try:
-                    if self.in_type in ['xls', 'xlsx']:
-                        row[col] = xldate.xldate_as_datetime(row[col], 0)
-                    else:
-                        row[col] = maya.when(row[col]).datetime().replace(tzinfo=None)
-                except:
-                    row[col] = maya.when(row[col]).datetime().replace(tzinfo=None)
 
-                self.data[i] = list(row.values())
+    def run_row_steps(self, steps):
+        '''
+        Run every row through the row steps in a single pass -
+        each row is made into a dict once, passed through all the steps and written back once.
+
+        A row step is step(row dict, row number) that returns the modified row dict
+        '''
+        if not steps:
+            return
+
+        headers = self.data.headers
+        for i, values in enumerate(self.data):
+            row = OrderedDict(zip(headers, values))
+            for step in steps:
+                row = step(row, i)
+            self.data[i] = list(row.values())
 
 
     def new_col(self, col_name):
@@ -183,27 +453,41 @@ class TransTab(object):
         self.delete_col(col_name)
         self.data.insert_col(pos, lambda x: '', header=col_name)
 
-    def delete_rows_by_column_val(self, col_name, val):
-        arr = self.data[col_name]
-        removed_count = 0
-        for ind in range(0, len(arr)):
-            if val == '':
-                if arr[ind] == val:
-                    del self.data[ind-removed_count]
-                    removed_count += 1    
-            else:
-                if val in arr[ind]:
-                    del self.data[ind-removed_count]
-                    removed_count += 1
+    def delete_rows_by_column_val(self, col_name, val, match='contains'):
+        '''
+        Delete the rows whose col_name cell matches val, see cell_matcher() for the kinds of match.
+        For 'in-file', val is the path(relative to the format) of a file with one value per line.
+        The cells are matched as text(an empty cell is ''), once per distinct cell value(see filter_rows)
+        '''
+        if match == 'in-file':
+            val = self.read_values(val)
+            match = 'in'
+
+        matches = cell_matcher(match, val)
+        pos = self.data.headers.index(col_name)
+
+        self.data._data[:] = filter_rows(self.data._data, pos, lambda cell: not matches('' if cell is None else str(cell)))
+
+
+    def read_values(self, fname):
+        '''
+        The non empty lines of a file, whose path is relative to the format file
+        '''
+        path = os.path.join(self.format_dir, fname)
+        try:
+            with open(path, 'r') as f:
+                return [line.strip() for line in f if line.strip()]
+        except OSError as e:
+            print('Could not read the values file {}: {}'.format(path, e))
+            sys.exit(-1)
 
     def delete_row(self, n):
         n = n - 2
         if n == -1:
-            new_data = Dataset()
-            new_data.headers = self.data[0]
-            for row in self.data[1:]:
-                new_data.append(row)
-            self.data = new_data
+            # The first data row becomes the header row, the rows stay where they are
+            headers = list(self.data[0])
+            del self.data._data[0]
+            self.data.headers = headers
         else:
             del self.data[n]
 
@@ -250,22 +534,30 @@ class TransTab(object):
         if dest_col not in self.data.headers:
             self.new_col(dest_col)
 
-        for i, row in enumerate(self.data.dict):
+        self.run_row_steps([self.concatenate_step(src_cols, dest_col, join_str)])
+
+
+    def concatenate_step(self, src_cols, dest_col, join_str):
+        def step(row, row_num):
             row[dest_col] = join_str.join([str(row[c]) for c in src_cols])
-            self.data[i] = list(row.values())
+            return row
+        return step
 
 
     def replace(self, col_name, kv_map, has_default, default_val, case_insensitive):
+        '''
+        Replace the cells of col_name by their value in kv_map, looked up once per distinct cell value(see map_column)
+        '''
         pos = self.data.headers.index(col_name)
 
         if case_insensitive:
-            val = (i.lower() for i in self.data[col_name])
             kv_map = {k.lower(): v for k, v in kv_map.items()}
-        else:
-            val = (i for i in self.data[col_name])
 
-        self.delete_col(col_name)
-        self.data.insert_col(pos, lambda row: kv_map.get(str(next(val)), default_val) if has_default else kv_map[str(next(val))], header=col_name)
+        def replacement(cell):
+            key = str(cell.lower() if case_insensitive else cell)
+            return kv_map.get(key, default_val) if has_default else kv_map[key]
+
+        map_column(self.data._data, pos, replacement)
 
 
     def delete_duplicates(self, col_name=''):
@@ -278,28 +570,101 @@ class TransTab(object):
 
 
     def sum_delete_duplicates(self, sum_col, unique_col):
-        unique_val_sum = {}
-        unique_val_row1 = {}
+        '''
+        Keep the first row of each unique_col value, with sum_col set to the sum of sum_col over all its rows
+        The rows are aggregated in one pass, with the first rows kept in a dict by unique_col value(in the order seen)
+        '''
+        sum_pos = self.data.headers.index(sum_col)
+        unique_pos = self.data.headers.index(unique_col)
+        first_rows = {}
 
-        # Collect sum of sum_cols per unique_col and also the first row number per unique col value
-        for i, row in enumerate(self.data.dict):
-            sum_col_val = row[sum_col]
-            unique_col_val = row[unique_col]
+        for row in self.data._data:
+            unique_col_val = row[unique_pos]
 
-            if unique_col_val in unique_val_sum:
-                unique_val_sum[unique_col_val] += sum_col_val
+            if unique_col_val in first_rows:
+                first_rows[unique_col_val][sum_pos] += row[sum_pos]
             else:
-                unique_val_sum[unique_col_val] = sum_col_val
-                unique_val_row1[unique_col_val] = i
+                first_rows[unique_col_val] = row
+
+        self.data._data[:] = list(first_rows.values())
 
-        # Set the sum for each unique col value in the respective first occurrence rows
-        for unique_col_val in unique_val_row1:
-            first_row_num = unique_val_row1[unique_col_val]
-            row = self.data.dict[first_row_num]
-            row[sum_col] = unique_val_sum[unique_col_val]
-            self.data[first_row_num] = list(row.values())
 
-        self.delete_duplicates(unique_col)
+    def group_by(self, key_cols, aggregates):
+        '''
+        Keep the first row of each combination of key_cols values, with the aggregates of the group's rows
+        stored in their out_col(a new column if it doesn't exist). The rows are aggregated in one pass,
+        with the groups kept in a dict by key(in the order seen).
+
+        sum, min and max skip empty cells and are '' when all the cells of the group are empty.
+        They aggregate the numbers in text cells as numbers, a text that isn't a number is an error.
+        first is the value in the first row and count the number of rows of the group
+        '''
+        headers = list(self.data.headers)
+        key_pos = [headers.index(col_name) for col_name in key_cols]
+
+        out_cols = [agg['out_col'] for agg in aggregates]
+        duplicates = sorted(set(col for col in out_cols if out_cols.count(col) > 1))
+        if duplicates:
+            print('group-by: more than one aggregate stored in {}, rename them with: as <col_name>'.format(
+                ', '.join("'{}'".format(col) for col in duplicates)))
+            sys.exit(-1)
+
+        new_cols = [col for col in out_cols if col not in headers]
+        out_headers = headers + new_cols
+
+        # (func, position read in the rows, position written in the output rows)
+        aggs = [(agg['func'], headers.index(agg['col_name']) if agg['col_name'] else None, out_headers.index(agg['out_col']))
+                for agg in aggregates]
+
+        # first is read from the first row of the group when the output is made, the others are updated on every row
+        running = [(i, func, pos) for i, (func, pos, out_pos) in enumerate(aggs) if func != 'first']
+
+        # key -> [first row, aggregated value of each aggregate]
+        groups = {}
+
+        for row in self.data._data:
+            key = tuple(row[pos] for pos in key_pos)
+            group = groups.get(key)
+
+            if group is None:
+                groups[key] = group = [row, [0 if func == 'count' else None for func, pos, out_pos in aggs]]
+
+            values = group[1]
+            for i, func, pos in running:
+                if func == 'count':
+                    values[i] += 1
+                    continue
+
+                val = row[pos]
+                if val is not None and val != '':
+                    try:
+                        val = text_to_number(val)
+                    except ValueError:
+                        print('group-by: {} \'{}\' did not contain a numerical value. Value: "{}"'.format(func, headers[pos], val))
+                        sys.exit(-1)
+
+                    if values[i] is None:
+                        values[i] = val
+                    elif func == 'sum':
+                        values[i] += val
+                    elif func == 'min':
+                        if val < values[i]:
+                            values[i] = val
+                    elif val > values[i]:
+                        values[i] = val
+
+        new_data = Dataset(headers=out_headers)
+        new_data.title = self.data.title
+        for first_row, values in groups.values():
+            out_row = list(first_row) + [''] * len(new_cols)
+            for (func, pos, out_pos), val in zip(aggs, values):
+                if func == 'first':
+                    out_row[out_pos] = first_row[pos]
+                else:
+                    out_row[out_pos] = '' if val is None else val
+            new_data.append(out_row)
+
+        self.data = new_data
 
 
     def get_custom_func(self, name):
@@ -326,19 +691,28 @@ class TransTab(object):
 
     def do_custom_operation(self, op, quit_on_error=False):
         '''
-        This operates on a single column. 
-        Done when there is an instruction of the kind: do <custom_op_name> on <col_name>
+        This operates on entire rows.
+        Done when there is an instruction of the kind: do <custom_op_name>
 
         The custom function executed by passing the following parameters:
         the row dict, row number, flag whether to quit if there is an error.
 
         It expects the modified row dict as the return value which will be assigned back to the main data.
         '''
-        for i, row in enumerate(self.data.dict):
-            self.data[i] = list(op(row, i, quit_on_error).values())
+        if is_vectorized(op):
+            print('{} is a vectorized operation, it has to be done on a column: do {} on <col_name>'.format(op.__name__, op.__name__))
+            sys.exit(-1)
+
+        self.run_row_steps([self.custom_operation_step(op, quit_on_error)])
+
 
+    def custom_operation_step(self, op, quit_on_error=False):
+        def step(row, row_num):
+            return op(row, row_num, quit_on_error)
+        return step
 
-    def do_custom_operation_col(self, op, col_name, quit_on_error=False):
+
+    def do_custom_operation_col(self, op, col_name, quit_on_error=False, memo=None):
         '''
         This operates on a single column. 
         Done when there is an instruction of the kind: do <custom_op_name> on <col_name>
@@ -347,85 +721,364 @@ class TransTab(object):
         the cell value, row dict, row number, column number, flag whether to quit if there is an error.
 
         It expects the modified vell value as the return value which will be assigned back to the column in main data.
+
+        A vectorized operation(see columns.vectorized) is called once, with the values of the whole column.
+        A memoized operation(do <custom_op_name> on <col_name> memoize) is a function of the cell value only,
+        its results are kept in memo(an LRUCache) and it is called only for the values that aren't in it
         '''
-        for i, row in enumerate(self.data.dict):
-            row[col_name] = op(row[col_name], row, i, col_name, quit_on_error)
-            self.data[i] = list(row.values())
+        if is_vectorized(op):
+            self.do_vectorized_operation_col(op, col_name, quit_on_error, memo)
+        elif memo is not None:
+            self.do_memoized_operation_col(op, col_name, quit_on_error, memo)
+        else:
+            self.run_row_steps([self.custom_operation_col_step(op, col_name, quit_on_error)])
 
 
-    def transform(self):
-        for f_cmd in GRAMMAR.parseString(self.file_format):
-            if f_cmd.decl == 'dates':
-                self.preprocess_dates(f_cmd.cols)
+    def do_vectorized_operation_col(self, op, col_name, quit_on_error=False, memo=None):
+        pos = self.data.headers.index(col_name)
+        rows = self.data._data
 
-            elif f_cmd.op == 'new':
-                self.new_col(f_cmd.col_name)
+        if memo is None:
+            values = self.call_vectorized(op, [row[pos] for row in rows], col_name, quit_on_error)
+            for row, value in zip(rows, values):
+                row[pos] = value
+            return
 
-            elif f_cmd.op == 'clear':
-                self.clear_col(f_cmd.col_name)
+        # The operation is called once, with the distinct values that aren't cached
+        codes, values = encode_column([row[pos] for row in rows])
+        results, missing = memo.lookup_column(codes, values)
 
-            elif f_cmd.op == 'delete':
-                if f_cmd.row:
-                    self.delete_row(f_cmd.row_num)
-                else:
-                    self.delete_col(f_cmd.col_name)
+        missing_results = self.call_vectorized(op, [values[code] for code in missing], col_name, quit_on_error)
+        for code, result in zip(missing, missing_results):
+            results[code] = result
+            memo.add(values[code], result)
 
-            elif f_cmd.op == 'drop':
-                self.drop()
+        for row, code in zip(rows, codes):
+            row[pos] = results[code]
 
-            elif f_cmd.op == 'rename':
-                self.rename_col(f_cmd.col_name, f_cmd.new_name)
 
-            elif f_cmd.op == 'copy':
-                self.copy_col(f_cmd.src_col, f_cmd.dest_col)
+    def call_vectorized(self, op, values, col_name, quit_on_error):
+        if not values:
+            return []
 
-            elif f_cmd.op == 'cutpaste':
-                self.cutpaste_col(f_cmd.src_col, f_cmd.dest_col)
+        results = op(values, col_name, quit_on_error)
 
-            elif f_cmd.op == 'concatenate':
-                self.concatenate_col(f_cmd.src_cols, f_cmd.dest_col, f_cmd.join_str)
+        if len(results) != len(values):
+            print('{} returned {} values for {} values of {}'.format(op.__name__, len(results), len(values), col_name))
+            sys.exit(-1)
 
-            elif f_cmd.op == 'replace':
-                self.replace(f_cmd.col_name, f_cmd.kv_map, f_cmd.has_default, f_cmd.default_val, f_cmd.case_insensitive)
+        return results
 
-            elif f_cmd.op == 'delete-duplicate-rows':
-                self.delete_duplicates(f_cmd.col_name)
 
-            elif f_cmd.op == 'delete-rows-by-column-val':
-                self.delete_rows_by_column_val(f_cmd.col, f_cmd.val)
+    def do_memoized_operation_col(self, op, col_name, quit_on_error, memo):
+        '''
+        Call the operation once per distinct value of the column that isn't cached, with the first row of the value.
+        No row dicts are made for the other rows
+        '''
+        headers = self.data.headers
+        pos = headers.index(col_name)
+        rows = self.data._data
 
-            elif f_cmd.op == 'sum-col-and-delete-duplicate-rows':
-                self.sum_delete_duplicates(f_cmd.sum_col, f_cmd.unique_col)
+        codes, values = encode_column([row[pos] for row in rows])
+        results, missing = memo.lookup_column(codes, values)
 
-            elif f_cmd.op == 'do' and f_cmd.custom_op_name:
-                func_obj = self.get_custom_func(f_cmd.custom_op_name)
+        if missing:
+            firsts = first_rows(codes, len(values))
+            for code in missing:
+                row_num = firsts[code]
+                results[code] = op(values[code], OrderedDict(zip(headers, rows[row_num])), row_num, col_name, quit_on_error)
+                memo.add(values[code], results[code])
+
+        for row, code in zip(rows, codes):
+            row[pos] = results[code]
+
+
+    def custom_operation_col_step(self, op, col_name, quit_on_error=False):
+        def step(row, row_num):
+            row[col_name] = op(row[col_name], row, row_num, col_name, quit_on_error)
+            return row
+        return step
+
+
+    def custom_step(self, func_obj, instruction):
+        '''
+        The row step of a do instruction that isn't vectorized
+        '''
+        if instruction['col_name']:
+            return self.custom_operation_col_step(func_obj, instruction['col_name'], instruction['quit_on_error'])
+        return self.custom_operation_step(func_obj, instruction['quit_on_error'])
+
+
+    def run_custom_operation(self, func_obj, instruction):
+        if self.in_parallel(func_obj, instruction):
+            self.run_parallel([instruction])
+        elif instruction['col_name']:
+            self.do_custom_operation_col(func_obj, instruction['col_name'], instruction['quit_on_error'],
+                                         self.get_memo(instruction))
+        else:
+            self.do_custom_operation(func_obj, instruction['quit_on_error'])
+
+
+    def in_parallel(self, func_obj, instruction):
+        '''
+        Whether a do instruction runs in the worker processes: row operations do, unless they are
+        declared sequential(see parallel.sequential). Vectorized and memoized operations run on the whole column
+        '''
+        return (self.workers > 1 and not is_vectorized(func_obj) and not instruction.get('memoize')
+                and not is_sequential(func_obj))
+
+
+    def run_parallel(self, instructions):
+        '''
+        Run do instructions over chunks of rows in the worker processes, each worker runs all of them
+        on a chunk(see parallel.run_chunk). The chunks are written back in order as they come back
+        '''
+        if not instructions:
+            return
+
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.workers, initializer=init_worker,
+                                             initargs=(self.format_dir, self.format_name))
+
+        headers = self.data.headers
+        rows = self.data._data
+        chunk_size = max(1, -(-len(rows) // (self.workers * CHUNKS_PER_WORKER)))
+        chunks = ((instructions, headers, [row[:] for row in rows[start:start + chunk_size]], start)
+                  for start in range(0, len(rows), chunk_size))
+
+        i = 0
+        for chunk_rows, exit_code in self.pool.imap(run_chunk, chunks):
+            if chunk_rows is None:
+                self.close_pool()
+                sys.exit(exit_code)
+            for values in chunk_rows:
+                self.data[i] = values
+                i += 1
 
-                if f_cmd.col_name:
-                    self.do_custom_operation_col(func_obj, f_cmd.col_name, f_cmd.quit_on_error)
-                else:
-                    self.do_custom_operation(func_obj, f_cmd.quit_on_error)
 
+    def close_pool(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+
+    def get_memo(self, instruction):
+        '''
+        The result cache of a memoized operation, shared by all its instructions - None if it isn't memoized
+        '''
+        if not instruction.get('memoize'):
+            return None
+
+        if not instruction['col_name']:
+            print('do {} memoize: only an operation on a column can be memoized'.format(instruction['custom_op_name']))
+            sys.exit(-1)
+
+        name = instruction['custom_op_name']
+        if name not in self.memos:
+            self.memos[name] = LRUCache(self.memo_size)
+        return self.memos[name]
+
+
+    def memo_stats(self):
+        return {name: (memo.hits, memo.misses) for name, memo in self.memos.items()}
+
+
+    def execute_fused(self, instructions):
+        '''
+        Execute consecutive row-local instructions in as few passes over the rows as possible.
+        A concatenate into a column that doesn't exist yet needs the column added first,
+        and vectorized and memoized operations run on the whole column, so the steps before them are run in a pass of their own.
+        With workers the consecutive operations that run in the worker processes(see in_parallel) make a pass of their own too
+        '''
+        steps = []
+        parallel = []
+
+        for instruction in instructions:
+            if instruction['op'] == 'concatenate':
+                self.run_parallel(parallel)
+                parallel = []
+                if instruction['dest_col'] not in self.data.headers:
+                    self.run_row_steps(steps)
+                    steps = []
+                    self.new_col(instruction['dest_col'])
+                steps.append(self.concatenate_step(instruction['src_cols'], instruction['dest_col'], instruction['join_str']))
+                continue
+
+            func_obj = self.get_custom_func(instruction['custom_op_name'])
+            if is_vectorized(func_obj) or instruction.get('memoize'):
+                self.run_parallel(parallel)
+                parallel = []
+                self.run_row_steps(steps)
+                steps = []
+                self.run_custom_operation(func_obj, instruction)
+            elif self.in_parallel(func_obj, instruction):
+                self.run_row_steps(steps)
+                steps = []
+                parallel.append(instruction)
             else:
-                print("Don't know how to process this instruction: {}".format(f_cmd))
+                self.run_parallel(parallel)
+                parallel = []
+                steps.append(self.custom_step(func_obj, instruction))
+
+        self.run_parallel(parallel)
+        self.run_row_steps(steps)
+
+
+    def load_program(self):
+        return load_program(self.file_format, self.cache_dir)
+
+
+    def transform(self):
+        try:
+            for instructions in plan_program(self.program):
+                name = ' + '.join(instruction_name(instruction) for instruction in instructions)
+                with self.profiler.stage(name, len(self.data)) as stage:
+                    memo_stats = self.memo_stats()
+                    if len(instructions) == 1:
+                        self.execute(instructions[0])
+                    else:
+                        self.execute_fused(instructions)
+                    stage['rows_out'] = len(self.data)
+
+                    # The lookups of the memoized operations during the stage
+                    for memo_name, memo in self.memos.items():
+                        hits, misses = memo_stats.get(memo_name, (0, 0))
+                        hits, misses = memo.hits - hits, memo.misses - misses
+                        if hits or misses:
+                            stage.setdefault('memo', {})[memo_name] = {'hits': hits, 'misses': misses,
+                                                                      'hit_rate': round(hits / (hits + misses), 4)}
+
+            with self.profiler.stage('save', len(self.data)) as stage:
+                self.save()
+                stage['rows_out'] = len(self.data)
+        finally:
+            self.close_pool()
+            self.profiler.stop()
+
+
+    def execute(self, instruction):
+        '''
+        Execute a single instruction of the program, see compile_instruction()
+        '''
+        op = instruction['op']
+
+        if op == 'dates':
+            self.preprocess_dates(instruction['cols'])
+
+        elif op == 'new':
+            self.new_col(instruction['col_name'])
+
+        elif op == 'clear':
+            self.clear_col(instruction['col_name'])
 
-        self.save()
+        elif op == 'delete-row':
+            self.delete_row(instruction['row_num'])
+
+        elif op == 'delete':
+            self.delete_col(instruction['col_name'])
+
+        elif op == 'drop':
+            self.drop()
+
+        elif op == 'rename':
+            self.rename_col(instruction['col_name'], instruction['new_name'])
+
+        elif op == 'copy':
+            self.copy_col(instruction['src_col'], instruction['dest_col'])
+
+        elif op == 'cutpaste':
+            self.cutpaste_col(instruction['src_col'], instruction['dest_col'])
+
+        elif op == 'concatenate':
+            self.concatenate_col(instruction['src_cols'], instruction['dest_col'], instruction['join_str'])
+
+        elif op == 'replace':
+            self.replace(instruction['col_name'], instruction['kv_map'], instruction['has_default'],
+                         instruction['default_val'], instruction['case_insensitive'])
+
+        elif op == 'delete-duplicate-rows':
+            self.delete_duplicates(instruction['col_name'])
+
+        elif op == 'delete-rows-by-column-val':
+            self.delete_rows_by_column_val(instruction['col'], instruction['val'], instruction['match'])
+
+        elif op == 'sum-col-and-delete-duplicate-rows':
+            self.sum_delete_duplicates(instruction['sum_col'], instruction['unique_col'])
+
+        elif op == 'group-by':
+            self.group_by(instruction['key_cols'], instruction['aggregates'])
+
+        elif op == 'do' and instruction['custom_op_name']:
+            self.run_custom_operation(self.get_custom_func(instruction['custom_op_name']), instruction)
+
+        else:
+            print("Don't know how to process this instruction: {}".format(instruction))
 
 
     def save(self):
+        out_fname = self.out_fname_prefix + '.' + self.out_type
+
+        if self.out_type.split('.')[0] in DELIMITERS:
+            write_delimited(self.data, out_fname, self.out_type)
+            return
+
+        if self.out_type == 'xlsx' and self.write_only:
+            # The same sheet name as tablib gives the first sheet without a title
+            write_xlsx(self.data, out_fname, self.out_sheet or 'Sheet0')
+            return
+
         book = Databook()
         self.data.title = self.out_sheet
         book.add_sheet(self.data)
-        with open(self.out_fname_prefix + '.' + self.out_type, 'wb') as f:
+        with open(out_fname, 'wb') as f:
             f.write(book.export(self.out_type))
 
 
+def instruction_name(instruction):
+    '''
+    Short description of an instruction for the profile report, like: do validate_ssn on 'SSN'
+    '''
+    op = instruction['op']
+
+    if op == 'delete-row':
+        return 'delete row {}'.format(instruction['row_num'])
+
+    name = op
+    if op == 'do':
+        name += ' ' + instruction['custom_op_name']
+
+    if op == 'dates':
+        cols = instruction['cols']
+    elif op == 'concatenate':
+        cols = instruction['src_cols']
+    elif op == 'delete-rows-by-column-val':
+        cols = [instruction['col']]
+    elif op == 'group-by':
+        cols = instruction['key_cols']
+    else:
+        cols = [instruction[key] for key in ['col_name', 'src_col', 'sum_col'] if instruction.get(key)]
+
+    if cols:
+        name += ' on ' if op == 'do' else ' '
+        name += ', '.join("'{}'".format(col) for col in cols)
+
+    return name
+
+
 ###############################################################################
 #            To use when Transtab is used by executing this very file         #
 ###############################################################################
 
 def main():
-    in_f, format_fname, out_sheet = process_options()
-    TransTab(in_fname = in_f, format_fname = format_fname, out_sheet=out_sheet).transform()
+    in_f, format_fname, out_f, out_sheet, profile, profile_path, use_cache, workers = process_options()
+    tt = TransTab(in_fname = in_f, format_fname = format_fname, out_sheet=out_sheet, out_fname=out_f, profile=profile,
+                  cache_dir=DEFAULT_CACHE_DIR if use_cache else '', workers=workers)
+    tt.transform()
+
+    if profile:
+        tt.profiler.save(profile_path)
+        tt.profiler.print_table()
 
 if __name__ == '__main__':
     main()
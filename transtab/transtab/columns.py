@@ -0,0 +1,75 @@
+from itertools import compress
+from operator import itemgetter
+
+
+# Cell types that are equal across types(1 == 1.0 == True), a column mixing them is encoded by (type, value)
+NUMBER_TYPES = frozenset([int, float, bool])
+
+
+def encode_column(column):
+    '''
+    Dictionary-encode the cells of a column: return (codes, values) - values are the distinct cells
+    in the order first seen, codes the index in values of each cell.
+    The cells of a column that mixes number types are told apart by their type too, 1 and 1.0 get their own codes
+    '''
+    index = {}
+    codes = [index.setdefault(value, len(index)) for value in column]
+
+    # Only numbers are equal across types, so only a column with numbers needs all its cell types checked
+    if not NUMBER_TYPES.isdisjoint(map(type, index)) and len(NUMBER_TYPES.intersection(map(type, column))) > 1:
+        index = {}
+        codes = [index.setdefault((type(value), value), len(index)) for value in column]
+        return codes, [value for value_type, value in index]
+
+    return codes, list(index)
+
+
+def first_rows(codes, count):
+    '''
+    The index of the first cell of each of the count codes of an encoded column, the codes first appear in order
+    '''
+    firsts = []
+    for i, code in enumerate(codes):
+        if code == len(firsts):
+            firsts.append(i)
+            if len(firsts) == count:
+                break
+    return firsts
+
+
+def map_column(rows, pos, func):
+    '''
+    Set the cell at pos of each row to func(cell), with func called once per distinct cell value
+    '''
+    codes, values = encode_column(list(map(itemgetter(pos), rows)))
+    mapped = [func(value) for value in values]
+
+    for row, code in zip(rows, codes):
+        row[pos] = mapped[code]
+
+
+def filter_rows(rows, pos, predicate):
+    '''
+    The rows whose cell at pos satisfies the predicate, with predicate called once per distinct cell value
+    '''
+    codes, values = encode_column(list(map(itemgetter(pos), rows)))
+    keep = [predicate(value) for value in values]
+
+    return list(compress(rows, map(keep.__getitem__, codes)))
+
+
+def vectorized(func, per_value=None):
+    '''
+    Declare a custom operation as vectorized - do <func> on 'col' then calls it once with the whole column,
+    as func(values, col_name, quit_on_error), and it returns the new values of the column(a sequence as long as values).
+    per_value(value) is the same operation on a single value(func.per_value), for the callers that go a row at a time.
+    The operations that aren't declared this way are called once per row. Formatter's vectorized operations are the same
+    '''
+    func.vectorized = True
+    if per_value is not None:
+        func.per_value = per_value
+    return func
+
+
+def is_vectorized(func):
+    return getattr(func, 'vectorized', False)
@@ -0,0 +1,90 @@
+import datetime
+
+import maya
+from xlrd import xldate
+
+
+# The strptime patterns tried by infer_pattern(), in order
+DATE_PATTERNS = [
+    '%m/%d/%Y', '%m/%d/%y', '%m-%d-%Y', '%Y-%m-%d', '%Y/%m/%d', '%d-%b-%Y', '%d %b %Y', '%b %d, %Y',
+    '%m/%d/%Y %H:%M', '%m/%d/%Y %H:%M:%S', '%m/%d/%Y %I:%M %p', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S'
+]
+
+# Number of distinct values of a column a pattern is checked against
+SAMPLE_SIZE = 20
+
+
+def parse_date(value, in_type):
+    '''
+    Convert a cell of a 'dates' column - xls/xlsx cells are usually xldate numbers,
+    the cells that aren't(and all the csv cells) are parsed by maya.
+    Cells that are datetimes already(xlsx date cells) are kept as they are
+    '''
+    if isinstance(value, datetime.datetime):
+        return value
+
+    if in_type in ['xls', 'xlsx']:
+        try:
+            return xldate.xldate_as_datetime(value, 0)
+        except Exception:
+            pass
+
+    return maya.when(value).datetime().replace(tzinfo=None)
+
+
+def infer_pattern(values):
+    '''
+    Return the one of DATE_PATTERNS that parses the most of the sampled text values, or None if none does.
+    A pattern that parses a value into another datetime than maya does is never used
+    '''
+    sample = [value for value in values if isinstance(value, str) and value][:SAMPLE_SIZE]
+
+    try:
+        expected = [maya.when(value).datetime().replace(tzinfo=None) for value in sample]
+    except Exception:
+        return None
+
+    best_pattern, best_count = None, 0
+
+    for pattern in DATE_PATTERNS:
+        count = 0
+        for value, date in zip(sample, expected):
+            try:
+                parsed = datetime.datetime.strptime(value, pattern)
+            except ValueError:
+                continue
+            if parsed != date:
+                break
+            count += 1
+        else:
+            if count > best_count:
+                best_pattern, best_count = pattern, count
+
+    return best_pattern
+
+
+def convert_dates(rows, pos, in_type):
+    '''
+    Convert the cells at pos of the rows into datetimes in one pass over the column.
+    Each distinct value is parsed once - with the strptime pattern inferred from the column
+    if it matches, or with parse_date() - empty cells are left as they are
+    '''
+    distinct = {}
+    for row in rows:
+        if row[pos]:
+            distinct[row[pos]] = None
+
+    pattern = infer_pattern(distinct)
+
+    for value in distinct:
+        if pattern and isinstance(value, str):
+            try:
+                distinct[value] = datetime.datetime.strptime(value, pattern)
+                continue
+            except ValueError:
+                pass
+        distinct[value] = parse_date(value, in_type)
+
+    for row in rows:
+        if row[pos]:
+            row[pos] = distinct[row[pos]]
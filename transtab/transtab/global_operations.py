@@ -2,40 +2,58 @@ import re
 import sys
 import numbers
 
+from transtab.columns import vectorized
 
-def validate_phone_number(val, row, row_num, col_name, quit_on_error):
+
+_PHONE_NUMBER_PATTERN = re.compile("^[0-9]{10}$")
+_PHONE_NUMBER_SEPARATORS = str.maketrans('', '', '()/ -')
+
+_SSN_PATTERN = re.compile("^[0-9]{9}$")
+_DIGITS_PATTERN = re.compile(r'\d+')
+
+
+def _phone_number(val):
     if not val:
         return ''
 
     if isinstance(val, float):
         val = int(val)
 
-    val = str(val)
-
-    for c in ['(', ')', '/', ' ', '-']:
-        val = val.replace(c, '')
+    val = str(val).translate(_PHONE_NUMBER_SEPARATORS)
 
-    if re.compile("^[0-9]{10}$").match(val):
+    if _PHONE_NUMBER_PATTERN.match(val):
         return val[:3] + '-' + val[3:6] + '-' + val[6:10]
     else:
         return ''
 
 
-def validate_ssn(val, row, row_num, col_name, quit_on_error):
+def _ssn(val):
     if not val:
         return ''
 
     if isinstance(val, float):
         val = int(val)
 
-    val = ''.join(re.findall(r'\d+', str(val)))
+    val = ''.join(_DIGITS_PATTERN.findall(str(val)))
 
-    if re.compile("^[0-9]{9}$").match(val):
+    if _SSN_PATTERN.match(val):
         return val[:3] + '-' + val[3:5] + '-' + val[5:9]
     else:
         return ''
 
 
+def validate_phone_number(values, col_name, quit_on_error):
+    return [_phone_number(val) for val in values]
+
+vectorized(validate_phone_number, per_value=_phone_number)
+
+
+def validate_ssn(values, col_name, quit_on_error):
+    return [_ssn(val) for val in values]
+
+vectorized(validate_ssn, per_value=_ssn)
+
+
 def validate_number(val, row, row_num, col_name, quit_on_error):
     if not val:
         return ''
@@ -52,4 +70,3 @@ def validate_number(val, row, row_num, col_name, quit_on_error):
     print('Error: {} did not contain a numerical value. Value: "{}"'.format(col_name, val))
     print('Row - ', dict(row))
     sys.exit(-1)
-
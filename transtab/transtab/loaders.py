@@ -0,0 +1,72 @@
+import csv
+from itertools import islice
+
+import xlrd
+import openpyxl
+from tablib import Dataset
+
+
+# The input types read by load_dataset(), the other types are loaded by tablib
+LOAD_TYPES = ['csv', 'tsv', 'xls', 'xlsx']
+
+
+def int_if_integral(val):
+    '''
+    Integral floats(xls/xlsx keep every number as a float) are made ints, anything else is kept as it is
+    '''
+    if type(val) == float and val.is_integer():
+        return int(val)
+    return val
+
+
+def iter_sheet_rows(f, in_type, skip_rows=0):
+    '''
+    Return (sheet title, iterator of the rows after the first skip_rows rows) of the open file f.
+    The rows are read as tablib reads them, one at a time - csv lines are parsed as they are read
+    and .xlsx files are opened read-only. The skipped rows are passed over without building their rows
+    '''
+    if in_type in ['csv', 'tsv']:
+        reader = csv.reader(f, delimiter='\t' if in_type == 'tsv' else ',')
+        return None, islice(reader, skip_rows, None)
+
+    if in_type == 'xls':
+        sheet = xlrd.open_workbook(file_contents=f.read()).sheet_by_index(0)
+        return sheet.name, (sheet.row_values(i) for i in range(skip_rows, sheet.nrows))
+
+    sheet = openpyxl.reader.excel.load_workbook(f, read_only=True).active
+
+    if sheet.max_column is None:
+        # Sheets saved without their dimensions(like the write-only output of writers.write_xlsx) give each row
+        # up to its last value only, they are padded with None to the widest row as a not read-only sheet is
+        rows = [[c.value for c in row] for row in sheet.rows]
+        width = max((len(row) for row in rows), default=0)
+        for row in rows:
+            row.extend([None] * (width - len(row)))
+        return sheet.title, iter(rows[skip_rows:])
+
+    return sheet.title, ([c.value for c in row] for row in islice(sheet.rows, skip_rows, None))
+
+
+def load_dataset(in_fname, in_type, skip_rows=0):
+    '''
+    Build the Dataset of the file with the row after the first skip_rows rows as its header row.
+    The integral numbers of xls/xlsx rows(but not of the header row) are made ints as the rows are read
+    '''
+    with open(in_fname, 'rb' if in_type in ['xls', 'xlsx'] else 'r') as f:
+        title, rows = iter_sheet_rows(f, in_type, skip_rows)
+
+        data = Dataset()
+        if title:
+            data.title = title
+
+        headers = next(rows, None)
+        if headers is not None:
+            data.headers = headers
+
+        if in_type in ['xls', 'xlsx']:
+            rows = ([int_if_integral(val) for val in row] for row in rows)
+
+        for row in rows:
+            data.append(row)
+
+    return data
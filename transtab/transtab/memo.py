@@ -0,0 +1,59 @@
+from collections import OrderedDict
+
+
+# Number of results kept by the cache of a memoized operation
+DEFAULT_MEMO_SIZE = 65536
+
+
+class LRUCache(object):
+    '''
+    Bounded cache of the results of a memoized operation(do <op> on <col_name> memoize) by cell value.
+    The least recently used results are evicted first. The values are cached by (type, value), so 1 and 1.0 are apart.
+    hits counts the cells whose result didn't need the operation to be called, misses the ones that did
+    '''
+
+    def __init__(self, maxsize=DEFAULT_MEMO_SIZE):
+        self.maxsize = maxsize
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+
+    def lookup(self, value):
+        '''
+        Return (True, the cached result) or (False, None) if the value isn't cached
+        '''
+        key = (type(value), value)
+        try:
+            result = self.results[key]
+        except KeyError:
+            self.misses += 1
+            return False, None
+
+        self.results.move_to_end(key)
+        self.hits += 1
+        return True, result
+
+
+    def add(self, value, result):
+        self.results[(type(value), value)] = result
+        if len(self.results) > self.maxsize:
+            self.results.popitem(last=False)
+
+
+    def lookup_column(self, codes, values):
+        '''
+        Look up the distinct values of a dictionary-encoded column(see columns.encode_column), return
+        (the results by code - None for the values that aren't cached, the codes of the values that aren't cached).
+        The cells that repeat a value of the column count as hits
+        '''
+        results = [None] * len(values)
+        missing = []
+
+        for code, value in enumerate(values):
+            found, results[code] = self.lookup(value)
+            if not found:
+                missing.append(code)
+
+        self.hits += len(codes) - len(values)
+        return results, missing
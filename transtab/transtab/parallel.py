@@ -0,0 +1,71 @@
+import sys
+import importlib
+from collections import OrderedDict
+
+from transtab import global_operations
+
+
+# Number of row chunks per worker process, more chunks even out the chunks that take longer
+CHUNKS_PER_WORKER = 4
+
+# The custom operations module of the format, imported once per worker process by init_worker()
+_format_module = None
+
+
+def sequential(func):
+    '''
+    Keep a custom operation out of the worker processes of --workers, it then runs in the main process
+    on all the rows in order. For the operations that keep state between rows(counters, previous rows)
+    or that write to the same file
+    '''
+    func.sequential = True
+    return func
+
+
+def is_sequential(func):
+    return getattr(func, 'sequential', False)
+
+
+def init_worker(format_dir, format_name):
+    '''
+    Import the custom operations module of the format, as TransTab does - next to the format file
+    '''
+    global _format_module
+
+    sys.path.append(format_dir)
+    try:
+        _format_module = importlib.import_module(format_name)
+    except Exception:
+        _format_module = None
+
+
+def worker_func(name):
+    if hasattr(_format_module, name):
+        return getattr(_format_module, name)
+    return getattr(global_operations, name)
+
+
+def run_chunk(chunk):
+    '''
+    Run the do instructions over a chunk of rows, as TransTab.run_row_steps does, and return (rows, None).
+    A chunk is (instructions, headers, rows, the number of its first row).
+    An operation that exits(like a validator on bad data) makes it return (None, exit code) instead
+    '''
+    instructions, headers, rows, first_row_num = chunk
+    ops = [(worker_func(instruction['custom_op_name']), instruction['col_name'], instruction['quit_on_error'])
+           for instruction in instructions]
+
+    try:
+        out_rows = []
+        for row_num, values in enumerate(rows, first_row_num):
+            row = OrderedDict(zip(headers, values))
+            for op, col_name, quit_on_error in ops:
+                if col_name:
+                    row[col_name] = op(row[col_name], row, row_num, col_name, quit_on_error)
+                else:
+                    row = op(row, row_num, quit_on_error)
+            out_rows.append(list(row.values()))
+    except SystemExit as e:
+        return None, e.code
+
+    return out_rows, None
@@ -0,0 +1,91 @@
+import sys
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class StageProfiler(object):
+    '''
+    Record the wall time, CPU time, rows in/out and peak memory(from tracemalloc)
+    of the stages of a transformation - loading, each instruction of the format and saving
+
+    A disabled profiler(the default) runs the stages without measuring anything.
+    tracemalloc slows python down noticeably, so the timings of a profiled run
+    are only comparable to other profiled runs
+    '''
+
+    def __init__(self, name='', enabled=False):
+        self.name = name
+        self.enabled = enabled
+        self.stages = []
+        self._started_tracing = False
+
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        '''
+        Measure the code in the 'with' block as the stage 'name'
+        The block can set the row count after the stage with record['rows_out'] = ...
+        peak_memory_bytes is the peak of the memory traced by tracemalloc during the stage,
+        including what was allocated before it
+        '''
+        record = {'stage': name, 'rows_in': rows_in, 'rows_out': None}
+
+        if not self.enabled:
+            yield record
+            return
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        tracemalloc.reset_peak()
+
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+        finally:
+            record['wall_seconds'] = round(time.perf_counter() - wall_start, 6)
+            record['cpu_seconds'] = round(time.process_time() - cpu_start, 6)
+            record['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+            self.stages.append(record)
+
+
+    def stop(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+
+    def report(self):
+        return {
+            'name': self.name,
+            'wall_seconds': round(sum(record['wall_seconds'] for record in self.stages), 6),
+            'cpu_seconds': round(sum(record['cpu_seconds'] for record in self.stages), 6),
+            'peak_memory_bytes': max([record['peak_memory_bytes'] for record in self.stages] or [0]),
+            'stages': self.stages
+        }
+
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=3, default=str)
+
+
+    def print_table(self, file=sys.stderr):
+        row_format = '{:<40} {:>10} {:>10} {:>10} {:>10} {:>12}'
+        print(row_format.format('stage', 'wall s', 'cpu s', 'rows in', 'rows out', 'peak KB'), file=file)
+        for record in self.stages + [dict(self.report(), stage='total', rows_in=None, rows_out=None)]:
+            print(row_format.format(record['stage'][:40],
+                                    '{:.3f}'.format(record['wall_seconds']),
+                                    '{:.3f}'.format(record['cpu_seconds']),
+                                    '' if record['rows_in'] is None else record['rows_in'],
+                                    '' if record['rows_out'] is None else record['rows_out'],
+                                    '{:.1f}'.format(record['peak_memory_bytes'] / 1024)), file=file)
+
+        # The result caches of the memoized operations, by stage
+        for record in self.stages:
+            for name, memo in sorted(record.get('memo', {}).items()):
+                print('{}: {} memo hits {} misses {} hit rate {:.1%}'.format(record['stage'], name, memo['hits'], memo['misses'],
+                                                                           memo['hit_rate']), file=file)
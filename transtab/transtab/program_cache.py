@@ -0,0 +1,55 @@
+import os
+import json
+import hashlib
+import tempfile
+
+
+# Where the compiled formats are cached unless a cache_dir is given
+DEFAULT_CACHE_DIR = os.environ.get('TRANSTAB_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'transtab')
+
+
+def program_path(cache_dir, file_format, version):
+    '''
+    The cache file of a format is named by the hash of its text and of the program version
+    so that an edited format, or a format compiled by another version, is never read back
+    '''
+    key = hashlib.sha256('{}\n{}'.format(version, file_format).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, key + '.json')
+
+
+def read_program(path, version):
+    '''
+    Return the cached program, or None if it isn't cached(or the cache file can't be used)
+    '''
+    try:
+        with open(path, 'r') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if not isinstance(cached, dict) or cached.get('version') != version:
+        return None
+
+    return cached.get('program')
+
+
+def write_program(path, program, version):
+    '''
+    Save the program to the cache. The cache is only an optimisation,
+    so a cache directory that can't be written to is ignored
+    '''
+    try:
+        cache_dir = os.path.dirname(path)
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Written to a temporary file and renamed so that a concurrent run never reads half a file
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    except OSError:
+        return
+
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'version': version, 'program': program}, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        os.remove(tmp_path)
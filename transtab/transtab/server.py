@@ -0,0 +1,350 @@
+import os
+import json
+import time
+import ipaddress
+import threading
+import importlib.util
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from optparse import OptionParser
+
+from transtab.TransTab import TransTab, load_program
+from transtab.program_cache import DEFAULT_CACHE_DIR
+
+
+DEFAULT_PORT = 8765
+
+# Number of formats kept loaded(compiled program and custom operations module)
+DEFAULT_FORMATS = 32
+
+# Number of jobs run at a time, and of the jobs that may wait for them - more jobs are turned away
+DEFAULT_JOBS = 2
+DEFAULT_QUEUE = 16
+
+# The latency stats are computed over the latest jobs
+LATENCY_WINDOW = 1000
+
+
+def file_mtime(path):
+    '''
+    The mtime of the file, None if it doesn't exist
+    '''
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def load_module(name, path):
+    '''
+    Import the custom operations module of a format from its file. It isn't kept in sys.modules,
+    so an edited module is imported anew and the modules of formats with the same name in other directories don't clash
+    '''
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def is_loopback(host):
+    '''
+    Whether the server would only be reachable from this machine when listening on host
+    '''
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def percentiles(values):
+    '''
+    count, mean, p50, p95 and max of the values in seconds
+    '''
+    if not values:
+        return {'count': 0}
+
+    values = sorted(values)
+    at = lambda p: values[int(round(p * (len(values) - 1)))]
+    return {'count': len(values), 'mean': round(sum(values) / len(values), 4), 'p50': round(at(0.5), 4),
+            'p95': round(at(0.95), 4), 'max': round(values[-1], 4)}
+
+
+def transform_job(formats, format_fname, in_fname, out_fname='', out_sheet=None):
+    '''
+    Transform a file with the format loaded by formats(a FormatCache). Return {"status": "done", "output": <path>,
+    "rows": <rows>} or {"status": "failed", "error": <error>} - a failed transform doesn't raise
+    '''
+    try:
+        program, module = formats.get(format_fname)
+        tt = TransTab(in_fname=in_fname, format_fname=format_fname, out_sheet=out_sheet, out_fname=out_fname,
+                      cache_dir=formats.cache_dir, program=program, format_module=module)
+        tt.transform()
+    except SystemExit as e:
+        # The transform printed why it stopped, as transtab does
+        return {'status': 'failed', 'error': 'the transform exited with code {}'.format(e.code)}
+    except Exception as e:
+        return {'status': 'failed', 'error': '{}: {}'.format(type(e).__name__, e)}
+
+    return {'status': 'done', 'output': tt.out_fname_prefix + '.' + tt.out_type, 'rows': len(tt.data)}
+
+
+class FormatCache(object):
+    '''
+    LRU of the loaded formats by path - the compiled program and the custom operations module of each format.
+    A format is loaded again when its file, or the file of its module, has another mtime than when it was loaded
+    '''
+
+    def __init__(self, maxsize=DEFAULT_FORMATS, cache_dir=DEFAULT_CACHE_DIR):
+        self.maxsize = maxsize
+        self.cache_dir = cache_dir
+        self.formats = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+
+    def get(self, format_fname):
+        '''
+        Return (program, custom operations module - '' if the format has none), as TransTab takes them
+        '''
+        path = os.path.abspath(format_fname)
+        module_path = os.path.splitext(path)[0] + '.py'
+        mtimes = (file_mtime(path), file_mtime(module_path))
+
+        with self.lock:
+            entry = self.formats.get(path)
+            if entry is not None and entry[0] == mtimes:
+                self.formats.move_to_end(path)
+                self.hits += 1
+                return entry[1], entry[2]
+            self.misses += 1
+
+        # Loaded outside the lock, so the jobs of the other formats don't wait for it
+        with open(path, 'r') as f:
+            program = load_program(f.read(), self.cache_dir)
+
+        module = ''
+        if mtimes[1] is not None:
+            module = load_module(os.path.splitext(os.path.basename(path))[0], module_path)
+
+        with self.lock:
+            self.formats[path] = (mtimes, program, module)
+            self.formats.move_to_end(path)
+            if len(self.formats) > self.maxsize:
+                self.formats.popitem(last=False)
+
+        return program, module
+
+
+    def stats(self):
+        return {'loaded': len(self.formats), 'hits': self.hits, 'misses': self.misses}
+
+
+class JobStats(object):
+    '''
+    Counts of the jobs by state, and the time the latest jobs waited in the queue and took in all
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.done = 0
+        self.failed = 0
+        self.rejected = 0
+        self.waits = deque(maxlen=LATENCY_WINDOW)
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+
+    def reject(self):
+        with self.lock:
+            self.rejected += 1
+
+
+    def queue(self):
+        with self.lock:
+            self.queued += 1
+
+
+    def start(self, wait):
+        with self.lock:
+            self.queued -= 1
+            self.running += 1
+            self.waits.append(wait)
+
+
+    def finish(self, ok, latency):
+        with self.lock:
+            self.running -= 1
+            if ok:
+                self.done += 1
+            else:
+                self.failed += 1
+            self.latencies.append(latency)
+
+
+    def report(self):
+        with self.lock:
+            return {'queue_depth': self.queued, 'running': self.running, 'done': self.done, 'failed': self.failed,
+                    'rejected': self.rejected, 'wait': percentiles(self.waits), 'latency': percentiles(self.latencies)}
+
+
+class TransformServer(ThreadingHTTPServer):
+    '''
+    Resident transtab: takes jobs over HTTP on localhost and runs them with the formats kept loaded(see FormatCache).
+
+    POST /jobs {"input": <path>, "format": <name or path>, "output": <path>, "sheet": <name>} runs a job and answers
+    when it is done, with {"status": "done", "output": <path>, "rows": <rows>, "seconds": <latency>}
+    or {"status": "failed", "error": <error>}. output and sheet are optional, as -o and -s of transtab.
+    A format name is looked up in formats_dir, .txt is added if it has no extension - a format outside of formats_dir
+    is answered with 400, as its operations module would be run. The input and output paths aren't restricted,
+    so the server must only listen on a loopback address(see is_loopback).
+    jobs jobs are run at a time by a pool of threads, queue_size more may wait - the others are answered with 503.
+
+    GET /stats returns the queue depth, the job counts, the wait and latency percentiles and the format cache counts
+    '''
+    daemon_threads = True
+
+    def __init__(self, address, formats_dir='.', jobs=DEFAULT_JOBS, queue_size=DEFAULT_QUEUE, format_cache=None):
+        super(TransformServer, self).__init__(address, JobHandler)
+        self.formats_dir = formats_dir
+        self.formats = format_cache if format_cache is not None else FormatCache()
+        self.pool = ThreadPoolExecutor(jobs)
+        self.slots = threading.BoundedSemaphore(jobs + queue_size)
+        self.stats = JobStats()
+
+
+    def format_path(self, name):
+        '''
+        The path of the format in formats_dir, None if the name leads out of it(an absolute path, .. or a symlink)
+        '''
+        formats_dir = os.path.realpath(self.formats_dir)
+        path = os.path.join(formats_dir, name)
+        if not os.path.splitext(path)[1]:
+            path += '.txt'
+
+        path = os.path.realpath(path)
+        if os.path.commonpath([formats_dir, path]) != formats_dir:
+            return None
+        return path
+
+
+    def submit(self, job):
+        '''
+        Run the job in the pool and return (HTTP status, result)
+        '''
+        format_fname = self.format_path(job['format'])
+        if format_fname is None:
+            return 400, {'status': 'rejected', 'error': 'the format {} is not in the formats directory'.format(job['format'])}
+
+        if not self.slots.acquire(blocking=False):
+            self.stats.reject()
+            return 503, {'status': 'rejected', 'error': 'the job queue is full'}
+
+        self.stats.queue()
+        result = self.pool.submit(self.run_job, job, format_fname, time.perf_counter()).result()
+        return (200 if result['status'] == 'done' else 500), result
+
+
+    def run_job(self, job, format_fname, submitted):
+        self.stats.start(time.perf_counter() - submitted)
+        try:
+            result = transform_job(self.formats, format_fname, job['input'], job.get('output') or '', job.get('sheet'))
+        finally:
+            self.slots.release()
+
+        latency = time.perf_counter() - submitted
+        self.stats.finish(result['status'] == 'done', latency)
+        result['seconds'] = round(latency, 4)
+        return result
+
+
+    def report(self):
+        report = self.stats.report()
+        report['formats'] = self.formats.stats()
+        return report
+
+
+    def server_close(self):
+        super(TransformServer, self).server_close()
+        self.pool.shutdown()
+
+
+class JobHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self.send_json(200, self.server.report())
+        else:
+            self.send_json(404, {'error': 'unknown path {}'.format(self.path)})
+
+
+    def do_POST(self):
+        if self.path != '/jobs':
+            self.send_json(404, {'error': 'unknown path {}'.format(self.path)})
+            return
+
+        try:
+            job = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or '{}')
+        except ValueError:
+            self.send_json(400, {'error': 'the job is not valid JSON'})
+            return
+
+        if not isinstance(job, dict) or not job.get('input') or not job.get('format'):
+            self.send_json(400, {'error': 'a job needs an input and a format'})
+            return
+
+        self.send_json(*self.server.submit(job))
+
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--host", dest="host", default='127.0.0.1',
+                      help="loopback address to listen on, the jobs may read and write any file", metavar="HOST")
+    parser.add_option("-p", "--port", dest="port", type="int", default=DEFAULT_PORT, help="port to listen on", metavar="PORT")
+    parser.add_option("--formats", dest="formats_dir", default='.',
+                      help="directory the format names of the jobs are looked up in", metavar="DIR")
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=DEFAULT_JOBS,
+                      help="number of jobs run at a time", metavar="N")
+    parser.add_option("--queue", dest="queue_size", type="int", default=DEFAULT_QUEUE,
+                      help="number of jobs that may wait, more are answered with 503", metavar="N")
+    parser.add_option("--format-cache", dest="format_cache", type="int", default=DEFAULT_FORMATS,
+                      help="number of formats kept loaded", metavar="N")
+    parser.add_option("--no-cache", dest="use_cache", action="store_false", default=True,
+                      help="don't keep the compiled formats on disk")
+
+    (options, args) = parser.parse_args()
+
+    if options.jobs < 1 or options.queue_size < 0 or options.format_cache < 1:
+        parser.error('--jobs and --format-cache have to be at least 1, --queue at least 0')
+
+    if not is_loopback(options.host):
+        parser.error('--host has to be a loopback address(like 127.0.0.1): the jobs may read and write any file '
+                     'and run the operations of the formats, they must not be reachable from other machines')
+
+    format_cache = FormatCache(options.format_cache, DEFAULT_CACHE_DIR if options.use_cache else '')
+    server = TransformServer((options.host, options.port), options.formats_dir, options.jobs, options.queue_size,
+                             format_cache)
+
+    print('transtab server on http://{}:{}'.format(*server.server_address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,20 @@
 import sys
 
 from transtab.TransTab import TransTab
+from transtab.program_cache import DEFAULT_CACHE_DIR
 from transtab.utils import process_options
 
 def main():
-    in_f, format_fname, out_sheet = process_options()
+    in_f, format_fname, out_f, out_sheet, profile, profile_path, use_cache, workers = process_options()
 
-    tt = TransTab(in_fname = in_f, format_fname = format_fname, out_sheet=out_sheet)
+    tt = TransTab(in_fname = in_f, format_fname = format_fname, out_sheet=out_sheet, out_fname=out_f, profile=profile,
+                  cache_dir=DEFAULT_CACHE_DIR if use_cache else '', workers=workers)
     tt.transform()
 
+    if profile:
+        tt.profiler.save(profile_path)
+        tt.profiler.print_table()
+
 if __name__ == '__main__':
     main()
     
@@ -4,7 +4,17 @@ def process_options():
     parser = OptionParser()
     parser.add_option("-f", "--format", dest="out_format",help="enter format", metavar="FORMAT")
     parser.add_option("-i", "--input", dest="in_f", help="input file path", metavar="PATH")
+    parser.add_option("-o", "--output", dest="out_f", default='',
+                      help="output file path, its extension(.xlsx, .csv, .tsv, .csv.gz, .tsv.gz) sets the output type", metavar="PATH")
     parser.add_option("-s", "--sheet", dest="out_sheet", help="sheet name", metavar="SHEET_NAME")
+    parser.add_option("--profile", dest="profile", action="store_true", default=False,
+                      help="record the time, CPU time, rows and peak memory of each instruction, printed as a table on stderr")
+    parser.add_option("--profile-report", dest="profile_path", default="profile.json",
+                      help="where to save the profile report as JSON", metavar="PATH")
+    parser.add_option("--no-cache", dest="use_cache", action="store_false", default=True,
+                      help="parse the format even if it was compiled before")
+    parser.add_option("-w", "--workers", dest="workers", type="int", default=1,
+                      help="run the custom row operations over chunks of rows in N worker processes", metavar="N")
 
     (options, args) = parser.parse_args()
 
@@ -16,4 +26,7 @@ def process_options():
     if not options.out_format:
         parser.error('format not provided (-f option)')
 
-    return options.in_f, options.out_format, options.out_sheet
\ No newline at end of file
+    if options.workers < 1:
+        parser.error('--workers has to be at least 1')
+
+    return options.in_f, options.out_format, options.out_f, options.out_sheet, options.profile, options.profile_path, options.use_cache, options.workers
\ No newline at end of file
@@ -0,0 +1,283 @@
+import os
+import json
+import time
+import fnmatch
+import hashlib
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from optparse import OptionParser
+
+from transtab.server import DEFAULT_JOBS, FormatCache, transform_job
+from transtab.program_cache import DEFAULT_CACHE_DIR
+
+
+# Seconds between two scans of the watched directory
+DEFAULT_INTERVAL = 2.0
+
+# Seconds a file's size and mtime have to stay the same before it is taken as completely written
+DEFAULT_SETTLE = 5.0
+
+# Name of the state file in the watched directory
+STATE_FNAME = '.transtab-watch.json'
+
+# Number of (content hash, format) pairs of transformed files kept in the state, the oldest are dropped first
+MAX_HASHES = 100000
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def read_state(path):
+    '''
+    The state of a previous run, an empty state if there is none(or the file can't be used)
+    '''
+    try:
+        with open(path, 'r') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+
+    if not isinstance(state, dict):
+        state = {}
+    state.setdefault('files', {})
+    state.setdefault('hashes', {})
+    return state
+
+
+def write_state(path, state):
+    '''
+    Save the state, written to a temporary file and renamed so that a crash never leaves half a file
+    '''
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.transtab-watch', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        os.remove(tmp_path)
+        raise
+
+
+class Watcher(object):
+    '''
+    Transform the files that land in watch_dir with the format of the first of routes((file pattern, format) pairs)
+    their name matches. The outputs are saved in out_dir as <file name>_formatted.<out_type>, the file name keeps
+    its extension so that a.csv and a.xlsx don't overwrite each other's output.
+
+    A file is sent to the pool of jobs threads once its size and mtime stayed the same for settle seconds.
+    A file with the content(by its sha256) of a file transformed before with the same format is not transformed again.
+    The state file keeps the size and mtime of the files handled and the hashes of the files transformed,
+    so a restarted watcher skips them - the files that landed or were being transformed meanwhile are picked up.
+    It is written once per scan, if anything changed.
+    Only the files directly in watch_dir are watched, not the ones whose name starts with a dot(hidden and partial uploads)
+    '''
+
+    def __init__(self, watch_dir, routes, out_dir, out_type='xlsx', state_fname='', jobs=DEFAULT_JOBS,
+                 settle=DEFAULT_SETTLE, format_cache=None):
+        self.watch_dir = watch_dir
+        self.routes = routes
+        self.out_dir = out_dir
+        self.out_type = out_type
+        self.state_fname = state_fname or os.path.join(watch_dir, STATE_FNAME)
+        self.settle = settle
+        self.formats = format_cache if format_cache is not None else FormatCache()
+        self.pool = ThreadPoolExecutor(jobs)
+
+        self.state = read_state(self.state_fname)
+        self.state_changed = False
+
+        # path: ((size, mtime), when it was first seen with them) of the files that may still be written to
+        self.pending = {}
+
+        # future: (path, (size, mtime), dedupe key) of the files being transformed, see dedupe_key()
+        self.running = {}
+
+
+    def route(self, fname):
+        for pattern, format_fname in self.routes:
+            if fnmatch.fnmatch(fname, pattern):
+                return format_fname
+        return None
+
+
+    def poll(self):
+        '''
+        Scan the directory once: send the files that are completely written to the pool
+        and record the files whose transform is done
+        '''
+        now = time.monotonic()
+        present = set()
+
+        for entry in os.scandir(self.watch_dir):
+            if entry.name.startswith('.') or not entry.is_file():
+                continue
+            format_fname = self.route(entry.name)
+            if format_fname is None:
+                continue
+
+            try:
+                stat = entry.stat()
+            except OSError:
+                # Moved away since the scan
+                continue
+
+            present.add(entry.path)
+            signature = [stat.st_size, stat.st_mtime_ns]
+
+            if self.state['files'].get(entry.path) == signature or self.is_running(entry.path):
+                continue
+
+            seen = self.pending.get(entry.path)
+            if seen is None or seen[0] != signature:
+                self.pending[entry.path] = (signature, now)
+            elif now - seen[1] >= self.settle:
+                del self.pending[entry.path]
+                self.submit(entry.path, signature, format_fname)
+
+        # The files that are gone are forgotten, their hashes are kept
+        for path in [path for path in self.state['files'] if path not in present]:
+            del self.state['files'][path]
+            self.state_changed = True
+        for path in [path for path in self.pending if path not in present]:
+            del self.pending[path]
+
+        self.collect()
+        self.save_state()
+
+
+    def save_state(self):
+        if self.state_changed:
+            write_state(self.state_fname, self.state)
+            self.state_changed = False
+
+
+    def is_running(self, path):
+        return any(running[0] == path for running in self.running.values())
+
+
+    def dedupe_key(self, digest, format_fname):
+        '''
+        A file is a duplicate of a file with the same content transformed with the same format
+        '''
+        return '{} {}'.format(digest, os.path.abspath(format_fname))
+
+
+    def submit(self, path, signature, format_fname):
+        try:
+            key = self.dedupe_key(file_hash(path), format_fname)
+        except OSError as e:
+            print('{}: {}'.format(path, e))
+            return
+
+        duplicate = self.state['hashes'].get(key)
+        if duplicate is None:
+            duplicate = next((running[0] for running in self.running.values() if running[2] == key), None)
+        if duplicate is not None:
+            print('{}: same content and format as {}, not transformed'.format(path, duplicate))
+            self.state['files'][path] = signature
+            self.state_changed = True
+            return
+
+        out_fname = os.path.join(self.out_dir, '{}_formatted.{}'.format(os.path.basename(path), self.out_type))
+        future = self.pool.submit(transform_job, self.formats, format_fname, path, out_fname)
+        self.running[future] = (path, signature, key)
+
+
+    def collect(self, wait=False):
+        '''
+        Record the transforms that are done, or wait for all of them
+        '''
+        done = [future for future in self.running if wait or future.done()]
+        if not done:
+            return
+
+        for future in done:
+            path, signature, key = self.running.pop(future)
+            result = future.result()
+
+            # A failed file isn't transformed again until it is written again
+            self.state['files'][path] = signature
+            if result['status'] == 'done':
+                print('{} -> {}'.format(path, result['output']))
+                self.state['hashes'][key] = path
+                if len(self.state['hashes']) > MAX_HASHES:
+                    del self.state['hashes'][next(iter(self.state['hashes']))]
+            else:
+                print('{}: {}'.format(path, result['error']))
+
+        self.state_changed = True
+
+
+    def run(self, interval=DEFAULT_INTERVAL):
+        try:
+            while True:
+                self.poll()
+                time.sleep(interval)
+        finally:
+            self.close()
+
+
+    def close(self):
+        self.collect(wait=True)
+        self.save_state()
+        self.pool.shutdown()
+
+
+def main():
+    parser = OptionParser(usage='%prog -d DIR -r PATTERN=FORMAT [-r PATTERN=FORMAT ...]')
+    parser.add_option("-d", "--dir", dest="watch_dir", help="directory to watch", metavar="DIR")
+    parser.add_option("-r", "--route", dest="routes", action="append", default=[],
+                      help="transform the files whose name matches PATTERN(like clients_*.xlsx) with FORMAT, "
+                           "the first route that matches is used", metavar="PATTERN=FORMAT")
+    parser.add_option("-o", "--out-dir", dest="out_dir", help="where the outputs are saved, default: DIR/formatted",
+                      metavar="DIR")
+    parser.add_option("-t", "--out-type", dest="out_type", default='xlsx',
+                      help="output type: xlsx, csv, tsv, csv.gz or tsv.gz", metavar="TYPE")
+    parser.add_option("--state", dest="state_fname", default='',
+                      help="state file, default: DIR/" + STATE_FNAME, metavar="PATH")
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=DEFAULT_JOBS,
+                      help="number of files transformed at a time", metavar="N")
+    parser.add_option("--interval", dest="interval", type="float", default=DEFAULT_INTERVAL,
+                      help="seconds between two scans of the directory", metavar="SECONDS")
+    parser.add_option("--settle", dest="settle", type="float", default=DEFAULT_SETTLE,
+                      help="seconds a file has to stay unchanged before it is transformed", metavar="SECONDS")
+    parser.add_option("--no-cache", dest="use_cache", action="store_false", default=True,
+                      help="don't keep the compiled formats on disk")
+
+    (options, args) = parser.parse_args()
+
+    if not options.watch_dir:
+        parser.error('directory to watch not provided (-d option)')
+
+    if not options.routes:
+        parser.error('no route provided (-r option)')
+
+    routes = []
+    for route in options.routes:
+        pattern, sep, format_fname = route.partition('=')
+        if not sep or not pattern or not format_fname:
+            parser.error('a route is PATTERN=FORMAT, not {}'.format(route))
+        routes.append((pattern, format_fname))
+
+    if options.jobs < 1:
+        parser.error('--jobs has to be at least 1')
+
+    out_dir = options.out_dir or os.path.join(options.watch_dir, 'formatted')
+    os.makedirs(out_dir, exist_ok=True)
+
+    watcher = Watcher(options.watch_dir, routes, out_dir, options.out_type, options.state_fname, options.jobs,
+                      options.settle, FormatCache(cache_dir=DEFAULT_CACHE_DIR if options.use_cache else ''))
+
+    print('watching {}'.format(options.watch_dir))
+    try:
+        watcher.run(options.interval)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
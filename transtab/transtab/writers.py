@@ -0,0 +1,82 @@
+import os
+import csv
+import gzip
+
+import openpyxl
+from openpyxl.writer.write_only import WriteOnlyCell
+
+
+def xlsx_cell_value(val):
+    '''
+    The value written for a cell, the same as tablib_patch.dset_sheet writes -
+    numbers as they are, anything else as text
+    '''
+    if isinstance(val, (int, float)):
+        return val
+    return str(val)
+
+
+def write_xlsx(dataset, path, sheet_name, freeze_panes=True):
+    '''
+    Save the dataset as .xlsx, streaming the rows through a write-only workbook.
+    Only the header row is styled(bold, frozen), text with line breaks is wrapped
+    '''
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(title=sheet_name)
+
+    if dataset.headers:
+        if freeze_panes:
+            ws.freeze_panes = 'A2'
+
+        bold = openpyxl.styles.Font(bold=True)
+        header = []
+        for col in dataset.headers:
+            cell = WriteOnlyCell(ws, value=str(col))
+            cell.font = bold
+            header.append(cell)
+        ws.append(header)
+
+    wrap_text = openpyxl.styles.Alignment(wrap_text=True)
+
+    for row in dataset._data:
+        values = [xlsx_cell_value(val) for val in row]
+
+        for i, val in enumerate(values):
+            if isinstance(val, str) and '\n' in val:
+                values[i] = WriteOnlyCell(ws, value=val)
+                values[i].alignment = wrap_text
+
+        ws.append(values)
+
+    wb.save(path)
+
+
+# The delimited output types written by write_delimited(), a .gz suffix compresses them
+DELIMITERS = {'csv': ',', 'tsv': '\t'}
+
+
+def write_delimited(dataset, path, out_type):
+    '''
+    Save the dataset as .csv/.tsv(out_type 'csv', 'tsv', 'csv.gz' or 'tsv.gz'), writing the rows
+    straight to the file as they are formatted - None is written as an empty cell, like tablib does.
+    The file is written as <path>.part and renamed when complete
+    '''
+    delimiter = DELIMITERS[out_type.split('.')[0]]
+    part_path = path + '.part'
+
+    if out_type.endswith('.gz'):
+        f = gzip.open(part_path, 'wt', newline='')
+    else:
+        f = open(part_path, 'w', newline='')
+
+    try:
+        with f:
+            writer = csv.writer(f, delimiter=delimiter)
+            if dataset.headers:
+                writer.writerow(dataset.headers)
+            writer.writerows(dataset._data)
+    except BaseException:
+        os.remove(part_path)
+        raise
+
+    os.replace(part_path, path)